@@ -12,6 +12,8 @@ import hmac
 import hashlib
 import time
 import logging
+import threading
+from collections import OrderedDict
 from functools import wraps
 from bottle import request, abort, response
 
@@ -153,53 +155,161 @@ def require_basic_auth(f):
     return decorated
 
 
-def basic_auth_plugin(callback):
+SESSION_MAX_AGE = 86400  # 24 hours
+SESSION_CACHE_SIZE = 256
+SESSION_CACHE_TTL = 300  # seconds a verified cookie is trusted without re-checking
+
+
+class SessionCache(object):
+    """
+    Bounded cache of session tokens that already passed verification, so
+    repeat requests skip the base64 decode and HMAC. Entries never outlive
+    the token itself.
+    """
+
+    def __init__(self, maxsize=SESSION_CACHE_SIZE, ttl=SESSION_CACHE_TTL):
+        self._maxsize = maxsize
+        self._ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, token):
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is None:
+                return None
+            username, expires = entry
+            if time.time() >= expires:
+                del self._entries[token]
+                return None
+            self._entries.move_to_end(token)
+            return username
+
+    def put(self, token, username, token_expires):
+        with self._lock:
+            self._entries[token] = (username, min(time.time() + self._ttl, token_expires))
+            self._entries.move_to_end(token)
+            while len(self._entries) > self._maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class BasicAuthPlugin(object):
     """
     Bottle plugin that applies Basic Authentication with cookie sessions to all routes.
-    
-    Install with:
-        from bottle import install
-        install(basic_auth_plugin)
+
+    The cookie secret and credentials are read once, when the plugin is
+    installed, rather than on every request. Routes can opt out with bottle's
+    `skip` mechanism, and paths under `public_prefixes` are never checked:
+
+        install(BasicAuthPlugin(public_prefixes=('/static/',)))
+
+        @get('/health', skip=['basic_auth'])
+        def health():
+            return "ok"
     """
-    def wrapper(*args, **kwargs):
-        secret = get_cookie_secret()
-        
-        # Check for valid session cookie first
-        auth_cookie = request.get_cookie('auth_session')
-        if auth_cookie:
-            username = verify_auth_token(auth_cookie, secret)
-            if username:
-                # Valid session, proceed
+    name = 'basic_auth'
+    api = 2
+
+    def __init__(self, public_prefixes=(), max_age_seconds=SESSION_MAX_AGE,
+                 cache_size=SESSION_CACHE_SIZE, cache_ttl=SESSION_CACHE_TTL):
+        self.public_prefixes = tuple(public_prefixes)
+        self.max_age_seconds = max_age_seconds
+        self.sessions = SessionCache(cache_size, cache_ttl)
+        self._secret = None
+        self._mac = None
+        self._credentials = None
+
+    def setup(self, app):
+        self.configure()
+
+    def configure(self):
+        """(Re)read secret and credentials from the environment."""
+        self._secret = get_cookie_secret()
+        # keyed once, copied per verification
+        self._mac = hmac.new(self._secret.encode('utf-8'), digestmod=hashlib.sha256)
+        self._credentials = get_auth_credentials()
+        self.sessions.clear()
+
+    def verify(self, token):
+        """Same checks as verify_auth_token, against the installed secret."""
+        username = self.sessions.get(token)
+        if username is not None:
+            return username
+
+        try:
+            decoded = base64.b64decode(token.encode('utf-8')).decode('utf-8')
+            parts = decoded.split(':')
+            if len(parts) != 3:
+                return None
+            username, timestamp, signature = parts
+            token_time = int(timestamp)
+        except (ValueError, TypeError, UnicodeDecodeError):
+            return None
+
+        expires = token_time + self.max_age_seconds
+        if time.time() > expires:
+            return None
+
+        mac = self._mac.copy()
+        mac.update(f"{username}:{timestamp}".encode('utf-8'))
+        if not hmac.compare_digest(signature, mac.hexdigest()):
+            return None
+
+        self.sessions.put(token, username, expires)
+        return username
+
+    def apply(self, callback, route=None):
+        if self._secret is None:
+            # used without install()
+            self.configure()
+
+        def wrapper(*args, **kwargs):
+            if self.public_prefixes and request.path.startswith(self.public_prefixes):
                 return callback(*args, **kwargs)
-        
-        # No valid session, check Basic auth
-        auth_header = request.environ.get('HTTP_AUTHORIZATION')
-        provided_username, provided_password = parse_basic_auth(auth_header)
-        
-        # Get expected credentials
-        expected_username, expected_password = get_auth_credentials()
-        
-        # Check if credentials match
-        if (provided_username == expected_username and 
-            provided_password == expected_password):
-            # Create and set session cookie
-            token = create_auth_token(provided_username, secret)
-            response.set_cookie(
-                'auth_session', 
-                token, 
-                max_age=86400,  # 24 hours
-                httponly=True,
-                secure=False,  # Set to True when using HTTPS
-                path='/'
-            )
-            return callback(*args, **kwargs)
-        
-        # Authentication failed - send 401 with WWW-Authenticate header
-        response.status = 401
-        response.headers['WWW-Authenticate'] = 'Basic realm="Authentication Required"'
-        return "Authentication required"
-    
-    return wrapper
+
+            # Check for valid session cookie first
+            auth_cookie = request.get_cookie('auth_session')
+            if auth_cookie and self.verify(auth_cookie):
+                return callback(*args, **kwargs)
+
+            # No valid session, check Basic auth
+            auth_header = request.environ.get('HTTP_AUTHORIZATION')
+            provided_username, provided_password = parse_basic_auth(auth_header)
+            expected_username, expected_password = self._credentials
+
+            if (provided_username == expected_username and
+                provided_password == expected_password):
+                # Create and set session cookie
+                token = create_auth_token(provided_username, self._secret)
+                response.set_cookie(
+                    'auth_session',
+                    token,
+                    max_age=self.max_age_seconds,
+                    httponly=True,
+                    secure=False,  # Set to True when using HTTPS
+                    path='/'
+                )
+                return callback(*args, **kwargs)
+
+            # Authentication failed - send 401 with WWW-Authenticate header
+            response.status = 401
+            response.headers['WWW-Authenticate'] = 'Basic realm="Authentication Required"'
+            return "Authentication required"
+
+        return wrapper
+
+    def __call__(self, callback):
+        return self.apply(callback)
+
+
+# Install with:
+#     from bottle import install
+#     install(basic_auth_plugin)
+basic_auth_plugin = BasicAuthPlugin()
 
 
 def logout_route():
@@ -0,0 +1,69 @@
+"""
+Benchmark mark_bookings against a history of thousands of bookings.
+
+    python -m benchmarks.bench_bookings --bookings 5000
+"""
+import argparse
+import copy
+import random
+import shutil
+import tempfile
+import time
+
+import tokens
+from bookings import rebuild_booking_index
+from storage import Storage
+from web import mark_bookings
+
+
+def _plan(n: int) -> dict:
+    return {
+        f"LB{i:02d}": {'slug': f"LB{i:02d}", 'schedule_id': str(1400000 + i)}
+        for i in range(n)
+    }
+
+
+def _legacy_mark_bookings(plan, s: Storage):
+    for row in plan.values():
+        _, booking = s.latest('book', {'scheduled_id': row['schedule_id']})
+        if booking:
+            row['scheduled'] = True
+
+
+def _timed(fn, *args):
+    start = time.perf_counter()
+    fn(*args)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--bookings', type=int, default=5000)
+    parser.add_argument('--plan-size', type=int, default=12)
+    args = parser.parse_args()
+
+    root = tempfile.mkdtemp()
+    try:
+        s = Storage(root)
+        start = time.time() - 365 * 24 * 60 * 60
+        for i in range(args.bookings):
+            s.put(tokens.generate_token('book', timestamp=start + i * 3600), {
+                'status': 1,
+                'scheduled_id': str(1300000 + random.randrange(args.bookings)),
+            })
+        plan = _plan(args.plan_size)
+
+        legacy = _timed(_legacy_mark_bookings, copy.deepcopy(plan), s)
+        rebuild = _timed(rebuild_booking_index, s)
+        indexed = _timed(mark_bookings, copy.deepcopy(plan), s)
+
+        print(f"bookings={args.bookings} plan_size={args.plan_size}")
+        print(f"  legacy per-row latest: {legacy * 1000:10.2f} ms")
+        print(f"  index rebuild:         {rebuild * 1000:10.2f} ms")
+        print(f"  indexed mark_bookings: {indexed * 1000:10.2f} ms")
+    finally:
+        shutil.rmtree(root)
+
+
+if __name__ == '__main__':
+    main()
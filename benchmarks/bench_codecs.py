@@ -0,0 +1,117 @@
+"""
+Storage put/get/list throughput and on-disk size for each installed codec,
+on synthetic plan, sched, book and http objects.
+
+    python -m benchmarks.bench_codecs --objects 500 [--json]
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import string
+import tempfile
+import time
+
+import serializers
+import tokens
+from storage import Storage
+
+
+def _class(i: int) -> dict:
+    return {
+        'slug': f"LB{i:02d}",
+        'schedule_id': str(1400000 + i),
+        'event_id': str(900000 + i),
+        'name': f"LB{i:02d} | Live Ball {i} | Coach",
+        'instructor': 'Coach',
+        'location': 'Court 3',
+        'duration': 90,
+        'timestamp': time.time() + i * 3600,
+        'scheduled': i % 3 == 0,
+    }
+
+
+def _text(n: int) -> str:
+    return ''.join(random.choices(string.ascii_letters + string.digits + ' <>/="', k=n))
+
+
+def _http() -> dict:
+    headers = {f"X-Header-{i}": _text(30) for i in range(12)}
+    return {
+        'time': time.time(),
+        'duration': random.random(),
+        'request': {'method': 'GET', 'headers': headers, 'url': 'https://example.com/member/classes', 'body': 'None'},
+        'response': {'status': 200, 'headers': headers, 'body': _text(200_000)},
+    }
+
+
+GENERATORS = {
+    'plan': lambda: {c['slug']: c for c in map(_class, range(12))},
+    'sched': lambda: [_class(i) for i in range(60)],
+    'book': lambda: {'status': 1, 'message': 'Registered', 'event_id': '900001', 'scheduled_id': '1400001'},
+    'http': _http,
+}
+
+
+def _bytes_on_disk(root: str) -> int:
+    return sum(os.path.getsize(os.path.join(d, f)) for d, _, files in os.walk(root) for f in files
+               if not d.startswith(os.path.join(root, '.')))
+
+
+def bench(codec: str, obj_type: str, objects: list) -> dict:
+    root = tempfile.mkdtemp()
+    try:
+        s = Storage(root, codec=codec)
+        ids = [tokens.generate_token(obj_type) for _ in objects]
+
+        start = time.perf_counter()
+        for _id, obj in zip(ids, objects):
+            s.put(_id, obj)
+        put = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for _id in ids:
+            s.get(_id)
+        get = time.perf_counter() - start
+
+        start = time.perf_counter()
+        listed = sum(1 for _ in s.list(obj_type))
+        list_ = time.perf_counter() - start
+        assert listed == len(objects)
+
+        return {
+            'put_per_s': len(objects) / put,
+            'get_per_s': len(objects) / get,
+            'list_per_s': len(objects) / list_,
+            'bytes_per_object': _bytes_on_disk(root) / len(objects),
+        }
+    finally:
+        shutil.rmtree(root)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--objects', type=int, default=500)
+    parser.add_argument('--json', action='store_true', help='print machine-readable results')
+    args = parser.parse_args()
+
+    results = {}
+    for obj_type, generate in GENERATORS.items():
+        # http bodies are big, fewer of them keeps the run short
+        n = args.objects // 10 if obj_type == 'http' else args.objects
+        objects = [generate() for _ in range(max(n, 1))]
+        results[obj_type] = {codec: bench(codec, obj_type, objects) for codec in serializers.available_codecs()}
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    for obj_type, by_codec in results.items():
+        print(obj_type)
+        for codec, r in by_codec.items():
+            print(f"  {codec:8} put {r['put_per_s']:9.0f}/s  get {r['get_per_s']:9.0f}/s  "
+                  f"list {r['list_per_s']:9.0f}/s  {r['bytes_per_object'] / 1024:8.1f} KiB/object")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+"""
+Import-time profile of the per-minute cron entry point, via -X importtime.
+
+Runs cronv2.main() against a plan with nothing due (the common case) and
+reports total import time, the slowest top-level imports, and whether any of
+the heavy booking dependencies were loaded. For reference it also profiles
+importing those dependencies directly.
+
+    python -m benchmarks.bench_cron_import --runs 5
+"""
+import argparse
+import json
+import os
+import re
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import tokens
+from storage import Storage
+
+HEAVY_MODULES = ('googleapiclient', 'google', 'requests', 'bs4', 'heare', 'smtplib')
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LINE = re.compile(r'import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)')
+
+
+def profile(code: str) -> dict:
+    """Run code in a fresh interpreter with -X importtime and parse the profile."""
+    start = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', code],
+        cwd=ROOT, capture_output=True, text=True, check=True
+    )
+    wall = time.perf_counter() - start
+
+    top_level = {}
+    modules = set()
+    for line in result.stderr.splitlines():
+        match = LINE.match(line)
+        if not match:
+            continue
+        cumulative, indent, module = int(match.group(2)), len(match.group(3)), match.group(4)
+        modules.add(module)
+        if indent == 1:
+            top_level[module] = cumulative
+    return {
+        'wall_s': wall,
+        'import_us': sum(top_level.values()),
+        'top_level': top_level,
+        'heavy': sorted(m for m in HEAVY_MODULES if m in modules),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--json', action='store_true', help='print machine-readable results')
+    args = parser.parse_args()
+
+    root = tempfile.mkdtemp()
+    try:
+        # a plan whose only class is a week out, so nothing is due
+        Storage(root).put(tokens.generate_token('plan'), {
+            'LB01': {'slug': 'LB01', 'schedule_id': '1', 'timestamp': time.time() + 7 * 24 * 60 * 60}
+        })
+        cases = {
+            'cron_noop': f"import cronv2; cronv2.main({root!r})",
+            'booking_deps': "import cal, client, mail_client",
+        }
+        results = {}
+        for name, code in cases.items():
+            runs = [profile(code) for _ in range(args.runs)]
+            results[name] = {
+                'import_ms_median': statistics.median(r['import_us'] for r in runs) / 1000,
+                'wall_ms_median': statistics.median(r['wall_s'] for r in runs) * 1000,
+                'heavy_modules': runs[-1]['heavy'],
+                'slowest': sorted(runs[-1]['top_level'].items(), key=lambda kv: -kv[1])[:5],
+            }
+    finally:
+        shutil.rmtree(root)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    for name, r in results.items():
+        print(f"{name}: imports {r['import_ms_median']:.1f} ms, process {r['wall_ms_median']:.1f} ms "
+              f"(median of {args.runs}), heavy modules: {', '.join(r['heavy_modules']) or 'none'}")
+        for module, us in r['slowest']:
+            print(f"    {module:30s} {us / 1000:8.1f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,167 @@
+"""
+How storage reads, cleanup, planning and rendering scale with history.
+
+Generates synthetic history (see benchmarks/history.py) for each volume, then
+times the operations the planner, cron job and web pages run against it.
+Results are machine-readable so runs can be compared between commits:
+
+    python -m benchmarks.bench_history --years 1 5 --json > after.json
+    python -m benchmarks.bench_history --years 1 5 --compare before.json
+
+--compare exits non-zero if any operation got slower than --threshold times
+its baseline median.
+"""
+import argparse
+import copy
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import timedelta
+
+import cal
+import serializers
+import web
+from benchmarks import history
+from bookings import rebuild_booking_index
+from storage import open_storage
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _timed(fn, repeat: int) -> dict:
+    # one untimed call first: compiled templates, indexes and caches are warm
+    # in the long-running web process, cold starts are timed separately
+    fn()
+    runs = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        runs.append(time.perf_counter() - start)
+    return {'runs': repeat, 'best_s': min(runs), 'median_s': statistics.median(runs)}
+
+
+def _drain(iterable) -> int:
+    return sum(1 for _ in iterable)
+
+
+def operations(s, now: float) -> dict:
+    """name -> zero-argument callable, against a store filled by history.generate()."""
+    sched_id, schedule = s.latest('sched')
+    plan_id, plan = s.latest('plan')
+    some_schedule_id = next(iter(plan.values()))['schedule_id']
+    week_ago = now - history.WEEK
+
+    return {
+        'bookings.rebuild_booking_index': lambda: rebuild_booking_index(s),
+        'list.plan': lambda: _drain(s.list('plan')),
+        'list.book.by_scheduled_id': lambda: _drain(s.list('book', {'scheduled_id': some_schedule_id})),
+        'list.http.last_week': lambda: _drain(s.list('http', {'$timestamp': {'$gte': week_ago}})),
+        'latest.sched': lambda: s.latest('sched'),
+        'latest.cal_event.by_schedule_id': lambda: s.latest('cal_event', {'schedule_id': some_schedule_id}),
+        # dry runs, so every repeat sees the same history
+        'cleanup.plan.dry_run': lambda: s.cleanup('plan', retention_window=timedelta(days=90)),
+        'cleanup.http.dry_run': lambda: s.cleanup('http', retention_window=timedelta(days=14)),
+        'web.mark_bookings': lambda: web.mark_bookings(copy.deepcopy(plan), s),
+        # every class in the newest plan already has an event, so this is only
+        # the per-row lookups and never calls Google
+        'cal.sync_plan_to_calendar': lambda: cal.sync_plan_to_calendar(s, copy.deepcopy(plan), 'bench'),
+        'web.render_response': lambda: web.render_response(copy.deepcopy(plan), copy.deepcopy(schedule), sched_id),
+    }
+
+
+def run(years: float, backend: str, repeat: int, http_per_day: int, http_body_bytes: int) -> dict:
+    root = tempfile.mkdtemp()
+    try:
+        s = open_storage(root, backend=backend)
+        now = time.time()
+        start = time.perf_counter()
+        counts = history.generate(s, years, end=now, http_per_day=http_per_day, http_body_bytes=http_body_bytes)
+        generate_s = time.perf_counter() - start
+
+        # render_response loads template.html relative to the working directory
+        cwd = os.getcwd()
+        os.chdir(ROOT)
+        try:
+            ops = {name: _timed(fn, repeat) for name, fn in operations(s, now).items()}
+        finally:
+            os.chdir(cwd)
+        return {'objects': counts, 'generate_s': generate_s, 'operations': ops}
+    finally:
+        shutil.rmtree(root)
+
+
+def _commit() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list:
+    """(volume, operation, baseline median, median, ratio, regressed) for operations in both runs."""
+    rows = []
+    for volume, r in results['volumes'].items():
+        before = baseline['volumes'].get(volume, {}).get('operations', {})
+        for name, op in r['operations'].items():
+            if name not in before or not before[name]['median_s']:
+                continue
+            ratio = op['median_s'] / before[name]['median_s']
+            rows.append((volume, name, before[name]['median_s'], op['median_s'], ratio, ratio > threshold))
+    return rows
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--years', type=float, nargs='+', default=[1, 5])
+    parser.add_argument('--backend', choices=('file', 'memory'), default='file')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--http-per-day', type=int, default=10)
+    parser.add_argument('--http-body-bytes', type=int, default=4096)
+    parser.add_argument('--json', action='store_true', help='print machine-readable results')
+    parser.add_argument('--compare', metavar='BASELINE.json', help='compare with the --json output of another run')
+    parser.add_argument('--threshold', type=float, default=1.25)
+    opts = parser.parse_args(args)
+
+    results = {
+        'commit': _commit(),
+        'python': platform.python_version(),
+        'backend': opts.backend,
+        'codec': serializers.get_codec(os.environ.get('STORAGE_CODEC', 'json')).name,
+        'volumes': {},
+    }
+    for years in opts.years:
+        results['volumes'][f"{years:g}y"] = run(years, opts.backend, opts.repeat,
+                                                opts.http_per_day, opts.http_body_bytes)
+
+    if opts.json:
+        print(json.dumps(results, indent=2))
+    else:
+        for volume, r in results['volumes'].items():
+            total = sum(r['objects'].values())
+            print(f"{volume}: {total} objects {r['objects']}, generated in {r['generate_s']:.1f}s")
+            for name, op in r['operations'].items():
+                print(f"  {name:36} median {op['median_s'] * 1000:10.2f} ms  best {op['best_s'] * 1000:10.2f} ms")
+
+    if opts.compare:
+        with open(opts.compare) as f:
+            baseline = json.load(f)
+        rows = compare(results, baseline, opts.threshold)
+        out = sys.stderr if opts.json else sys.stdout
+        print(f"\nvs {baseline.get('commit') or opts.compare}:", file=out)
+        for volume, name, before, after, ratio, regressed in rows:
+            flag = '  REGRESSED' if regressed else ''
+            print(f"  {volume:5} {name:36} {before * 1000:10.2f} -> {after * 1000:10.2f} ms  x{ratio:.2f}{flag}",
+                  file=out)
+        if any(row[-1] for row in rows):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
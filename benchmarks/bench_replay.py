@@ -0,0 +1,135 @@
+"""
+Planner and booking end-to-end against the recorded club site (see replay.py),
+offline, with the recorded latencies.
+
+    python -m benchmarks.bench_replay --log-dir ./log [--latency-scale 1] [--members 20] [--json]
+
+Times sign in, the class map, next week's schedule and registration (fast
+register and cart checkout), then load-tests registration: --members
+sessions race for one class that fills up after --capacity bookings.
+Planner phases need a recording with those pages in it; registration is
+scripted and always runs.
+"""
+import argparse
+import json
+import threading
+import time
+
+import client
+from log_report import percentile
+from replay import FullAfter, NeedsCart, OpensAt, Recording, ReplayAdapter, ReplayMiss, replay_session
+from storage import open_storage
+
+
+def _timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return time.perf_counter() - start, result
+
+
+def planner_phases(recording: Recording, latency_scale: float) -> dict:
+    session = replay_session(ReplayAdapter(recording, latency_scale=latency_scale))
+    results = {}
+    try:
+        results['sign_in'], _ = _timed(client.sign_in, session, 'member@example.com', 'password')
+        results['build_class_map'], class_map = _timed(client.build_class_map, session)
+        slugs = [slug for slug in class_map if slug.startswith('LB') or slug.startswith('LF')]
+        results['build_next_week_schedule'], schedule = _timed(
+            client.build_next_week_schedule, session, class_map, slugs)
+        results['classes'] = len(schedule)
+    except ReplayMiss as e:
+        results['skipped'] = str(e)
+    return results
+
+
+def registration(recording: Recording, latency_scale: float, scenarios: list) -> float:
+    session = replay_session(ReplayAdapter(recording, scenarios, latency_scale=latency_scale))
+    elapsed, result = _timed(client.register_for_instance, session, '900001', '1400001', '42')
+    assert result.get('status') == 1, result
+    return elapsed
+
+
+def load_test(recording: Recording, latency_scale: float, members: int, capacity: int) -> dict:
+    """`members` sessions register for one class at the moment it opens."""
+    opens_at = time.time() + 0.2
+    adapter = ReplayAdapter(recording, [OpensAt(opens_at), FullAfter(capacity)], latency_scale=latency_scale)
+    latencies, outcomes = [], {'booked': 0, 'full': 0, 'not_open': 0, 'error': 0}
+    lock = threading.Lock()
+
+    def member(user_id):
+        session = replay_session(adapter)
+        time.sleep(max(0.0, opens_at - time.time()))
+        start = time.perf_counter()
+        try:
+            result = client.register_for_instance(session, '900001', '1400001', str(user_id))
+            if result.get('status') == 1:
+                outcome = 'booked'
+            else:
+                outcome = 'full' if 'maximum number' in result.get('message', '') else 'not_open'
+        except Exception:
+            outcome = 'error'
+        with lock:
+            latencies.append(time.perf_counter() - start)
+            outcomes[outcome] += 1
+
+    threads = [threading.Thread(target=member, args=(i,)) for i in range(members)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    latencies.sort()
+    return {
+        'members': members,
+        'capacity': capacity,
+        'outcomes': outcomes,
+        'requests': adapter.requests,
+        'wall_s': time.perf_counter() - start,
+        'p50_s': percentile(latencies, 50),
+        'p95_s': percentile(latencies, 95),
+    }
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--log-dir', default='./log')
+    parser.add_argument('--days', type=float, default=14, help='only replay logs this recent')
+    parser.add_argument('--latency-scale', type=float, default=1.0, help='0 replays as fast as possible')
+    parser.add_argument('--members', type=int, default=20)
+    parser.add_argument('--capacity', type=int, default=12)
+    parser.add_argument('--json', action='store_true', help='print machine-readable results')
+    opts = parser.parse_args(args)
+
+    since = time.time() - opts.days * 24 * 60 * 60
+    # bodies are read back as they're replayed, through the store's bounded cache
+    recording = Recording.from_storage(open_storage(opts.log_dir), since=since)
+    results = {
+        'recorded_exchanges': len(recording),
+        'latency_scale': opts.latency_scale,
+        'planner': planner_phases(recording, opts.latency_scale),
+        'register_fast_s': registration(recording, opts.latency_scale, []),
+        'register_cart_s': registration(recording, opts.latency_scale, [NeedsCart()]),
+        'load': load_test(recording, opts.latency_scale, opts.members, opts.capacity),
+    }
+
+    if opts.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{results['recorded_exchanges']} recorded exchanges, latency x{opts.latency_scale:g}")
+    planner = results['planner']
+    if 'skipped' in planner:
+        print(f"  planner phases skipped: {planner['skipped']}")
+    else:
+        for phase in ('sign_in', 'build_class_map', 'build_next_week_schedule'):
+            print(f"  {phase:28} {planner[phase] * 1000:10.1f} ms")
+        print(f"  {'classes next week':28} {planner['classes']:10d}")
+    print(f"  {'register (fast)':28} {results['register_fast_s'] * 1000:10.1f} ms")
+    print(f"  {'register (cart)':28} {results['register_cart_s'] * 1000:10.1f} ms")
+    load = results['load']
+    print(f"  {load['members']} members racing for {load['capacity']} spots: {load['outcomes']}, "
+          f"{load['requests']} requests in {load['wall_s']:.2f}s, p50 {load['p50_s'] * 1000:.1f} ms, "
+          f"p95 {load['p95_s'] * 1000:.1f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+"""
+Register-button title to timestamp parsing, as build_next_week_schedule does
+it for every event-info page, over recorded pages.
+
+    python -m benchmarks.bench_titles --log-dir ./log [--pages 200] [--json]
+
+Titles come from the event-info pages in the http logs; without any, from
+synthetic pages of the same shape. Times the original strptime parser, the
+precompiled parser with an empty memo (first planner run in a process), and
+warm (a title seen before), per title and per page.
+"""
+import argparse
+import datetime
+import json
+import random
+import re
+import time
+from typing import List
+
+from bs4 import BeautifulSoup
+
+import client
+from benchmarks.history import DAY, _description
+from storage import open_storage
+
+BUTTONS_PER_PAGE = 24
+
+
+def original(title: str) -> int:
+    import pytz
+    pacific = pytz.timezone('America/Los_Angeles')
+    tstr = title.split("|")[-1]
+    tstr = re.compile("-[0-9]+:[0-9]{2}[ap]m").sub('', tstr).strip()
+    tstr = re.compile(r'([0-9]{1,2}:[0-9]{2}[ap]m)\s+.*?\s+on').sub(r'\1 on', tstr)
+    return int(pacific.localize(datetime.datetime.strptime(tstr, '%A %I:%M%p on %m/%d/%Y')).timestamp())
+
+
+def recorded_pages(log_dir: str, limit: int) -> List[List[str]]:
+    pages = []
+    for _, record in open_storage(log_dir, cache_bytes=0).list('http'):
+        request, response = record.get('request') or {}, record.get('response') or {}
+        if '/calendar/event-info' not in (request.get('url') or '') or not response.get('body'):
+            continue
+        soup = BeautifulSoup(response['body'], 'html.parser')
+        titles = [b['data-title'] for b in soup.find_all(attrs={'data-title': True})
+                  if {'register-button-closed', 'register-button-now'} & set(b.get('class', []))]
+        if titles:
+            pages.append(titles)
+        if len(pages) >= limit:
+            break
+    return pages
+
+
+def synthetic_pages(n: int, seed: int = 0) -> List[List[str]]:
+    rng = random.Random(seed)
+    start = time.time()
+    pages = []
+    for p in range(n):
+        slug = f"LB{p % 60:02d}"
+        # one page lists the coming weeks of one class
+        first = start + rng.randint(0, 6) * DAY + rng.randint(7, 20) * 3600
+        pages.append([_description(slug, p, first + week * 7 * DAY) for week in range(BUTTONS_PER_PAGE)])
+    return pages
+
+
+def _per_title(fn, titles: List[str], before=None) -> float:
+    if before:
+        before()
+    start = time.perf_counter()
+    for title in titles:
+        fn(title)
+    return (time.perf_counter() - start) / len(titles)
+
+
+def bench(pages: List[List[str]]) -> dict:
+    titles = [t for page in pages for t in page]
+    clear = client._extract_timestamp_from_title.cache_clear
+    results = {
+        'pages': len(pages),
+        'titles': len(titles),
+        'original_us': _per_title(original, titles) * 1e6,
+        'cold_us': _per_title(client._extract_timestamp_from_title, titles, before=clear) * 1e6,
+        'warm_us': _per_title(client._extract_timestamp_from_title, titles) * 1e6,
+    }
+    clear()
+    start = time.perf_counter()
+    for page in pages:
+        client._extract_timestamps_from_titles(page)
+    results['batch_cold_page_us'] = (time.perf_counter() - start) / len(pages) * 1e6
+    results['speedup_cold'] = results['original_us'] / results['cold_us']
+    return results
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--log-dir', default='./log')
+    parser.add_argument('--pages', type=int, default=200)
+    parser.add_argument('--json', action='store_true', help='print machine-readable results')
+    opts = parser.parse_args(args)
+
+    pages = recorded_pages(opts.log_dir, opts.pages)
+    source = 'recorded'
+    if not pages:
+        pages, source = synthetic_pages(opts.pages), 'synthetic'
+    results = dict(bench(pages), source=source)
+
+    if opts.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{results['titles']} titles on {results['pages']} {source} pages")
+    for name in ('original', 'cold', 'warm'):
+        print(f"  {name:10} {results[name + '_us']:8.2f} us/title")
+    print(f"  {'batch':10} {results['batch_cold_page_us']:8.2f} us/page (cold)")
+    print(f"  cold speedup x{results['speedup_cold']:.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,137 @@
+"""
+Synthetic history: what a storage directory looks like after the planner and
+cron job have run for a while.
+
+One week of history is a `sched` of the classes on offer, the `plan` picked
+from it (same token, plan prefix), a `book` for most planned classes, a
+`cal_event` for each of them, and `http` logs of the requests made along the
+way. Timestamps run back from `end`, so retention cleanup and $timestamp
+queries see realistic ages.
+
+    s = open_storage(root)
+    counts = generate(s, years=1)
+"""
+import random
+import string
+import time
+from datetime import datetime
+from typing import Dict
+
+import tokens
+
+WEEK = 7 * 24 * 60 * 60
+DAY = 24 * 60 * 60
+
+CLASSES_PER_WEEK = 60
+PLANNED_PER_WEEK = 12
+BOOKED_FRACTION = 0.75
+
+_LEVELS = ('3.0-3.5', '3.5-4.0', '4.0+')
+_ENDPOINTS = (
+    'https://tcsp.clubautomation.com/calendar/classes-by-class',
+    'https://tcsp.clubautomation.com/calendar/event-info',
+    'https://tcsp.clubautomation.com/calendar/fast-register-event',
+    'https://tcsp.clubautomation.com/member/cart',
+    'https://tcsp.clubautomation.com/member/cart/step/2',
+    'https://tcsp.clubautomation.com/login/login',
+)
+
+
+def _description(slug: str, i: int, ts: float) -> str:
+    t = datetime.fromtimestamp(ts)
+    start = t.strftime('%I:%M%p').lstrip('0').lower()
+    return f"{slug} | Live Ball {_LEVELS[i % len(_LEVELS)]} Drop-in | {t:%A} {start}-8:45pm on {t:%m/%d/%Y}"
+
+
+def week_schedule(week_start: float, week: int) -> list:
+    schedule = []
+    for i in range(CLASSES_PER_WEEK):
+        ts = week_start + (i % 7) * DAY + (8 + i % 12) * 3600
+        slug = f"LB{i:02d}"
+        schedule.append({
+            'slug': slug,
+            'schedule_id': str(1_000_000 + week * CLASSES_PER_WEEK + i),
+            'event_id': str(500_000 + i),
+            'description': _description(slug, i, ts),
+            'timestamp': ts,
+        })
+    return sorted(schedule, key=lambda c: c['timestamp'])
+
+
+def week_plan(schedule: list, rng: random.Random) -> dict:
+    return {c['slug']: dict(c) for c in rng.sample(schedule, PLANNED_PER_WEEK)}
+
+
+def booking(inst: dict) -> dict:
+    return {
+        'status': 1,
+        'message': 'Registered',
+        'event_id': inst['event_id'],
+        'scheduled_id': inst['schedule_id'],
+    }
+
+
+def cal_event(inst: dict, rng: random.Random) -> dict:
+    return {
+        'kind': 'calendar#event',
+        'id': ''.join(rng.choices(string.ascii_lowercase + string.digits, k=26)),
+        'status': 'confirmed',
+        'summary': '✅ Sean @ Tennis',
+        'description': inst['description'],
+        'start': {'dateTime': datetime.fromtimestamp(inst['timestamp']).isoformat()},
+        'schedule_id': inst['schedule_id'],
+    }
+
+
+def http_log(ts: float, rng: random.Random, body_bytes: int) -> dict:
+    url = rng.choice(_ENDPOINTS)
+    status = 200 if rng.random() > 0.02 else rng.choice((500, 502, 429))
+    headers = {'Content-Type': 'text/html; charset=UTF-8', 'Set-Cookie': 'PHPSESSID=' + 'x' * 26}
+    return {
+        'time': ts,
+        'duration': rng.lognormvariate(-1, 0.6),
+        'request': {'method': 'POST' if 'register' in url or 'cart' in url else 'GET', 'url': url,
+                    'headers': {'X-Requested-With': 'XMLHttpRequest'}, 'body': 'None'},
+        'response': {'status': status, 'headers': headers,
+                     'body': ''.join(rng.choices(string.ascii_letters + ' <>/="', k=body_bytes))},
+    }
+
+
+def generate(s, years: float, end: float = None, http_per_day: int = 10, http_body_bytes: int = 4096,
+             log_storage=None, seed: int = 0) -> Dict[str, int]:
+    """
+    Fill `s` (and `log_storage`, default `s`) with `years` of weekly history
+    ending at `end`. The newest plan has a cal_event for every class, like
+    after a successful sync.
+
+    :return: number of objects written, per type
+    """
+    rng = random.Random(seed)
+    end = end or time.time()
+    log_storage = log_storage or s
+    weeks = max(1, int(years * 52))
+    counts = {'sched': 0, 'plan': 0, 'book': 0, 'cal_event': 0, 'http': 0}
+
+    def put(store, obj_type, ts, obj):
+        store.put(tokens.generate_token(obj_type, timestamp=ts), obj)
+        counts[obj_type] += 1
+
+    for week in range(weeks):
+        week_start = end - (weeks - week) * WEEK
+        schedule = week_schedule(week_start + WEEK, week)
+        sched_id = tokens.generate_token('sched', timestamp=week_start)
+        s.put(sched_id, schedule)
+        plan = week_plan(schedule, rng)
+        s.put(tokens.swap_prefix(sched_id, 'plan'), plan)
+        counts['sched'] += 1
+        counts['plan'] += 1
+
+        for inst in plan.values():
+            put(s, 'cal_event', week_start + 60, cal_event(inst, rng))
+            if rng.random() < BOOKED_FRACTION:
+                put(s, 'book', inst['timestamp'] - 2 * DAY, booking(inst))
+
+        for _ in range(int(http_per_day * 7)):
+            ts = week_start + rng.random() * WEEK
+            put(log_storage, 'http', ts, http_log(ts, rng, http_body_bytes))
+    return counts
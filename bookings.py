@@ -0,0 +1,74 @@
+"""
+Index of successful bookings, keyed by class instance schedule id.
+
+Bookings are stored as `book_*` objects, one per successful registration.
+Looking one up by schedule id used to mean decoding every booking ever made;
+the index keeps a `schedule_id -> booking token` map next to them instead.
+
+Each member's bookings are a type of their own (see members.py), with an
+index of their own: `book_by_schedule`, `book_ana_by_schedule`.
+"""
+from typing import Dict
+
+import tokens
+from storage import Storage, token_order
+
+
+def _index_name(obj_type: str) -> str:
+    return f"{obj_type}_by_schedule"
+
+
+def _scan(s: Storage, obj_type: str) -> dict:
+    by_schedule = {}
+    count = 0
+    for token, booking in s.list(obj_type):
+        count += 1
+        schedule_id = booking.get('scheduled_id')
+        if schedule_id is None:
+            continue
+        current = by_schedule.get(schedule_id)
+        if current is None or token_order(token) > token_order(current):
+            by_schedule[schedule_id] = token
+
+    return {'count': count, 'by_schedule': by_schedule}
+
+
+def rebuild_booking_index(s: Storage, obj_type: str = 'book') -> dict:
+    return s.update_index(_index_name(obj_type), lambda _: _scan(s, obj_type))
+
+
+def _load_index(s: Storage, obj_type: str) -> dict:
+    index = s.get_index(_index_name(obj_type))
+    if index is None or index.get('count') != s.count(obj_type):
+        # missing, or bookings were written/deleted behind our back
+        index = rebuild_booking_index(s, obj_type)
+    return index
+
+
+def booking_index(s: Storage, obj_type: str = 'book') -> Dict[str, str]:
+    """
+    :return: map of schedule_id to the token of its latest booking
+    """
+    return _load_index(s, obj_type)['by_schedule']
+
+
+def record_booking(s: Storage, token: str, booking: dict) -> None:
+    """
+    Store a booking and add it to the index of its type. Cron's member threads
+    and the watcher book at the same time, so both happen under the index's
+    lock, where no other booking can slip in between.
+    """
+    obj_type = tokens.parse(token)['prefix']
+    schedule_id = booking.get('scheduled_id')
+
+    def update(index):
+        if index is None or index.get('count') != s.count(obj_type):
+            index = _scan(s, obj_type)
+        s.put(token, booking)
+        current = index['by_schedule'].get(schedule_id)
+        if schedule_id is not None and (current is None or token_order(token) > token_order(current)):
+            index['by_schedule'][schedule_id] = token
+        index['count'] += 1
+        return index
+
+    s.update_index(_index_name(obj_type), update)
@@ -11,6 +11,7 @@ import json
 import logging
 import storage
 import tokens
+from members import DEFAULT, Member
 from tokens import generate_token
 
 # If modifying these scopes, delete the file token.json.
@@ -67,25 +68,26 @@ def _format_event_timestamp(ts: float) -> str:
     return t.isoformat()
 
 
-def get_event_for_class(db: storage.Storage, class_instance: dict, calendar_id: str):
+def get_event_for_class(db: storage.Storage, class_instance: dict, calendar_id: str, member: Member = DEFAULT):
     """
     Get event that was created these scripts.
     :param db:
     :param class_instance:
     :param calendar_id:
+    :param member: whose event, each member has their own
     :return:
     """
-    token, event = db.latest('cal_event', {'schedule_id': class_instance['schedule_id']})
+    token, event = db.latest(member.cal_event_type, {'schedule_id': class_instance['schedule_id']})
     return token, event
 
 
-def create_event_for_class(db: storage.Storage, class_instance: dict, calendar_id: str):
-    token, existing_event = get_event_for_class(db, class_instance, calendar_id)
+def create_event_for_class(db: storage.Storage, class_instance: dict, calendar_id: str, member: Member = DEFAULT):
+    token, existing_event = get_event_for_class(db, class_instance, calendar_id, member)
     icon = '✅' if class_instance.get('scheduled') else '⏳'
     color = GCAL_GREEN if class_instance.get('scheduled') else GCAL_YELLOW
     body = {
         'colorId': color,
-        'summary': f"{icon} Sean @ Tennis",
+        'summary': f"{icon} {member.name} @ Tennis",
         'location': '7135 Sportsfield Dr NE, Seattle, WA 98115, USA',
         'start': {'dateTime': _format_event_timestamp(class_instance['timestamp']), 'timeZone': 'America/Los_Angeles'},
         'end': {'dateTime': _format_event_timestamp(class_instance['timestamp'] + (75.0 * 60.0)), 'timeZone': 'America/Los_Angeles'},
@@ -104,7 +106,7 @@ def create_event_for_class(db: storage.Storage, class_instance: dict, calendar_i
     try:
         result = op(**op_args).execute()
         if not token:
-            token = tokens.generate_token('cal_event')
+            token = tokens.generate_token(member.cal_event_type)
         cp = result.copy()
         cp['schedule_id'] = class_instance['schedule_id']
         db.put(token, cp)
@@ -114,18 +116,18 @@ def create_event_for_class(db: storage.Storage, class_instance: dict, calendar_i
         return None
 
 
-def sync_plan_to_calendar(db: storage.Storage, plan: dict, calendar_id: str):
+def sync_plan_to_calendar(db: storage.Storage, plan: dict, calendar_id: str, member: Member = DEFAULT):
     synced = []
     for slug, inst in plan.items():
-        token, existing = db.latest('cal_event', {'schedule_id': inst['schedule_id']})
+        token, existing = db.latest(member.cal_event_type, {'schedule_id': inst['schedule_id']})
         if not token:
-            synced.append(create_event_for_class(db, inst, calendar_id))
+            synced.append(create_event_for_class(db, inst, calendar_id, member))
 
     return synced
 
 
-def remove_calendar_event(db: storage.Storage, class_instance: dict, calendar_id: str):
-    token, existing_event = get_event_for_class(db, class_instance, calendar_id)
+def remove_calendar_event(db: storage.Storage, class_instance: dict, calendar_id: str, member: Member = DEFAULT):
+    token, existing_event = get_event_for_class(db, class_instance, calendar_id, member)
     if not existing_event:
         # no calendar event managed for this instance. 🤷
         return
@@ -136,28 +138,29 @@ def remove_calendar_event(db: storage.Storage, class_instance: dict, calendar_id
 def update_calendar_to_new_plan(
         db: storage.Storage,
         old_plan: dict, new_plan: dict,
-        calendar_id: str = os.environ.get('SHARED_CALENDAR_ID')):
+        calendar_id: str = os.environ.get('SHARED_CALENDAR_ID'),
+        member: Member = DEFAULT):
     if not calendar_id:
         # Don't set this in development, don't update shared calendar in development. Bad!
         return
     to_add = new_plan.keys() - old_plan.keys()
     to_remove = old_plan.keys() - new_plan.keys()
     for slug in to_add:
-        create_event_for_class(db, new_plan.get(slug), calendar_id=calendar_id)
+        create_event_for_class(db, new_plan.get(slug), calendar_id=calendar_id, member=member)
 
     for slug in to_remove:
         existing_instance = old_plan.get(slug)
         if not existing_instance.get('scheduled'):
             # leave things that are already booked on the calendar, and just be sad about it
             # can still be manually removed from the calendar and will not be replaced.
-            remove_calendar_event(db, old_plan.get(slug), calendar_id=calendar_id)
+            remove_calendar_event(db, old_plan.get(slug), calendar_id=calendar_id, member=member)
 
 
 def main(args=None):
     # init calendar credentials
     if args is None:
         args = sys.argv
-    db = storage.Storage('./storage')
+    db = storage.open_storage('./storage')
     create_calendar_service(db)
     if '--sync-latest' in args:
         _, plan = db.latest('plan')
@@ -1,26 +1,66 @@
+"""
+Retention cleanup, run weekly from cron.
+
+    python3 cleanup.py [--dry-run=false] [--budget=SECONDS]
+
+Note --dry-run=false is what asks for a dry run, and a plain run deletes.
+Existing crontabs depend on that, so it stays as it was.
+
+With a budget it stops once that many seconds have passed; whatever is left
+is picked up by the next run.
+"""
 import sys
+import time
 from datetime import timedelta
 
+from members import load_members
 from storage import Storage
 
 CLEANUP_SPEC = {
     'plan': timedelta(days=90),
     'sched': timedelta(days=90),
     'cal_event': timedelta(days=90),
-    'http': timedelta(days=14)
+    'http': timedelta(days=14),
+    'job': timedelta(days=14),
+    'prof': timedelta(days=14),
+}
+
+# which store each type is written to, see client.py. Members' own types,
+# plan_ana and so on, are cleaned up like the type they are a version of.
+STORE_TYPES = {
+    './storage': ('plan', 'sched', 'cal_event', 'job', 'prof'),
+    './log': ('http',),
 }
 
+BATCH_PAUSE = 0.05  # seconds between delete batches, spreads out the I/O
+
+
+def _option(args, name: str):
+    for arg in args:
+        if arg.startswith(f'{name}='):
+            return arg.split('=', 1)[1]
+    return None
+
 
 def main(args=sys.argv):
+    # historical, and inverted: see the module docstring
     dry_run = '--dry-run=false' in args
-    s = Storage('./storage')
-    log_storage = Storage('./log')
-
-    for t, window in CLEANUP_SPEC.items():
-        cleaned = s.cleanup(t, retention_window=window, dry_run=dry_run)
-        cleaned += log_storage.cleanup(t, retention_window=window, dry_run=dry_run)
-        if len(cleaned) > 0:
-            print(f"DRY_RUN={dry_run}: cleaned {len(cleaned)} items from {t}.")
+    budget = _option(args, '--budget')
+    deadline = time.time() + float(budget) if budget else None
+
+    for root, types in STORE_TYPES.items():
+        s = Storage(root)
+        members = load_members(s)
+        for base in types:
+            for t in sorted({member.typed(base) for member in members}):
+                report = s.cleanup(t, retention_window=CLEANUP_SPEC[base], dry_run=dry_run,
+                                   deadline=deadline, pause=BATCH_PAUSE)
+                if len(report) > 0:
+                    print(f"DRY_RUN={dry_run}: cleaned {len(report)} items "
+                          f"({report.bytes_reclaimed / 1024:.0f} KiB) from {t}.")
+                if not report.complete:
+                    print(f"Stopped at the {budget}s budget, run again to continue.")
+                    return
 
 
 if __name__ == "__main__":
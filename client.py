@@ -1,17 +1,24 @@
 import os
 import re
+import calendar
 import datetime
+import functools
 import time
 import logging
 from collections import defaultdict
-from typing import List
+from typing import Iterable, List, Union
 
 import requests
 from bs4 import BeautifulSoup
 from heare.config import SettingsDefinition, Setting
 
 import cal
-from storage import Storage
+import metrics
+import profiling
+import ratelimit
+from bookings import record_booking
+from members import DEFAULT, Member
+from storage import open_storage
 import tokens
 
 USER_AGENT = "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) " \
@@ -19,8 +26,8 @@ USER_AGENT = "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) " \
              " Safari/537.36"
 
 
-log_storage = Storage('./log')
-obj_storage = Storage('./storage')
+log_storage = open_storage('./log')
+obj_storage = open_storage('./storage')
 
 
 def http_log(response: requests.Response, *args, **kwargs) -> None:
@@ -43,18 +50,46 @@ def http_log(response: requests.Response, *args, **kwargs) -> None:
     })
 
 
-def make_session() -> requests.Session:
+class RateLimitedAdapter(requests.adapters.BaseAdapter):
+    """Waits for the shared rate limit (see ratelimit.py) before each request."""
+
+    def __init__(self, adapter: requests.adapters.BaseAdapter, priority: str = ratelimit.BACKGROUND):
+        super().__init__()
+        self._adapter = adapter
+        self._priority = priority
+
+    def send(self, request, **kwargs):
+        ratelimit.limiter().acquire(ratelimit.priority_for(request.url, self._priority))
+        return self._adapter.send(request, **kwargs)
+
+    def close(self):
+        self._adapter.close()
+
+
+def make_session(adapter: requests.adapters.BaseAdapter = None,
+                 priority: str = ratelimit.BACKGROUND) -> requests.Session:
+    """
+    A session of its own (cookies, sign in) that can share its connections:
+    sessions given the same adapter draw from one pool. Every request waits
+    its turn under the rate limit shared with the other processes.
+    """
     s = requests.Session()
+    s.mount('https://', RateLimitedAdapter(adapter or requests.adapters.HTTPAdapter(), priority))
     s.hooks['response'].append(http_log)
     return s
 
 
-def store_booked_class(instance, resp: dict):
-    token = tokens.generate_token('book')
+def pooled_adapter(sessions: int) -> requests.adapters.HTTPAdapter:
+    """One connection pool to the club for `sessions` sessions used at once."""
+    return requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=max(1, sessions))
+
+
+def store_booked_class(instance, resp: dict, book_type: str = 'book'):
+    token = tokens.generate_token(book_type)
     body = resp.copy()
     body['event_id'] = instance['event_id']
     body['scheduled_id'] = instance['schedule_id']
-    obj_storage.put(token, body)
+    record_booking(obj_storage, token, body)
 
 
 def successful_registration_response(resp: dict) -> bool:
@@ -62,6 +97,29 @@ def successful_registration_response(resp: dict) -> bool:
         or 'already' in resp.get('message', '')
 
 
+# why the club refused a registration for good, as recorded in a plan's `failure`
+FULL = 'full'
+NEEDS_PAYMENT = 'payment'
+
+
+def failure_reason(resp: dict) -> Union[str, None]:
+    """FULL or NEEDS_PAYMENT, or None for a refusal worth retrying."""
+    message = resp.get('message') or ''
+    if 'maximum' in message:
+        return FULL
+    if 'without payment' in message:
+        return NEEDS_PAYMENT
+    return None
+
+
+_LOGIN_FORM = re.compile(r'id=["\']login_token["\']')
+
+
+def signed_out(page: requests.Response) -> bool:
+    """Whether the club answered with its sign-in page, i.e. the session has expired."""
+    return bool(_LOGIN_FORM.search(page.text))
+
+
 def _extract_late_fall_slug(class_name):
     """Extract a synthetic slug for Late Fall classes.
     
@@ -115,64 +173,155 @@ def get_class_info_from_block(block):
     }
 
 
-def _extract_timestamp_from_title(title):
+# e.g. "LB01 | Thursday 10:45am-11:45am 90 MINUTE EDITION! on 10/30/2025"
+_TIME_RANGE = re.compile("-[0-9]+:[0-9]{2}[ap]m")
+_EDITION = re.compile(r'([0-9]{1,2}:[0-9]{2}[ap]m)\s+.*?\s+on')
+_TITLE = re.compile(r'([A-Za-z]+)\s+([0-9]{1,2}):([0-5][0-9])([AaPp][Mm])\s+on\s+([0-9]{1,2})/([0-9]{1,2})/([0-9]{4})')
+_WEEKDAYS = frozenset(name.lower() for name in calendar.day_name)
+
+
+@functools.lru_cache(maxsize=None)
+def _pacific():
     import pytz
-    pacific = pytz.timezone('America/Los_Angeles')
-    parts = title.split("|")
-    tstr = parts[-1]
+    return pytz.timezone('America/Los_Angeles')
+
+
+@functools.lru_cache(maxsize=None)
+def _pacific_offset(year: int, month: int, day: int, hour: int) -> int:
+    """UTC offset in seconds of a Pacific wall-clock hour; DST switches on the hour."""
+    return int(_pacific().localize(datetime.datetime(year, month, day, hour)).utcoffset().total_seconds())
+
+
+def _parse_title_time(tstr: str) -> datetime.datetime:
+    """'Thursday 10:45am on 10/30/2025'; strptime parses (or refuses) anything less regular."""
+    match = _TITLE.fullmatch(tstr)
+    if match:
+        weekday, hour, minute, ampm, month, day, year = match.groups()
+        hour = int(hour)
+        if weekday.lower() in _WEEKDAYS and 1 <= hour <= 12:
+            hour = hour % 12 + (12 if ampm.lower() == 'pm' else 0)
+            return datetime.datetime(int(year), int(month), int(day), hour, int(minute))
+    return datetime.datetime.strptime(tstr, '%A %I:%M%p on %m/%d/%Y')
+
+
+@functools.lru_cache(maxsize=16384)
+def _extract_timestamp_from_title(title: str) -> int:
+    tstr = title.split("|")[-1]
     # First remove time range suffix (e.g., "-11:45am")
-    rx = re.compile("-[0-9]+:[0-9]{2}[ap]m")
-    tstr = rx.sub('', tstr).strip()
+    tstr = _TIME_RANGE.sub('', tstr).strip()
     # Remove any additional text between the time and "on" (e.g., "90 MINUTE EDITION!")
-    # This regex matches: (time with am/pm) + (any text) + (literal " on")
-    # and replaces it with just: (time with am/pm) + " on"
-    rx_edition = re.compile(r'([0-9]{1,2}:[0-9]{2}[ap]m)\s+.*?\s+on')
-    tstr = rx_edition.sub(r'\1 on', tstr)
-    # Parse the date without timezone first
-    naive_dt = datetime.datetime.strptime(tstr, '%A %I:%M%p on %m/%d/%Y')
-    # Localize it to Pacific time
-    local_dt = pacific.localize(naive_dt)
-    return int(local_dt.timestamp())
-
-
-def build_next_week_schedule(session: requests.Session, class_map: dict[str, dict], slugs:List[str]):
+    tstr = _EDITION.sub(r'\1 on', tstr)
+    # Localize the naive time to Pacific time
+    naive_dt = _parse_title_time(tstr)
+    offset = _pacific_offset(naive_dt.year, naive_dt.month, naive_dt.day, naive_dt.hour)
+    return calendar.timegm(naive_dt.timetuple()) - offset
+
+
+def _extract_timestamps_from_titles(titles: Iterable[str]) -> List[int]:
+    """Timestamps of every button title on a page, in order."""
+    return [_extract_timestamp_from_title(title) for title in titles]
+
+
+WEEK = 7 * 24 * 60 * 60
+# how long an event page is trusted to predict the coming weeks' instances.
+# Only which instances it listed is used: its Full/Closed state is stale by
+# the next weekly run, and booking (then watcher.py) finds out about those
+MAX_PAGE_AGE = 4 * WEEK
+# instances kept per page, soonest first
+PAGE_INSTANCES = 8
+
+
+def _record_page(pages: dict, inst: dict, buttons: list, timestamps: List[int], min_timestamp: float,
+                 now: float) -> None:
+    instances = sorted(
+        [ts, b['data-event-id'], b['data-schedule-id'], b['data-title'], b.text]
+        for b, ts in zip(buttons, timestamps) if ts >= min_timestamp)
+    pages[inst['slug']] = {
+        'event_id': inst['event_id'],
+        'schedule': inst.get('schedule'),
+        'description': inst.get('description'),
+        'fetched': now,
+        'instances': instances[:PAGE_INSTANCES],
+    }
+
+
+def _predict_instance(inst: dict, page: dict, previous: dict, min_timestamp: float, cutoff_timestamp: float,
+                      now: float):
+    """
+    Next week's instance from the event page seen before, if the class map
+    still lists the class the same way and it falls a week after last week's.
+    """
+    if page is None or previous is None:
+        return None
+    if (page['event_id'], page['schedule'], page['description']) != \
+            (inst['event_id'], inst.get('schedule'), inst.get('description')):
+        return None
+    if now - page['fetched'] > MAX_PAGE_AGE:
+        return None
+    page['instances'] = [i for i in page['instances'] if i[0] >= min_timestamp]
+    eligible = [i for i in page['instances'] if i[0] <= cutoff_timestamp]
+    # an hour either way for daylight saving
+    if not eligible or abs(eligible[0][0] - previous['timestamp'] - WEEK) > 60 * 60:
+        return None
+    return eligible[0]
+
+
+@profiling.timed()
+def build_next_week_schedule(session: requests.Session, class_map: dict[str, dict], slugs:List[str],
+                             previous: List[dict] = None, pages: dict = None, now: float = None):
+    """
+    Next week's instance of each class in `slugs`, found on its event page.
+
+    `pages` (slug -> what its event page listed) is updated with every page
+    fetched. Given last week's schedule as `previous` as well, classes whose
+    next instance is predicted from `pages` and confirmed by the class map
+    aren't fetched at all.
+    """
+    now = time.time() if now is None else now
     instances = {}
     # Calculate the minimum timestamp (48 hours from now - past the booking window)
-    min_timestamp = datetime.datetime.now().timestamp() + (48 * 60 * 60)
+    min_timestamp = now + (48 * 60 * 60)
     # Calculate the cutoff timestamp for 9 days in the future
-    cutoff_timestamp = datetime.datetime.now().timestamp() + (9 * 24 * 60 * 60)
-    
+    cutoff_timestamp = now + (9 * 24 * 60 * 60)
+    previous_by_slug = {c['slug']: c for c in previous} if previous is not None else {}
+
     for slug in slugs:
         if slug not in class_map:
             continue
-        for inst in class_map[slug]:
+        if previous is not None and pages is not None:
+            predicted = _predict_instance(class_map[slug][0], pages.get(slug), previous_by_slug.get(slug),
+                                          min_timestamp, cutoff_timestamp, now)
+            if predicted is not None:
+                class_ = class_map[slug][0].copy()
+                class_['timestamp'], class_['event_id'], class_['schedule_id'], class_['description'], _ = predicted
+                class_['slug'] = slug
+                instances[slug] = class_
+                metrics.inc('schedule_instances_total', source='predicted')
+                continue
+        for n, inst in enumerate(class_map[slug]):
             class_ = inst.copy()
             page = session.get(f'https://tcsp.clubautomation.com/calendar/event-info?id={class_["event_id"]}')
             soup = BeautifulSoup(page.content, "html.parser")
-            candidate_instances = soup.find_all(class_='register-button-closed')
-            
+            closed_instances = soup.find_all(class_='register-button-closed')
+            now_instances = soup.find_all(class_='register-button-now')
+            timestamps = _extract_timestamps_from_titles(
+                instance['data-title'] for instance in closed_instances + now_instances)
+            if n == 0 and pages is not None:
+                _record_page(pages, dict(inst, slug=slug), closed_instances + now_instances, timestamps,
+                             min_timestamp, now)
+
             # Filter candidate_instances to be within 48 hours to 9 days in the future
-            filtered_candidate_instances = []
-            for instance in candidate_instances:
-                instance_timestamp = _extract_timestamp_from_title(instance['data-title'])
-                if min_timestamp <= instance_timestamp <= cutoff_timestamp:
-                    filtered_candidate_instances.append(instance)
-            candidate_instances = filtered_candidate_instances
-            
+            in_window = [min_timestamp <= ts <= cutoff_timestamp for ts in timestamps]
+            candidate_instances = [i for i, ok in zip(closed_instances, in_window) if ok]
+
             eligible_instances = list(filter(
                     lambda x: (x.text != 'Full' and x.text != 'Closed') or x.text == 'Not yet open',
                     candidate_instances
                 ))
-            
+
             # Also filter register-button-now instances for the same criteria
-            now_instances = soup.find_all(class_='register-button-now')
-            filtered_now_instances = []
-            for instance in now_instances:
-                instance_timestamp = _extract_timestamp_from_title(instance['data-title'])
-                if min_timestamp <= instance_timestamp <= cutoff_timestamp:
-                    filtered_now_instances.append(instance)
-            candidate_instances = filtered_now_instances
-            
+            candidate_instances = [i for i, ok in zip(now_instances, in_window[len(closed_instances):]) if ok]
+
             eligible_instances = candidate_instances + eligible_instances
 
             if not eligible_instances:
@@ -184,10 +333,12 @@ def build_next_week_schedule(session: requests.Session, class_map: dict[str, dic
             class_['slug'] = slug
             class_['timestamp'] = _extract_timestamp_from_title(class_['description'])
             instances[slug] = class_
+            metrics.inc('schedule_instances_total', source='fetched')
             break
     return sorted(instances.values(), key=lambda x: x['timestamp'])
 
 
+@profiling.timed()
 def build_class_map(session: requests.Session):
     all_classes = session.get(
         'https://tcsp.clubautomation.com/calendar/classes-by-class',
@@ -207,6 +358,7 @@ def build_class_map(session: requests.Session):
     return result
 
 
+@profiling.timed()
 def sign_in(session: requests.Session, email=os.getenv("EMAIL"), password=os.getenv("PASSWORD")):
     page = session.get('https://tcsp.clubautomation.com')
     soup = BeautifulSoup(page.content, "html.parser")
@@ -275,10 +427,12 @@ def register_for_instance(session, event_id, schedule_id, user_id):
     }
     
     # Try fast-register first
-    register_resp = session.post(
-        'https://tcsp.clubautomation.com/calendar/fast-register-event',
-        data=body
-    )
+    metrics.inc('booking_attempts_total', endpoint='fast_register')
+    with metrics.span('fast_register'):
+        register_resp = session.post(
+            'https://tcsp.clubautomation.com/calendar/fast-register-event',
+            data=body
+        )
     register_resp.raise_for_status()
     result = register_resp.json()
     
@@ -302,10 +456,12 @@ def _register_via_cart(session, event_id, schedule_id, user_id):
         "scheduleId": schedule_id,
     }
     
-    add_resp = session.post(
-        'https://tcsp.clubautomation.com/calendar/register-event',
-        data=body
-    )
+    metrics.inc('booking_attempts_total', endpoint='cart_add')
+    with metrics.span('cart_add'):
+        add_resp = session.post(
+            'https://tcsp.clubautomation.com/calendar/register-event',
+            data=body
+        )
     add_resp.raise_for_status()
     add_result = add_resp.json()
     
@@ -317,7 +473,8 @@ def _register_via_cart(session, event_id, schedule_id, user_id):
     logging.info(f"Added to cart: {add_result.get('message')}")
     
     # Step 2: Get cart page to find cart item ID and form details
-    cart_resp = session.get('https://tcsp.clubautomation.com/member/cart')
+    with metrics.span('cart_page'):
+        cart_resp = session.get('https://tcsp.clubautomation.com/member/cart')
     cart_html = cart_resp.text
     
     # Extract cart item IDs from form action
@@ -359,7 +516,9 @@ def _register_via_cart(session, event_id, schedule_id, user_id):
         checkout_data['bill_state'] = bill_state
     
     logging.info(f"Submitting checkout to {checkout_url}")
-    checkout_resp = session.post(checkout_url, data=checkout_data)
+    metrics.inc('booking_attempts_total', endpoint='cart_checkout')
+    with metrics.span('cart_checkout'):
+        checkout_resp = session.post(checkout_url, data=checkout_data)
     checkout_resp.raise_for_status()
     
     # Check if checkout succeeded (look for "Thank you" in response)
@@ -386,10 +545,15 @@ class ClientSettings(SettingsDefinition):
 
 
 class Client(object):
-    def __init__(self, settings: ClientSettings):
-        self._username = settings.username.get()
-        self._password = settings.password.get()
-        self._session = make_session()
+    def __init__(self, settings: ClientSettings = None, member: Member = DEFAULT, adapter=None,
+                 priority: str = ratelimit.BACKGROUND):
+        credentials = member.credentials()
+        if credentials is None:
+            settings = settings or ClientSettings.load()
+            credentials = settings.username.get(), settings.password.get()
+        self._username, self._password = credentials
+        self._member = member
+        self._session = make_session(adapter, priority)
         self._session.headers.update({
             "User-Agent": USER_AGENT
         })
@@ -397,10 +561,26 @@ class Client(object):
 
     def _sign_in(self):
         if not self._signed_in:
-            sign_in(self._session, email=self._username, password=self._password)
+            with metrics.span('sign_in'):
+                sign_in(self._session, email=self._username, password=self._password)
             self._signed_in = True
             logging.debug("Successfully signed in.")
 
+    def event_info(self, event_id: str) -> str:
+        """The event-info page listing a class's instances and their register buttons."""
+        self._sign_in()
+        url = f'https://tcsp.clubautomation.com/calendar/event-info?id={event_id}'
+        page = self._session.get(url)
+        page.raise_for_status()
+        if signed_out(page):
+            # long-lived clients (watcher.py) outlast the club's session
+            logging.info("Signed out by the club, signing in again.")
+            self._signed_in = False
+            self._sign_in()
+            page = self._session.get(url)
+            page.raise_for_status()
+        return page.text
+
     def refresh_class_map(self):
         self._sign_in()
         return build_class_map(self._session)
@@ -423,7 +603,8 @@ class Client(object):
 
     def register_for_instance(self, class_instance, attempts: int = 90):
         self._sign_in()
-        user_info = get_user_info(self._session)
+        with metrics.span('get_user_info'):
+            user_info = get_user_info(self._session)
         resp = {'status': -1, 'message': 'no-attempt-made'}
         for _ in range(attempts):
             resp = register_for_instance(
@@ -433,11 +614,12 @@ class Client(object):
                 user_info.get('id')
             )
 
-            if 'maximum number' in resp.get('message') or 'without payment' in resp.get('message'):
+            if failure_reason(resp):
                 break
             if successful_registration_response(resp):
-                store_booked_class(class_instance, resp)
-                cal.create_event_for_class(obj_storage, class_instance, os.environ.get('SHARED_CALENDAR_ID'))
+                store_booked_class(class_instance, resp, self._member.book_type)
+                with metrics.span('calendar_write'):
+                    cal.create_event_for_class(obj_storage, class_instance, self._member.calendar(), self._member)
                 break
             logging.debug("Open class instance not found, waiting for another attempt.")
             time.sleep(1)
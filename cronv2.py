@@ -1,73 +1,190 @@
-import os
-import sys
+import copy
+import logging
 from datetime import datetime, timedelta
+from typing import Generator, List
 
-import cal
-from client import Client, ClientSettings
-from storage import Storage
-import mail_client
-import logging
-logging.basicConfig(
-    format='[%(asctime)s][%(levelname)-0s] %(message)s',
-    level=logging.ERROR,
-    datefmt='%Y-%m-%d %H:%M:%S')
-storage = Storage('storage')
-
-plan_id, plan = storage.latest('plan')
-if not plan:
-    sys.exit()
-
-now = datetime.now()
-schedule_window = timedelta(days=2, minutes=2)
-settings = ClientSettings.load()
-
-for slug, clazz in plan.items():
-    if clazz.get('scheduled') or clazz.get('failed'):
-        continue
-
-    class_start = datetime.fromtimestamp(clazz['timestamp'])
-    if class_start < now:
-        continue
-    if (class_start - now) <= schedule_window:
-        client = Client(settings)
-        result = client.register_for_instance(clazz)
-        if result.get('status') == 1 or 'already registered' in result.get('message'):
-            clazz['scheduled'] = True
-            cal.create_event_for_class(storage, clazz, os.environ.get('SHARED_CALENDAR_ID'))
+import members
+import metrics
+import profiling
+from members import DEFAULT, Member
+from plans import merge_onto
+from storage import Storage, open_storage
+
+# Runs every minute and almost always finds nothing to book, so everything
+# heavy (google api client, requests, bs4, smtp) is only imported once a
+# class is actually due. See benchmarks/bench_cron_import.py.
+
+# the club opens registration two days ahead, start trying just before
+BOOKING_WINDOW = timedelta(days=2)
+SCHEDULE_WINDOW = BOOKING_WINDOW + timedelta(minutes=2)
+
+
+def due_classes(plan: dict, now: datetime, window: timedelta = SCHEDULE_WINDOW) -> Generator[dict, None, None]:
+    """Planned classes that still need booking and whose booking window is open."""
+    for slug, clazz in plan.items():
+        if clazz.get('scheduled') or clazz.get('failed'):
+            continue
+
+        class_start = datetime.fromtimestamp(clazz['timestamp'])
+        if class_start < now:
+            continue
+        if (class_start - now) <= window:
+            yield clazz
+
+
+def send_failure_email(clazz: dict, result: dict, member: Member = DEFAULT):
+    import mail_client
+
+    # Create detailed HTML email body
+    class_time = datetime.fromtimestamp(clazz['timestamp']).strftime('%Y-%m-%d %I:%M %p')
+    cart_url = result.get('cart_url', 'https://tcsp.clubautomation.com/member/cart')
+    email_body = f"""
+    <h2>Tennis Class Booking Error</h2>
+    <p>An error occurred while trying to book the following tennis class:</p>
+    <h3>Class Details:</h3>
+    <ul>
+        <li><strong>Date/Time:</strong> {class_time}</li>
+        <li><strong>Class Name:</strong> {clazz.get('name', 'N/A')}</li>
+        <li><strong>Instructor:</strong> {clazz.get('instructor', 'N/A')}</li>
+        <li><strong>Location:</strong> {clazz.get('location', 'N/A')}</li>
+        <li><strong>Duration:</strong> {clazz.get('duration', 'N/A')} minutes</li>
+        <li><strong>Slug:</strong> {clazz.get('slug', 'N/A')}</li>
+    </ul>
+    <h3>Error Details:</h3>
+    <p>{result.get('message', 'Unknown error')}</p>
+    <h3>Manual Action Required:</h3>
+    <p>If items were added to your cart, you can complete checkout manually:</p>
+    <p><a href="{cart_url}">{cart_url}</a></p>
+    <p><em>Attempted booking at: {datetime.now().strftime('%Y-%m-%d %I:%M %p')}</em></p>
+    """
+
+    # Send error email
+    mail_client.send_email(
+        subject=f"Tennis Booking Error - {class_time}",
+        body=email_body,
+        recipient=member.email
+    )
+
+
+class Due(object):
+    """A member's plan with classes due, as read at the start of the run."""
+
+    def __init__(self, member: Member, plan_id: str, plan: dict, version: str, classes: list):
+        self.member = member
+        self.plan_id = plan_id
+        self.plan = plan
+        self.version = version
+        self.classes = classes
+
+
+def find_due(storage: Storage, now: datetime) -> List[Due]:
+    """Every member's due classes: one index read plus one plan per member."""
+    found = []
+    for member in members.load_members(storage):
+        plan_id = storage.head(member.plan_type)
+        if not plan_id:
+            continue
+        plan, version = storage.get_versioned(plan_id)
+        if not plan:
+            continue
+        due = list(due_classes(plan, now))
+        if due:
+            found.append(Due(member, plan_id, plan, version, due))
+    return found
+
+
+def book_members(storage: Storage, work: List[Due]):
+    """
+    Book every member at once, so nobody waits for the others' classes. Each
+    member gets a session of their own over one shared connection pool.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    from client import pooled_adapter
+
+    adapter = pooled_adapter(len(work))
+    try:
+        with ThreadPoolExecutor(max_workers=len(work), thread_name_prefix='book') as pool:
+            futures = [pool.submit(book_classes, storage, due.plan_id, due.plan, due.version, due.classes,
+                                   due.member, adapter) for due in work]
+    finally:
+        adapter.close()
+
+    # one member failing doesn't stop the others, but still fails the run
+    errors = []
+    for due, future in zip(work, futures):
+        error = future.exception()
+        if error is not None:
+            logging.error(f"Booking for {due.member.name} failed", exc_info=error)
+            errors.append(error)
+    if errors:
+        raise errors[0]
+
+
+def book_classes(storage: Storage, plan_id: str, plan: dict, version: str, due: list,
+                 member: Member = DEFAULT, adapter=None):
+    from client import Client
+    from ratelimit import BOOKING
+
+    base = copy.deepcopy(plan)
+    try:
+        # sign in and everything else on the way to booking goes ahead of background scraping
+        client = Client(member=member, adapter=adapter, priority=BOOKING)
+        for clazz in due:
+            book_class(storage, client, clazz, member)
+
+        # booking can take minutes, the web app may have edited the plan meanwhile
+        storage.put(plan_id, plan, expected_version=version, merge=merge_onto(base))
+    finally:
+        metrics.flush(storage)
+
+
+def book_class(storage: Storage, client, clazz: dict, member: Member = DEFAULT):
+    import cal
+    from client import failure_reason
+
+    try:
+        with metrics.span('register'):
+            result = client.register_for_instance(clazz)
+    except Exception:
+        metrics.inc('booking_outcomes_total', outcome='error')
+        raise
+
+    if result.get('status') == 1 or 'already registered' in result.get('message'):
+        clazz['scheduled'] = True
+        metrics.inc('booking_outcomes_total', outcome='booked')
+        window_opened = clazz['timestamp'] - BOOKING_WINDOW.total_seconds()
+        metrics.observe('booking_window_delay_seconds', max(0.0, datetime.now().timestamp() - window_opened))
+        with metrics.span('calendar_write'):
+            cal.create_event_for_class(storage, clazz, member.calendar(), member)
+    else:
+        error_message = f"Failed to sign up for {clazz['slug']}: {result.get('message')}"
+        logging.error(error_message)
+        send_failure_email(clazz, result, member)
+
+        reason = failure_reason(result)
+        if reason:
+            clazz['failed'] = True
+            # watcher.py only waits on classes that were full
+            clazz['failure'] = reason
+            metrics.inc('booking_outcomes_total', outcome='failed')
         else:
-            error_message = f"Failed to sign up for {clazz['slug']}: {result.get('message')}"
-            logging.error(error_message)
-            
-            # Create detailed HTML email body
-            class_time = datetime.fromtimestamp(clazz['timestamp']).strftime('%Y-%m-%d %I:%M %p')
-            cart_url = result.get('cart_url', 'https://tcsp.clubautomation.com/member/cart')
-            email_body = f"""
-            <h2>Tennis Class Booking Error</h2>
-            <p>An error occurred while trying to book the following tennis class:</p>
-            <h3>Class Details:</h3>
-            <ul>
-                <li><strong>Date/Time:</strong> {class_time}</li>
-                <li><strong>Class Name:</strong> {clazz.get('name', 'N/A')}</li>
-                <li><strong>Instructor:</strong> {clazz.get('instructor', 'N/A')}</li>
-                <li><strong>Location:</strong> {clazz.get('location', 'N/A')}</li>
-                <li><strong>Duration:</strong> {clazz.get('duration', 'N/A')} minutes</li>
-                <li><strong>Slug:</strong> {clazz.get('slug', 'N/A')}</li>
-            </ul>
-            <h3>Error Details:</h3>
-            <p>{result.get('message', 'Unknown error')}</p>
-            <h3>Manual Action Required:</h3>
-            <p>If items were added to your cart, you can complete checkout manually:</p>
-            <p><a href="{cart_url}">{cart_url}</a></p>
-            <p><em>Attempted booking at: {datetime.now().strftime('%Y-%m-%d %I:%M %p')}</em></p>
-            """
-            
-            # Send error email
-            mail_client.send_email(
-                subject=f"Tennis Booking Error - {class_time}",
-                body=email_body
-            )
-            
-            if 'maximum' in result.get('message') or 'without payment' in result.get('message'):
-                clazz['failed'] = True
-
-storage.put(plan_id, plan)
\ No newline at end of file
+            metrics.inc('booking_outcomes_total', outcome='retry')
+
+
+def main(storage_root='storage'):
+    logging.basicConfig(
+        format='[%(asctime)s][%(levelname)-0s] %(message)s',
+        level=logging.ERROR,
+        datefmt='%Y-%m-%d %H:%M:%S')
+    storage = open_storage(storage_root)
+
+    work = find_due(storage, datetime.now())
+    if not work:
+        return
+    # only runs that book anything are profiled, not the idle minutes
+    with profiling.profiled('cron', storage):
+        book_members(storage, work)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,186 @@
+"""
+Live plan status for the schedule page, streamed as server-sent events.
+
+Bookings land from cronv2.py, a different process, so changes are picked up
+by polling: one watcher thread per plan type (one per member, see members.py)
+stats the current plan file every few seconds and only decodes it when it
+changed. Each change is fanned out to every page connected to that member's
+feed as a per-slug status event.
+
+Every open stream holds a server thread, so streams are short (pages
+reconnect on their own) and capped per process at MAX_STREAMS, well below the
+server's thread count, over all members' feeds; past the cap /events answers 503 and the page retries
+later. Clicks and saves always have threads left.
+"""
+import json
+import logging
+import queue
+import threading
+import time
+from typing import Dict, Generator, List, Tuple, Union
+
+from storage import Storage
+
+POLL_INTERVAL = 2.0  # seconds between checks for a changed plan
+HEARTBEAT_INTERVAL = 15.0  # keeps proxies from closing an idle stream
+STREAM_DURATION = 25.0  # browsers reconnect on their own, this frees the thread
+RETRY_MS = 5000
+# open streams per process; web.main() sets it from the thread count
+MAX_STREAMS = 2
+
+
+def plan_status(plan: dict) -> Dict[str, dict]:
+    return {
+        slug: {
+            'checked': True,
+            'scheduled': bool(class_.get('scheduled', False)),
+            'failed': bool(class_.get('failed', False)),
+        }
+        for slug, class_ in plan.items()
+    }
+
+
+def diff_status(plan_id: str, old: Dict[str, dict], new: Dict[str, dict]) -> List[dict]:
+    """Per-slug events for every class whose status differs between snapshots."""
+    unplanned = {'checked': False, 'scheduled': False, 'failed': False}
+    changes = []
+    for slug in sorted(old.keys() | new.keys()):
+        status = new.get(slug, unplanned)
+        if old.get(slug, unplanned) != status:
+            changes.append({'plan_id': plan_id, 'slug': slug, **status})
+    return changes
+
+
+class PlanStatusFeed(object):
+    def __init__(self, s: Storage, plan_type: str = 'plan', interval: float = POLL_INTERVAL):
+        self._storage = s
+        self._plan_type = plan_type
+        self._interval = interval
+        self._lock = threading.Lock()
+        self._subscribers = set()
+        self._thread = None
+        # (plan id, plan mtime) as of the last poll
+        self._seen: Tuple = (None, None)
+        self._plan_id = None
+        self._status: Dict[str, dict] = {}
+
+    def snapshot(self) -> List[dict]:
+        with self._lock:
+            return diff_status(self._plan_id, {}, self._status)
+
+    def poll(self) -> List[dict]:
+        """Check storage once; broadcast and return any status changes."""
+        # a single small ref file, cheap enough to read every poll
+        plan_id = self._storage.head(self._plan_type)
+        if plan_id is None:
+            return []
+
+        seen = (plan_id, self._storage.last_modified(plan_id))
+        with self._lock:
+            if seen == self._seen:
+                return []
+            self._seen = seen
+        plan = self._storage.get(plan_id) or {}
+
+        with self._lock:
+            status = plan_status(plan)
+            old = self._status if plan_id == self._plan_id else {}
+            changes = diff_status(plan_id, old, status)
+            self._plan_id, self._status = plan_id, status
+            subscribers = list(self._subscribers)
+        for q in subscribers:
+            for change in changes:
+                q.put(change)
+        return changes
+
+    def _run(self):
+        while True:
+            with self._lock:
+                if not self._subscribers:
+                    self._thread = None
+                    return
+            try:
+                self.poll()
+            except Exception:
+                logging.exception("Failed to poll plan status")
+            time.sleep(self._interval)
+
+    def subscribe(self, limit: int = None) -> Union[queue.Queue, None]:
+        """A queue of status changes, or None if `limit` subscribers are already connected."""
+        q = queue.Queue()
+        with self._lock:
+            if limit is not None and len(self._subscribers) >= limit:
+                return None
+            self._subscribers.add(q)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name=f'{self._plan_type}-status', daemon=True)
+                self._thread.start()
+        return q
+
+    def unsubscribe(self, q: queue.Queue) -> None:
+        with self._lock:
+            self._subscribers.discard(q)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._subscribers)
+
+
+class PlanStatusFeeds(object):
+    """A PlanStatusFeed per plan type, made on first use, sharing one stream limit."""
+
+    def __init__(self, s: Storage, interval: float = POLL_INTERVAL):
+        self._storage = s
+        self._interval = interval
+        self._lock = threading.Lock()
+        self._feeds: Dict[str, PlanStatusFeed] = {}
+
+    def feed(self, plan_type: str) -> PlanStatusFeed:
+        with self._lock:
+            return self._feed(plan_type)
+
+    def _feed(self, plan_type: str) -> PlanStatusFeed:
+        if plan_type not in self._feeds:
+            self._feeds[plan_type] = PlanStatusFeed(self._storage, plan_type, self._interval)
+        return self._feeds[plan_type]
+
+    def subscribe(self, plan_type: str, limit: int = None) -> Tuple[PlanStatusFeed, Union[queue.Queue, None]]:
+        """The plan type's feed and a queue of its changes; None for the queue past `limit` streams in all."""
+        with self._lock:
+            feed = self._feed(plan_type)
+            if limit is not None and sum(len(f) for f in self._feeds.values()) >= limit:
+                return feed, None
+            return feed, feed.subscribe()
+
+
+def _format(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def stream(feed: PlanStatusFeed, q: queue.Queue = None,
+           duration: float = STREAM_DURATION) -> Generator[str, None, None]:
+    """
+    The body of an event stream: the current status of every planned class,
+    then one `status` event per change until the stream times out.
+    `q` is a subscription already taken from the feed, if any.
+    """
+    q = q or feed.subscribe()
+    try:
+        yield f"retry: {RETRY_MS}\n\n"
+        feed.poll()
+        # anything queued by that poll is already part of the snapshot
+        while not q.empty():
+            q.get_nowait()
+        for change in feed.snapshot():
+            yield _format('status', change)
+
+        deadline = time.time() + duration
+        while time.time() < deadline:
+            try:
+                change = q.get(timeout=HEARTBEAT_INTERVAL)
+            except queue.Empty:
+                yield ": keep-alive\n\n"
+                continue
+            yield _format('status', change)
+    finally:
+        feed.unsubscribe(q)
@@ -0,0 +1,112 @@
+"""
+Background jobs for slow side effects of web requests, e.g. propagating a
+plan change to Google Calendar.
+
+Jobs run on a single worker thread, in submission order, so calendar updates
+for consecutive plan saves never interleave. Each job's status is stored as a
+`job_*` object so any web worker process can report on it.
+
+Jobs only live in the process that submitted them. A job whose process died
+before finishing it is reported as failed, and fail_orphaned() marks every
+unfinished job from an earlier process failed when the server starts.
+"""
+import datetime
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Union
+
+import tokens
+from storage import Storage
+
+PENDING = 'pending'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='jobs')
+
+
+def _now() -> float:
+    return datetime.datetime.now().timestamp()
+
+
+def _process_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _orphaned(job: dict, started: float = None) -> bool:
+    """An unfinished job whose process is gone (or was an earlier process with our pid)."""
+    if job.get('status') not in (PENDING, RUNNING) or 'pid' not in job:
+        return False
+    if job['pid'] == os.getpid():
+        return started is not None and job.get('created', 0) < started
+    return not _process_alive(job['pid'])
+
+
+def _fail(s: Storage, job_id: str) -> None:
+    _update(s, job_id, status=FAILED, finished=_now(), error='Interrupted: the web server restarted')
+
+
+def _update(s: Storage, job_id: str, **fields) -> None:
+    job = s.get(job_id) or {}
+    job.update(fields)
+    s.put(job_id, job)
+
+
+def _run(s: Storage, job_id: str, fn: Callable, args, kwargs) -> None:
+    _update(s, job_id, status=RUNNING, started=_now())
+    try:
+        fn(*args, **kwargs)
+    except Exception as e:
+        logging.exception(f"Job {job_id} failed")
+        _update(s, job_id, status=FAILED, finished=_now(), error=str(e))
+        return
+    _update(s, job_id, status=DONE, finished=_now())
+
+
+def submit(s: Storage, name: str, fn: Callable, *args, **kwargs) -> str:
+    """
+    Queue fn(*args, **kwargs) to run in the background.
+    :return: the job id, to look up with status()
+    """
+    job_id = tokens.generate_token('job')
+    s.put(job_id, {'name': name, 'status': PENDING, 'created': _now(), 'pid': os.getpid()})
+    _executor.submit(_run, s, job_id, fn, args, kwargs)
+    return job_id
+
+
+def status(s: Storage, job_id: str) -> Union[dict, None]:
+    if not job_id.startswith('job_') or not tokens.is_valid_token(job_id):
+        return None
+    job = s.get(job_id)
+    if job is not None and _orphaned(job):
+        _fail(s, job_id)
+        job = s.get(job_id)
+    return job
+
+
+def fail_orphaned(s: Storage, started: float = None) -> int:
+    """
+    Mark unfinished jobs left by processes that are gone as failed, so pages
+    following them stop waiting. Call once at startup.
+    :return: how many jobs were marked
+    """
+    started = _now() if started is None else started
+    orphans = [job_id for job_id, job in s.list('job', {'status': {'$in': [PENDING, RUNNING]}})
+               if _orphaned(job, started)]
+    for job_id in orphans:
+        _fail(s, job_id)
+    return len(orphans)
+
+
+def wait_for_idle(timeout: float = None) -> None:
+    """Block until every job submitted so far has finished."""
+    # the single worker runs jobs in order, so a no-op queued now runs last
+    _executor.submit(lambda: None).result(timeout=timeout)
@@ -0,0 +1,185 @@
+"""
+Latency and error report over the HTTP logs client.http_log() records.
+
+    python3 log_report.py [--days 7] [--bucket day|hour] [--json]
+
+Requests are grouped by endpoint (fast-register-event, event-info, login,
+cart...) and reported per time bucket: volume, error rate and p50/p95/p99
+latency. Each endpoint is also compared with the window before, and flagged
+when it got noticeably slower or started failing more.
+
+Records are streamed from storage one at a time and only their durations are
+kept, so a week of multi-hundred-KB logs doesn't need to fit in memory. Logs
+older than the previous window are never opened.
+"""
+import argparse
+import datetime
+import json
+import math
+import re
+import sys
+from collections import defaultdict
+from typing import Dict, Iterable, List, Tuple, Union
+from urllib.parse import urlparse
+
+from storage import open_storage
+
+# checked in order, first match wins
+ENDPOINT_PATTERNS = [
+    (re.compile(r'^/member/cart/step/'), 'cart-checkout'),
+    (re.compile(r'^/member/cart'), 'cart'),
+    (re.compile(r'^/login/'), 'login'),
+    (re.compile(r'^/?$'), 'home'),
+]
+
+BUCKET_FORMATS = {
+    'hour': '%Y-%m-%d %H:00',
+    'day': '%Y-%m-%d',
+}
+
+PERCENTILES = (50, 95, 99)
+# an endpoint regressed if its p95 grew by this factor, or its error rate by
+# this many percentage points, with at least MIN_SAMPLES requests on each side
+LATENCY_REGRESSION = 1.5
+ERROR_REGRESSION = 0.05
+MIN_SAMPLES = 5
+
+
+def normalize_endpoint(url: str) -> str:
+    path = urlparse(url or '').path
+    for pattern, name in ENDPOINT_PATTERNS:
+        if pattern.search(path):
+            return name
+    # the last path segment that isn't an id, e.g. /calendar/event-info -> event-info
+    segments = [s for s in path.split('/') if s and not re.fullmatch(r'[\d,]+', s)]
+    return segments[-1] if segments else 'home'
+
+
+def percentile(sorted_values: List[float], p: float) -> Union[float, None]:
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    rank = max(1, math.ceil(p / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+class Stats(object):
+    def __init__(self):
+        self.durations: List[float] = []
+        self.errors = 0
+
+    def add(self, duration: float, error: bool) -> None:
+        self.durations.append(duration)
+        self.errors += error
+
+    def summary(self) -> dict:
+        durations = sorted(self.durations)
+        result = {'requests': len(durations), 'error_rate': self.errors / len(durations) if durations else 0.0}
+        for p in PERCENTILES:
+            result[f'p{p}'] = percentile(durations, p)
+        return result
+
+
+def _is_error(record: dict) -> bool:
+    status = (record.get('response') or {}).get('status')
+    return not isinstance(status, int) or status >= 400
+
+
+def read_records(records: Iterable[Tuple[str, dict]]) -> Iterable[Tuple[float, str, float, bool]]:
+    """(time, endpoint, duration, is error) of each log record."""
+    for _, record in records:
+        if record.get('time') is None or record.get('duration') is None:
+            continue
+        endpoint = normalize_endpoint((record.get('request') or {}).get('url'))
+        yield record['time'], endpoint, record['duration'], _is_error(record)
+
+
+def analyze(rows: Iterable[Tuple[float, str, float, bool]], now: float, window: float, bucket: str = 'day') -> dict:
+    """
+    Per-endpoint stats for the window ending at `now`, broken down by time
+    bucket, compared with the same-length window before it.
+    """
+    start = now - window
+    previous_start = start - window
+    buckets: Dict[Tuple[str, str], Stats] = defaultdict(Stats)
+    current: Dict[str, Stats] = defaultdict(Stats)
+    previous: Dict[str, Stats] = defaultdict(Stats)
+
+    for when, endpoint, duration, error in rows:
+        if start <= when < now:
+            current[endpoint].add(duration, error)
+            key = datetime.datetime.fromtimestamp(when).strftime(BUCKET_FORMATS[bucket])
+            buckets[(endpoint, key)].add(duration, error)
+        elif previous_start <= when < start:
+            previous[endpoint].add(duration, error)
+
+    report = {}
+    for endpoint in sorted(current.keys() | previous.keys()):
+        now_summary = current[endpoint].summary()
+        before = previous[endpoint].summary()
+        report[endpoint] = {
+            'window': now_summary,
+            'previous_window': before,
+            'regressions': regressions(now_summary, before),
+            'buckets': {
+                key: stats.summary() for (name, key), stats in sorted(buckets.items()) if name == endpoint
+            },
+        }
+    return report
+
+
+def regressions(current: dict, previous: dict) -> List[str]:
+    if current['requests'] < MIN_SAMPLES or previous['requests'] < MIN_SAMPLES:
+        return []
+    flags = []
+    if previous['p95'] > 0 and current['p95'] > previous['p95'] * LATENCY_REGRESSION:
+        flags.append(f"p95 {previous['p95']:.2f}s -> {current['p95']:.2f}s")
+    if current['error_rate'] - previous['error_rate'] > ERROR_REGRESSION:
+        flags.append(f"errors {previous['error_rate']:.0%} -> {current['error_rate']:.0%}")
+    return flags
+
+
+def _format_row(name: str, s: dict) -> str:
+    if not s['requests']:
+        return f"  {name:24} {0:7d}"
+    return (f"  {name:24} {s['requests']:7d} {s['error_rate']:7.1%} "
+            f"{s['p50']:8.3f} {s['p95']:8.3f} {s['p99']:8.3f}")
+
+
+def print_report(report: dict, out=None) -> None:
+    out = out or sys.stdout
+    header = f"  {'':24} {'reqs':>7} {'errors':>7} {'p50 s':>8} {'p95 s':>8} {'p99 s':>8}"
+    for endpoint, r in report.items():
+        flag = f"  REGRESSED: {'; '.join(r['regressions'])}" if r['regressions'] else ''
+        print(f"{endpoint}{flag}", file=out)
+        print(header, file=out)
+        for key, s in r['buckets'].items():
+            print(_format_row(key, s), file=out)
+        print(_format_row('window', r['window']), file=out)
+        print(_format_row('previous window', r['previous_window']), file=out)
+        print(file=out)
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description='Latency and error report over the HTTP logs')
+    parser.add_argument('--log-dir', default='./log')
+    parser.add_argument('--days', type=float, default=7, help='length of the window, and of the one compared with')
+    parser.add_argument('--bucket', choices=sorted(BUCKET_FORMATS), default='day')
+    parser.add_argument('--json', action='store_true', help='print machine-readable results')
+    opts = parser.parse_args(args)
+
+    # every record is read once, caching them would only cost memory
+    log_storage = open_storage(opts.log_dir, cache_bytes=0)
+    now = datetime.datetime.now().timestamp()
+    window = opts.days * 24 * 60 * 60
+    records = log_storage.list('http', {'$timestamp': {'$gte': now - 2 * window}})
+    report = analyze(read_records(records), now, window, opts.bucket)
+
+    if opts.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
+
+
+if __name__ == '__main__':
+    main()
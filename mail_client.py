@@ -37,9 +37,9 @@ def send_email(subject, body, recipient=None):
         return False
 
 
-def send_plan_email(schedule_id, plan_html):
+def send_plan_email(schedule_id, plan_html, recipient=None):
     subject = f"Weekly Tennis Plan"
     body = plan_html
-    success = send_email(subject, body)
+    success = send_email(subject, body, recipient)
     if not success:
         logging.error(f"Failed to send email for schedule {schedule_id}")
\ No newline at end of file
@@ -0,0 +1,160 @@
+"""
+Members whose classes are planned and booked from this one deployment.
+
+Members are kept in the `members` index in Storage, keyed by a short
+alphanumeric slug:
+
+    {'ana': {'name': 'Ana', 'email': 'ana@example.com', 'password_env': 'ANA_PASSWORD',
+             'calendar_id': '...'}}
+
+Passwords are never stored: a member's is read from the environment
+variable `password_env` names, which must be set wherever cron runs.
+
+There is always the default member, slug '', the single account this app
+started out with: its credentials come from ClientSettings, and its plans,
+bookings and calendar events keep their `plan`, `book` and `cal_event` types.
+Every other member's objects get the slug appended, `plan_ana`, `book_ana`,
+so heads, the booking index and cleanup work per member as they are. The
+web pages and plan API edit the default member's plan, or a member's with
+?member=<slug>, e.g. /schedule?member=ana.
+
+    python3 members.py list
+    python3 members.py add <slug> <name> <email> --password-env VAR [--calendar-id ID]
+    python3 members.py remove <slug>
+
+Cheap to import: cronv2.py loads members every minute.
+"""
+import argparse
+import logging
+import os
+import re
+import sys
+from typing import List, Tuple, Union
+
+INDEX_NAME = 'members'
+# types that belong to a member, rather than to everyone (sched) or no one (http)
+MEMBER_TYPES = ('plan', 'book', 'cal_event')
+DEFAULT_NAME = os.environ.get('MEMBER_NAME', 'Sean')
+
+_SLUG = re.compile(r'^[A-Za-z0-9]+$')
+
+
+class Member(object):
+    def __init__(self, slug: str = '', name: str = DEFAULT_NAME, email: str = None, password_env: str = None,
+                 calendar_id: str = None):
+        if slug and not _SLUG.match(slug):
+            raise ValueError(f"Member slugs are letters and digits only: {slug!r}")
+        self.slug = slug
+        self.name = name
+        self.email = email
+        self.password_env = password_env
+        self.calendar_id = calendar_id
+
+    def typed(self, obj_type: str) -> str:
+        """This member's version of a Storage type, e.g. plan -> plan_ana."""
+        if not self.slug or obj_type not in MEMBER_TYPES:
+            return obj_type
+        return f"{obj_type}_{self.slug}"
+
+    @property
+    def plan_type(self) -> str:
+        return self.typed('plan')
+
+    @property
+    def book_type(self) -> str:
+        return self.typed('book')
+
+    @property
+    def cal_event_type(self) -> str:
+        return self.typed('cal_event')
+
+    def credentials(self) -> Union[Tuple[str, str], None]:
+        """(email, password), or None to fall back to ClientSettings."""
+        if not self.email:
+            return None
+        if not self.password_env:
+            raise ValueError(f"Member {self.slug!r} has no password_env, add them again with --password-env")
+        password = os.environ.get(self.password_env)
+        if not password:
+            raise ValueError(f"Member {self.slug!r}: environment variable {self.password_env} is not set")
+        return self.email, password
+
+    def calendar(self) -> Union[str, None]:
+        return self.calendar_id or os.environ.get('SHARED_CALENDAR_ID')
+
+    def to_dict(self) -> dict:
+        fields = {'name': self.name, 'email': self.email, 'password_env': self.password_env,
+                  'calendar_id': self.calendar_id}
+        return {k: v for k, v in fields.items() if v is not None}
+
+    def __repr__(self):
+        return f"Member({self.slug!r}, {self.name!r})"
+
+
+DEFAULT = Member()
+
+
+def load_members(s) -> List[Member]:
+    """The default member, then everyone in the members index."""
+    index = s.get_index(INDEX_NAME) or {}
+    default = _member('', index['']) if '' in index else DEFAULT
+    return [default] + [_member(slug, fields) for slug, fields in sorted(index.items()) if slug]
+
+
+def _member(slug: str, fields: dict) -> Member:
+    fields = dict(fields)
+    if fields.pop('password', None) is not None:
+        # from before passwords had to come from the environment
+        logging.warning(f"Ignoring the password stored for member {slug!r}, set password_env instead")
+    return Member(slug, **fields)
+
+
+def add_member(s, member: Member) -> None:
+    def update(index):
+        index = index or {}
+        index[member.slug] = member.to_dict()
+        return index
+    s.update_index(INDEX_NAME, update)
+
+
+def remove_member(s, slug: str) -> bool:
+    removed = []
+
+    def update(index):
+        index = index or {}
+        if index.pop(slug, None) is not None:
+            removed.append(slug)
+        return index
+    s.update_index(INDEX_NAME, update)
+    return bool(removed)
+
+
+def main(args=None):
+    from storage import open_storage
+
+    parser = argparse.ArgumentParser(description='Manage the members classes are booked for')
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('list')
+    add = commands.add_parser('add')
+    add.add_argument('slug')
+    add.add_argument('name')
+    add.add_argument('email')
+    add.add_argument('--password-env', required=True, help='environment variable holding the password')
+    add.add_argument('--calendar-id')
+    remove = commands.add_parser('remove')
+    remove.add_argument('slug')
+    opts = parser.parse_args(args)
+
+    s = open_storage('storage')
+    if opts.command == 'add':
+        add_member(s, Member(opts.slug, opts.name, opts.email, password_env=opts.password_env,
+                             calendar_id=opts.calendar_id))
+    elif opts.command == 'remove' and not remove_member(s, opts.slug):
+        sys.exit(f"No member {opts.slug}")
+    for member in load_members(s):
+        print(f"{member.slug or '(default)':12} {member.name:16} {member.email or '(ClientSettings)':32} "
+              f"{member.plan_type}")
+
+
+if __name__ == '__main__':
+    main()
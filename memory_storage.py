@@ -0,0 +1,217 @@
+"""
+Storage without the disk, for tests, benchmarks and ephemeral runs.
+
+MemoryStorage has the interface and semantics of storage.Storage: token ids,
+compare-and-swap puts, heads, queries and retention cleanup. Objects go
+through the codec on the way in, so what comes back is what the file store
+would return (int keys become strings, tuples lists).
+
+Nothing is shared between processes. snapshot() and restore() move the
+contents to and from a directory in the on-disk layout, so a run can start
+from, or leave behind, something the file store can open.
+
+Select it with STORAGE_BACKEND=memory, see storage.open_storage().
+"""
+import os
+import threading
+import time
+from datetime import timedelta
+from typing import Callable, Dict, Generator, List, Tuple, Union
+
+import serializers
+import tokens
+from query import Query
+from storage import (ABSENT, CLEANUP_BATCH_SIZE, MAX_MERGE_ATTEMPTS, CleanupReport, ConflictError, Storage,
+                     _copy, _expired, _shard, token_order)
+
+
+class _Entry(object):
+    __slots__ = ('obj', 'version', 'mtime', 'size')
+
+    def __init__(self, obj, version: str, mtime: float, size: int):
+        self.obj = obj
+        self.version = version
+        self.mtime = mtime
+        self.size = size
+
+
+class MemoryStorage(object):
+    def __init__(self, codec: str = None, cache_bytes: int = None):
+        # cache_bytes is accepted for parity with Storage, there is nothing to cache
+        self._codec = serializers.get_codec(codec or os.environ.get('STORAGE_CODEC', 'json'))
+        self._lock = threading.RLock()
+        self._objects: Dict[str, Dict[str, _Entry]] = {}
+        self._indexes: Dict[str, dict] = {}
+        self._heads: Dict[str, str] = {}
+        self._writes = 0
+
+    def _normalize(self, obj) -> Tuple[object, int]:
+        data = self._codec.encode(obj)
+        return serializers.decode(data), len(data)
+
+    def _entry(self, _id: str) -> Union[_Entry, None]:
+        if not tokens.is_valid_token(_id):
+            raise ValueError(f"Invalid _id: {_id}")
+        try:
+            obj_type, _ = _shard(_id)
+        except ValueError:
+            # like Storage, a token put() can't have written (e.g. 'job_') is just missing
+            return None
+        return self._objects.get(obj_type, {}).get(_id)
+
+    def put(self, _id: str, obj: dict, expected_version: str = None,
+            merge: Callable[[dict, dict], dict] = None) -> str:
+        """Same contract as Storage.put()."""
+        obj_type, _ = _shard(_id)
+        for _ in range(MAX_MERGE_ATTEMPTS):
+            stored, size = self._normalize(obj)
+            with self._lock:
+                current = self.version(_id) or ABSENT
+                if expected_version is None or current == expected_version:
+                    return self._write(obj_type, _id, stored, size)
+                if merge is None:
+                    raise ConflictError(f"{_id} changed: expected version {expected_version}, found {current}")
+                theirs, expected_version = self.get_versioned(_id)
+                expected_version = expected_version or ABSENT
+            obj = merge(obj, theirs)
+        raise ConflictError(f"{_id} kept changing, gave up after {MAX_MERGE_ATTEMPTS} merges")
+
+    def _write(self, obj_type: str, _id: str, obj, size: int) -> str:
+        self._writes += 1
+        version = f"mem-{self._writes:x}"
+        self._objects.setdefault(obj_type, {})[_id] = _Entry(obj, version, time.time(), size)
+        head = self._heads.get(obj_type)
+        if head is None or token_order(_id) > token_order(head):
+            self._heads[obj_type] = _id
+        return version
+
+    def get(self, _id) -> Union[dict, None]:
+        return self.get_versioned(_id)[0]
+
+    def get_versioned(self, _id) -> Union[Tuple[dict, str], Tuple[None, None]]:
+        with self._lock:
+            entry = self._entry(_id)
+            if entry is None:
+                return None, None
+            return _copy(entry.obj), entry.version
+
+    def version(self, _id) -> Union[str, None]:
+        with self._lock:
+            entry = self._entry(_id)
+            return None if entry is None else entry.version
+
+    def last_modified(self, _id: str) -> Union[float, None]:
+        with self._lock:
+            entry = self._entry(_id)
+            return None if entry is None else entry.mtime
+
+    def cache_stats(self) -> dict:
+        return {'hits': 0, 'misses': 0, 'entries': 0, 'bytes': 0}
+
+    def get_index(self, name: str) -> Union[dict, None]:
+        with self._lock:
+            index = self._indexes.get(name)
+            return None if index is None else _copy(index)
+
+    def put_index(self, name: str, index: dict) -> None:
+        stored, _ = self._normalize(index)
+        with self._lock:
+            self._indexes[name] = stored
+
+    def update_index(self, name: str, update: Callable[[Union[dict, None]], dict]) -> dict:
+        with self._lock:
+            index = update(self.get_index(name))
+            self.put_index(name, index)
+        return index
+
+    def index_names(self) -> List[str]:
+        with self._lock:
+            return sorted(self._indexes)
+
+    def types(self) -> List[str]:
+        with self._lock:
+            return sorted(t for t, objects in self._objects.items() if objects)
+
+    def head(self, obj_type: str) -> Union[str, None]:
+        with self._lock:
+            return self._heads.get(obj_type)
+
+    def repair_refs(self) -> List[str]:
+        # heads are kept exactly by put() and cleanup(), there is nothing to repair
+        return []
+
+    def count(self, obj_type: str) -> int:
+        with self._lock:
+            return len(self._objects.get(obj_type, {}))
+
+    def list(self, obj_type: str, query: Union[dict, Query] = None) -> Generator[Tuple[str, dict], None, None]:
+        if query is not None and not isinstance(query, Query):
+            query = Query(query)
+        with self._lock:
+            entries = list(self._objects.get(obj_type, {}).items())
+
+        for _id, entry in entries:
+            if query is not None and not (query.matches_token(_id) and query.matches(entry.obj)):
+                continue
+            yield _id, _copy(entry.obj)
+
+    def latest(self, obj_type: str, query: Union[dict, Query] = None) -> Union[tuple[str, dict], tuple[None, None]]:
+        if query is None:
+            head = self.head(obj_type)
+            if head is None:
+                return None, None
+            return head, self.get(head)
+
+        objs = sorted([(*token_order(t), o) for t, o in list(self.list(obj_type, query=query))])
+        if objs:
+            return objs[-1][1:]
+        return None, None
+
+    def cleanup(self, obj_type: str, retention_count: int = None, retention_window: timedelta = None,
+                dry_run=True, deadline: float = None, batch_size: int = CLEANUP_BATCH_SIZE,
+                pause: float = 0) -> CleanupReport:
+        """Same contract as Storage.cleanup(), without any I/O to pause for."""
+        report = CleanupReport(obj_type, dry_run)
+        with self._lock:
+            entries = dict(self._objects.get(obj_type, {}))
+        expired = _expired(entries, retention_count, retention_window)
+
+        for start in range(0, len(expired), batch_size):
+            if deadline is not None and time.time() >= deadline:
+                report.complete = False
+                break
+            with self._lock:
+                for token in expired[start:start + batch_size]:
+                    if not dry_run and self._objects[obj_type].pop(token, None) is None:
+                        continue
+                    report.deleted.append(token)
+                    report.bytes_reclaimed += entries[token].size
+
+        if not dry_run and report.deleted:
+            with self._lock:
+                remaining = self._objects.get(obj_type, {})
+                if remaining:
+                    self._heads[obj_type] = max(remaining, key=token_order)
+                else:
+                    self._heads.pop(obj_type, None)
+        return report
+
+    def snapshot(self, directory: str) -> None:
+        """Write everything to a directory, in the file store's layout."""
+        target = Storage(directory, codec=self._codec.name, cache_bytes=0)
+        for obj_type in self.types():
+            for _id, obj in self.list(obj_type):
+                target.put(_id, obj)
+        for name in self.index_names():
+            target.put_index(name, self.get_index(name))
+
+    def restore(self, directory: str) -> None:
+        """Replace the contents with those of a file store directory."""
+        source = Storage(directory, cache_bytes=0)
+        with self._lock:
+            self._objects, self._indexes, self._heads = {}, {}, {}
+            for obj_type in source.types():
+                for _id, obj in source.list(obj_type):
+                    self.put(_id, obj)
+            for name in source.index_names():
+                self.put_index(name, source.get_index(name))
@@ -0,0 +1,154 @@
+"""
+Booking metrics: timing spans for each phase of a booking, counters for
+attempts and outcomes, and how long after a booking window opened a class
+was confirmed.
+
+Metrics are collected in-process and flush()ed into a `metrics` index in
+Storage, so the totals survive the short-lived cron runs that do the booking.
+web.py serves the totals in the Prometheus text format from /metrics.
+
+    with metrics.span('sign_in'):
+        ...
+    metrics.inc('booking_outcomes_total', outcome='booked')
+"""
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Tuple
+
+INDEX_NAME = 'metrics'
+
+PHASE_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+# cron runs every minute, a booking can be confirmed anywhere from seconds to
+# hours after its window opened
+DELAY_BUCKETS = (1, 5, 15, 30, 60, 120, 300, 900, 1800, 3600, 4 * 3600, 24 * 3600)
+QUEUE_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+# name -> (type, help, buckets)
+DEFINITIONS = {
+    'booking_phase_seconds': ('histogram', 'Time spent in each phase of booking a class.', PHASE_BUCKETS),
+    'booking_attempts_total': ('counter', 'Registration requests sent to the club.', None),
+    'booking_outcomes_total': ('counter', 'Classes the cron job tried to book, by outcome.', None),
+    'booking_window_delay_seconds': ('histogram', 'Delay from a booking window opening to a confirmed booking.',
+                                     DELAY_BUCKETS),
+    'waitlist_polls_total': ('counter', 'Event info polls by the waitlist watcher, by what they found.', None),
+    'club_request_queue_seconds': ('histogram', 'Time requests to the club waited for the shared rate limit.',
+                                   QUEUE_BUCKETS),
+    'schedule_instances_total': ('counter', 'Classes in the weekly schedule, by whether their event page was '
+                                            'fetched or their instance predicted from the last one.', None),
+}
+
+
+def _label_key(labels: dict) -> str:
+    return ','.join(f'{k}="{v}"' for k, v in sorted(labels.items()))
+
+
+class Registry(object):
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: Dict[str, Dict[str, float]] = {}
+        self._histograms: Dict[str, Dict[str, dict]] = {}
+
+    def inc(self, name: str, amount: float = 1, **labels) -> None:
+        key = _label_key(labels)
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + amount
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        buckets = DEFINITIONS[name][2]
+        key = _label_key(labels)
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            hist = series.setdefault(key, {'buckets': [0] * len(buckets), 'sum': 0, 'count': 0})
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    hist['buckets'][i] += 1
+            hist['sum'] += value
+            hist['count'] += 1
+
+    def drain(self) -> dict:
+        """Everything recorded so far, as a metrics index delta; starts over empty."""
+        with self._lock:
+            delta = {'counters': self._counters, 'histograms': self._histograms}
+            self._counters, self._histograms = {}, {}
+        return delta
+
+
+registry = Registry()
+
+
+def inc(name: str, amount: float = 1, **labels) -> None:
+    registry.inc(name, amount, **labels)
+
+
+def observe(name: str, value: float, **labels) -> None:
+    registry.observe(name, value, **labels)
+
+
+@contextmanager
+def span(phase: str):
+    """Time a phase of a booking into booking_phase_seconds, even if it raises."""
+    start = time.monotonic()
+    try:
+        yield
+    finally:
+        observe('booking_phase_seconds', time.monotonic() - start, phase=phase)
+
+
+def merge(state: dict, delta: dict) -> dict:
+    state = state or {'counters': {}, 'histograms': {}}
+    for name, series in delta['counters'].items():
+        totals = state['counters'].setdefault(name, {})
+        for key, value in series.items():
+            totals[key] = totals.get(key, 0) + value
+    for name, series in delta['histograms'].items():
+        totals = state['histograms'].setdefault(name, {})
+        for key, hist in series.items():
+            total = totals.setdefault(key, {'buckets': [0] * len(hist['buckets']), 'sum': 0, 'count': 0})
+            total['buckets'] = [a + b for a, b in zip(total['buckets'], hist['buckets'])]
+            total['sum'] += hist['sum']
+            total['count'] += hist['count']
+    return state
+
+
+def flush(s) -> dict:
+    """Add what this process recorded to the totals in storage; returns the totals."""
+    delta = registry.drain()
+    if not delta['counters'] and not delta['histograms']:
+        return s.get_index(INDEX_NAME) or {'counters': {}, 'histograms': {}}
+    return s.update_index(INDEX_NAME, lambda state: merge(state, delta))
+
+
+def _series(name: str, key: str, extra: str = '') -> str:
+    labels = ','.join(part for part in (key, extra) if part)
+    return f"{name}{{{labels}}}" if labels else name
+
+
+def _format_value(value: float) -> str:
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+def render(state: dict, extra_counters: List[Tuple[str, str, float]] = ()) -> str:
+    """Totals in the Prometheus text exposition format."""
+    lines = []
+    for name, (kind, help_, buckets) in DEFINITIONS.items():
+        lines.append(f"# HELP {name} {help_}")
+        lines.append(f"# TYPE {name} {kind}")
+        if kind == 'counter':
+            for key, value in sorted(state['counters'].get(name, {}).items()):
+                lines.append(f"{_series(name, key)} {_format_value(value)}")
+            continue
+        for key, hist in sorted(state['histograms'].get(name, {}).items()):
+            for bound, count in zip(buckets, hist['buckets']):
+                le = f'le="{bound}"'
+                lines.append(f"{_series(name + '_bucket', key, le)} {count}")
+            le = 'le="+Inf"'
+            lines.append(f"{_series(name + '_bucket', key, le)} {hist['count']}")
+            lines.append(f"{_series(name + '_sum', key)} {_format_value(hist['sum'])}")
+            lines.append(f"{_series(name + '_count', key)} {hist['count']}")
+    for name, help_, value in extra_counters:
+        lines.append(f"# HELP {name} {help_}")
+        lines.append(f"# TYPE {name} counter")
+        lines.append(f"{name} {_format_value(value)}")
+    return '\n'.join(lines) + '\n'
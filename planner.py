@@ -1,25 +1,44 @@
 import argparse
 from pybars import Compiler
 
+import metrics
+import profiling
 import tokens
 from client import sign_in, build_class_map, build_next_week_schedule, make_session
 from web import mark_bookings
-import os
 from cal import sync_plan_to_calendar
-from storage import Storage
+from members import Member, load_members
+from storage import open_storage
 from tokens import generate_token, swap_prefix
 
-storage = Storage('storage')
+storage = open_storage('storage')
 
+# what each class's event page listed when last fetched, see build_next_week_schedule
+PAGES_INDEX = 'sched_pages'
 
-def main(send_email=True, print_schedule=False):
-    # sign in and build next week's schedule
+
+def main(send_email=True, print_schedule=False, full_rescan=False):
+    try:
+        with profiling.profiled('planner', storage):
+            plan_next_week(send_email, print_schedule, full_rescan)
+    finally:
+        # rate limit queueing (see ratelimit.py) and pages fetched for the schedule
+        metrics.flush(storage)
+
+
+def plan_next_week(send_email=True, print_schedule=False, full_rescan=False):
+    # sign in and build next week's schedule, fetching only the event pages
+    # last week's schedule can't predict (all of them for a full rescan)
     s = make_session()
     sign_in(s)
     class_map = build_class_map(s)
-    schedule = build_next_week_schedule(s, class_map, list(filter(lambda key: key.startswith("LB") or key.startswith("LF"), class_map.keys())))
+    _, previous = (None, None) if full_rescan else storage.latest('sched')
+    pages = storage.get_index(PAGES_INDEX) or {}
+    schedule = build_next_week_schedule(s, class_map, list(filter(lambda key: key.startswith("LB") or key.startswith("LF"), class_map.keys())),
+                                        previous=previous, pages=pages)
     schedule_id = generate_token('sched', entropy=10)
     storage.put(schedule_id, schedule)
+    storage.put_index(PAGES_INDEX, pages)
 
     if print_schedule:
         print(f"Schedule ID: {schedule_id}")
@@ -28,8 +47,19 @@ def main(send_email=True, print_schedule=False):
         for cls in schedule:
             print(f"  {cls['slug']}: {cls.get('seasonal_slug', '')} | {cls.get('schedule', '')}")
 
+    with profiling.span('template_compile'):
+        compiler = Compiler()
+        source = open('invite_to_plan.html', 'r').read()
+        template = compiler.compile(source)
+
+    # one schedule for everyone, a plan for each member
+    for member in load_members(storage):
+        plan_member_week(member, schedule_id, schedule, template, send_email, print_schedule)
+
+
+def plan_member_week(member: Member, schedule_id, schedule, template, send_email=True, print_schedule=False):
     # create a plan based on previous week's plan
-    prev_plan_id, previous_plan = storage.latest("plan")
+    prev_plan_id, previous_plan = storage.latest(member.plan_type)
     next_plan = None
     if previous_plan is not None:
         plan_slugs = [s['slug'] for s in previous_plan.values()]
@@ -38,26 +68,24 @@ def main(send_email=True, print_schedule=False):
             si['slug']: si
             for si in schedule if si['slug'] in previous_plan
         }
-        next_plan_id = swap_prefix(schedule_id, 'plan')
+        next_plan_id = swap_prefix(schedule_id, member.plan_type)
     else:
-        next_plan_id, next_plan = tokens.generate_token('plan'), {}
+        next_plan_id, next_plan = tokens.generate_token(member.plan_type), {}
 
-    mark_bookings(next_plan)
-    sync_plan_to_calendar(storage, next_plan, os.environ.get('SHARED_CALENDAR_ID'))
+    with profiling.span('mark_bookings'):
+        mark_bookings(next_plan, storage, member.book_type)
+    with profiling.span('sync_plan_to_calendar'):
+        sync_plan_to_calendar(storage, next_plan, member.calendar(), member)
     storage.put(next_plan_id, next_plan)
 
     if print_schedule:
-        print(f"\nPlan ID: {next_plan_id}")
+        print(f"\nPlan ID: {next_plan_id} ({member.name})")
         print(f"Total classes in plan: {len(next_plan)}")
         if next_plan:
             print("\nPlan:")
             for slug, cls in next_plan.items():
                 print(f"  {slug}: {cls.get('seasonal_slug', '')} | {cls.get('schedule', '')}")
 
-    compiler = Compiler()
-    source = open('invite_to_plan.html', 'r').read()
-    template = compiler.compile(source)
-
     # Calculate weekly cost: $41.38 per class
     CLASS_COST = 41.38
     num_classes = len(next_plan)
@@ -71,13 +99,17 @@ def main(send_email=True, print_schedule=False):
 
     if send_email:
         from mail_client import send_plan_email
-        send_plan_email(schedule_id, plan_html)
+        send_plan_email(schedule_id, plan_html, recipient=member.email)
 
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Generate tennis class schedule and plan')
     parser.add_argument('--no-email', action='store_true', help='Disable sending email')
     parser.add_argument('--print-schedule', action='store_true', help='Print schedule and plan to stdout')
+    parser.add_argument('--profile', choices=profiling.MODES, help='Profile the run, see profiling.py')
+    parser.add_argument('--full-rescan', action='store_true',
+                        help="Fetch every class's event page instead of predicting from last week's schedule")
     args = parser.parse_args()
-    
-    main(send_email=not args.no_email, print_schedule=args.print_schedule)
+    profiling.set_mode(args.profile)
+
+    main(send_email=not args.no_email, print_schedule=args.print_schedule, full_rescan=args.full_rescan)
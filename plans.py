@@ -0,0 +1,60 @@
+"""
+Reconciling concurrent edits to a plan.
+
+The web app edits which classes are in the plan while cronv2.py marks
+classes `scheduled` or `failed` as it books them. Both write the whole plan
+back with a compare-and-swap Storage.put(); when one loses the race its
+changes are merged onto the other's with merge_plans().
+"""
+import copy
+from typing import Callable
+
+STATUS_FLAGS = ('scheduled', 'failed')
+
+
+def _flag(plan: dict, slug: str, flag: str) -> bool:
+    return bool(plan.get(slug, {}).get(flag))
+
+
+def merge_plans(base: dict, ours: dict, theirs: dict) -> dict:
+    """
+    Three-way merge of two plans edited from the same base.
+
+    A class added or removed on one side is added or removed in the result.
+    Status flags are sticky: set on either side, set in the result, except
+    that a booking (watcher.py's, off the waitlist) clears an earlier failure.
+    A class that got booked while the other side removed it is kept, the
+    booking happened either way.
+    """
+    merged = {}
+    for slug in sorted(ours.keys() | theirs.keys()):
+        if slug not in ours or slug not in theirs:
+            side = ours if slug in ours else theirs
+            added = slug not in base
+            booked_meanwhile = _flag(side, slug, 'scheduled') and not _flag(base, slug, 'scheduled')
+            if not (added or booked_meanwhile):
+                continue
+
+        entry = copy.deepcopy(ours.get(slug) or theirs[slug])
+        for flag in STATUS_FLAGS:
+            if _flag(ours, slug, flag) or _flag(theirs, slug, flag):
+                entry[flag] = True
+        if entry.get('scheduled'):
+            entry.pop('failed', None)
+            entry.pop('failure', None)
+        merged[slug] = entry
+    return merged
+
+
+def merge_onto(base: dict) -> Callable[[dict, dict], dict]:
+    """A Storage.put() merge hook for a plan that was read as `base`."""
+    state = {'base': copy.deepcopy(base or {})}
+
+    def merge(ours: dict, theirs: dict) -> dict:
+        theirs = theirs or {}
+        merged = merge_plans(state['base'], ours, theirs)
+        # a retry merges against an even newer write, relative to this one
+        state['base'] = copy.deepcopy(theirs)
+        return merged
+
+    return merge
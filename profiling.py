@@ -0,0 +1,220 @@
+"""
+Opt-in profiling for the planner, the cron job and web requests.
+
+Set PROFILE (or pass planner.py --profile) to turn it on:
+
+    PROFILE=spans     wall-clock timers around the main phases, nearly free
+    PROFILE=cprofile  a full cProfile of each run, spans included
+
+Web requests only ever record spans: cProfile can't run in several request
+threads at once. Streaming and polling routes opt out with skip=['profiling'].
+
+Each profiled() run is stored as a `prof_*` object, cleaned up like any other
+type (see cleanup.py). Export one for the usual tools:
+
+    python3 profiling.py list
+    python3 profiling.py export <prof_id> out.pstats   # snakeviz, gprof2dot, python -m pstats
+    python3 profiling.py export <prof_id> out.folded   # flamegraph.pl, speedscope
+
+With PROFILE unset, profiled() and span() only check a thread-local.
+"""
+import base64
+import functools
+import logging
+import marshal
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Union
+
+import tokens
+
+MODES = ('spans', 'cprofile')
+TOP_FUNCTIONS = 25
+
+_mode = None
+_local = threading.local()
+
+
+def set_mode(mode: Union[str, None]) -> None:
+    """Override PROFILE, e.g. from a command line flag."""
+    if mode is not None and mode not in MODES:
+        raise ValueError(f"Unknown profiling mode: {mode}")
+    global _mode
+    _mode = mode
+
+
+def mode() -> Union[str, None]:
+    if _mode is not None:
+        return _mode
+    env = os.environ.get('PROFILE', '').strip().lower()
+    return env if env in MODES else None
+
+
+@contextmanager
+def span(name: str):
+    """Time a phase of the profiled run this thread is in, if any."""
+    run = getattr(_local, 'run', None)
+    if run is None:
+        yield
+        return
+
+    run['stack'].append(name)
+    path = ';'.join(run['stack'])
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        run['spans'].append({
+            'path': path,
+            'start': start - run['t0'],
+            'duration': time.perf_counter() - start,
+        })
+        run['stack'].pop()
+
+
+def timed(name: str = None) -> Callable:
+    """Decorator form of span()."""
+    def decorate(fn):
+        label = name or fn.__name__
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(label):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+@contextmanager
+def profiled(name: str, s, spans_only: bool = False):
+    """
+    Profile a whole run and store the result in `s`. Runs don't nest: inside
+    another profiled run this is just a span. With spans_only, a cprofile
+    mode records spans only.
+    """
+    current = mode()
+    if current is not None and spans_only:
+        current = 'spans'
+    if current is None or getattr(_local, 'run', None) is not None:
+        with span(name):
+            yield
+        return
+
+    run = {'stack': [], 'spans': [], 't0': time.perf_counter()}
+    profiler = None
+    if current == 'cprofile':
+        import cProfile
+        profiler = cProfile.Profile()
+    started = time.time()
+    _local.run = run
+    if profiler is not None:
+        profiler.enable()
+    try:
+        with span(name):
+            yield
+    finally:
+        if profiler is not None:
+            profiler.disable()
+        _local.run = None
+        try:
+            save(s, name, current, started, run['spans'], profiler)
+        except Exception:
+            logging.exception(f"Failed to save profile of {name}")
+
+
+class ProfilingPlugin(object):
+    """
+    Bottle plugin timing each request handler as spans, installed by web.py.
+    Routes that stream (nothing runs until the body is read) or are polled
+    (a profile per poll) skip it: @get('/events', skip=['profiling']).
+    """
+    name = 'profiling'
+    api = 2
+
+    def __init__(self, get_storage: Callable):
+        # looked up per request, so the store can be swapped out (tests)
+        self._get_storage = get_storage
+
+    def apply(self, callback, route):
+        if mode() is None:
+            return callback
+        label = f"{route.method} {route.rule}"
+
+        @functools.wraps(callback)
+        def wrapper(*args, **kwargs):
+            with profiled(label, self._get_storage(), spans_only=True):
+                return callback(*args, **kwargs)
+        return wrapper
+
+
+def _function_name(key) -> str:
+    filename, line, func = key
+    return f"{os.path.basename(filename)}:{line}({func})" if line else func
+
+
+def save(s, name: str, mode_: str, started: float, spans: List[dict], profiler=None) -> str:
+    profile = {
+        'name': name,
+        'mode': mode_,
+        'started': started,
+        'duration': max((sp['duration'] for sp in spans if ';' not in sp['path']), default=0.0),
+        'spans': spans,
+    }
+    if profiler is not None:
+        import pstats
+        stats = pstats.Stats(profiler).stats
+        # marshal of this dict is exactly what pstats.dump_stats() writes
+        profile['pstats'] = base64.b64encode(marshal.dumps(stats)).decode('ascii')
+        top = sorted(stats.items(), key=lambda kv: -kv[1][3])[:TOP_FUNCTIONS]
+        profile['top'] = [
+            {'function': _function_name(key), 'calls': nc, 'tottime': tt, 'cumtime': ct}
+            for key, (cc, nc, tt, ct, callers) in top
+        ]
+    prof_id = tokens.generate_token('prof')
+    s.put(prof_id, profile)
+    return prof_id
+
+
+def folded(profile: dict) -> str:
+    """Spans in the folded-stack format flame graph tools read, self time in µs."""
+    self_time: Dict[str, float] = {}
+    for sp in profile['spans']:
+        self_time[sp['path']] = self_time.get(sp['path'], 0.0) + sp['duration']
+        parent = sp['path'].rpartition(';')[0]
+        if parent:
+            self_time[parent] = self_time.get(parent, 0.0) - sp['duration']
+    return ''.join(f"{path} {max(0, round(t * 1e6))}\n" for path, t in sorted(self_time.items()))
+
+
+def export(profile: dict, path: str) -> None:
+    if path.endswith('.folded'):
+        with open(path, 'w') as f:
+            f.write(folded(profile))
+        return
+    if 'pstats' not in profile:
+        raise ValueError(f"{profile['name']} was profiled with spans only, export it as .folded")
+    with open(path, 'wb') as f:
+        f.write(base64.b64decode(profile['pstats']))
+
+
+def main(args=sys.argv[1:]):
+    from storage import open_storage
+
+    s = open_storage('storage')
+    if args[:1] == ['list']:
+        for prof_id, profile in sorted(s.list('prof')):
+            print(f"{prof_id}  {profile['name']:32} {profile['mode']:9} {profile['duration']:8.3f}s")
+    elif args[:1] == ['export'] and len(args) == 3:
+        profile = s.get(args[1])
+        if profile is None:
+            sys.exit(f"No profile {args[1]}")
+        export(profile, args[2])
+    else:
+        sys.exit("usage: profiling.py list | export <prof_id> <file.pstats|file.folded>")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,148 @@
+"""
+Queries for Storage.list() and Storage.latest().
+
+A query maps field paths to conditions, all of which must hold:
+
+    {'scheduled_id': '1400001'}                  equality
+    {'request.method': 'GET'}                    dotted paths into nested objects
+    {'response': {'status': 200}}                nested queries, same thing
+    {'status': {'$in': [1, 2]}}                  membership
+    {'duration': {'$gt': 1.5, '$lte': 10}}       $gt, $gte, $lt, $lte
+    {'failed': {'$exists': False}}               presence of a field
+    {'$timestamp': {'$gte': since}}              the timestamp in the object's token
+
+A query is compiled once into a Query, then matched against many objects.
+Conditions on $timestamp only need the token, so Storage uses them to skip
+month buckets and files without opening them.
+"""
+import operator
+from typing import Callable, Tuple, Union
+
+import tokens
+
+TOKEN_TIMESTAMP = '$timestamp'
+
+_COMPARISONS = {
+    '$gt': operator.gt,
+    '$gte': operator.ge,
+    '$lt': operator.lt,
+    '$lte': operator.le,
+}
+
+# (is the field present, its value) -> bool
+Condition = Callable[[bool, object], bool]
+
+
+def _is_operators(cond) -> bool:
+    return isinstance(cond, dict) and len(cond) > 0 and all(k.startswith('$') for k in cond)
+
+
+def _compile_operator(op: str, arg) -> Condition:
+    if op == '$exists':
+        want = bool(arg)
+        return lambda present, value: present == want
+
+    if op == '$in':
+        try:
+            members = frozenset(arg)
+        except TypeError:
+            # unhashable members, e.g. dicts
+            members = list(arg)
+
+        def check_in(present, value):
+            try:
+                return present and value in members
+            except TypeError:
+                return False
+        return check_in
+
+    if op in _COMPARISONS:
+        compare = _COMPARISONS[op]
+
+        def check_compare(present, value):
+            try:
+                return present and value is not None and compare(value, arg)
+            except TypeError:
+                return False
+        return check_compare
+
+    raise ValueError(f"Unknown query operator: {op}")
+
+
+def _compile_condition(cond) -> Condition:
+    if _is_operators(cond):
+        checks = [_compile_operator(op, arg) for op, arg in cond.items()]
+        return lambda present, value: all(check(present, value) for check in checks)
+
+    if isinstance(cond, dict):
+        nested = _compile(cond)
+        return lambda present, value: isinstance(value, dict) and nested(value)
+
+    # a missing field equals None, as it always has
+    return lambda present, value: value == cond
+
+
+def _resolve(obj, keys) -> Tuple[bool, object]:
+    for key in keys:
+        if not isinstance(obj, dict) or key not in obj:
+            return False, None
+        obj = obj[key]
+    return True, obj
+
+
+def _compile(query: dict) -> Callable[[dict], bool]:
+    checks = []
+    for path, cond in query.items():
+        if path.startswith('$'):
+            raise ValueError(f"{path} is only supported at the top level of a query")
+        checks.append((path.split('.'), _compile_condition(cond)))
+
+    def matches(obj: dict) -> bool:
+        for keys, check in checks:
+            if not check(*_resolve(obj, keys)):
+                return False
+        return True
+    return matches
+
+
+class Query(object):
+    def __init__(self, query: dict = None):
+        query = dict(query or {})
+        timestamp = query.pop(TOKEN_TIMESTAMP, None)
+        self.since, self.until = _bounds(timestamp)
+        self._timestamp = None if timestamp is None else _compile_condition(timestamp)
+        self._matches = _compile(query)
+
+    def matches_token(self, token: str) -> bool:
+        """Whether an object with this token can match, without reading it."""
+        if self._timestamp is None:
+            return True
+        parsed = tokens.parse(token)
+        return parsed is not None and self._timestamp(True, parsed['timestamp'])
+
+    def matches(self, obj: dict) -> bool:
+        return self._matches(obj)
+
+
+def _bounds(cond) -> Tuple[Union[float, None], Union[float, None]]:
+    """Loosest (since, until) range of timestamps a $timestamp condition allows."""
+    if cond is None:
+        return None, None
+    if not _is_operators(cond):
+        return cond, cond
+
+    since, until = None, None
+    for op, arg in cond.items():
+        if op in ('$gt', '$gte'):
+            since = arg if since is None else max(since, arg)
+        elif op in ('$lt', '$lte'):
+            until = arg if until is None else min(until, arg)
+        elif op == '$in' and arg:
+            since = min(arg) if since is None else max(since, min(arg))
+            until = max(arg) if until is None else min(until, max(arg))
+    return since, until
+
+
+def matches_query(obj: dict, query: dict) -> bool:
+    """Match one object; for many, compile a Query once instead."""
+    return Query(query).matches(obj)
@@ -0,0 +1,121 @@
+"""
+One request rate to the club site, shared by every process talking to it.
+
+The web app, planner, cron job and waitlist watcher each make their own
+requests; without coordination a planner burst can get us throttled just as a
+booking window opens. Every session from client.make_session() takes a token
+from one bucket before each request. The bucket is a small JSON file, updated
+under flock like Storage's locks, so it is shared across processes.
+
+Two priorities:
+
+    BOOKING      registration and checkout; may use every token
+    BACKGROUND   everything else; leaves RESERVE tokens for booking, and waits
+                 entirely while any process has a booking request queued
+
+Requests to the registration and cart endpoints are always BOOKING, whatever
+the session's priority. Time spent queueing goes to the
+club_request_queue_seconds histogram.
+
+    CLUB_RATE=2 CLUB_BURST=10    requests per second, and burst size
+    CLUB_RATE=0                  no limit
+"""
+import fcntl
+import json
+import os
+import time
+from typing import Callable
+from urllib.parse import urlsplit
+
+import metrics
+
+BOOKING = 'booking'
+BACKGROUND = 'background'
+PRIORITIES = (BOOKING, BACKGROUND)
+
+RATE = float(os.environ.get('CLUB_RATE', 2.0))
+BURST = float(os.environ.get('CLUB_BURST', 10.0))
+# share of the burst background requests can't touch
+RESERVE = 0.5
+# longest nap between retries, so waiters notice tokens and bookings quickly
+MAX_SLEEP = 0.25
+STATE_FILE = os.environ.get('RATE_LIMIT_FILE', './storage/.ratelimit')
+
+BOOKING_PATHS = ('/calendar/fast-register-event', '/calendar/register-event', '/member/cart')
+
+
+def priority_for(url: str, default: str = BACKGROUND) -> str:
+    path = urlsplit(url).path
+    return BOOKING if path.startswith(BOOKING_PATHS) else default
+
+
+class RateLimiter(object):
+    def __init__(self, path: str = STATE_FILE, rate: float = RATE, burst: float = BURST,
+                 clock: Callable[[], float] = time.time, sleep: Callable[[float], None] = time.sleep):
+        self.path = path
+        self.rate = rate
+        self.burst = max(1.0, burst)
+        self.reserve = self.burst * RESERVE
+        self._clock = clock
+        self._sleep = sleep
+
+    def _try(self, priority: str) -> float:
+        """Take a token if there is one for `priority`; else how long to wait for one."""
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with open(self.path, 'a+') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            f.seek(0)
+            try:
+                state = json.loads(f.read() or '{}')
+            except ValueError:
+                state = {}
+            now = self._clock()
+            tokens = state.get('tokens', self.burst)
+            tokens = min(self.burst, tokens + max(0.0, now - state.get('updated', now)) * self.rate)
+            booking_waiting = state.get('booking_waiting_until', 0) > now
+
+            floor = 0.0 if priority == BOOKING else self.reserve
+            if priority != BOOKING and booking_waiting:
+                wait = MAX_SLEEP
+            elif tokens - floor >= 1:
+                tokens -= 1
+                wait = 0.0
+            else:
+                wait = (floor + 1 - tokens) / self.rate
+
+            state['tokens'], state['updated'] = tokens, now
+            if priority == BOOKING and wait:
+                # a heartbeat: background requests hold off while it is fresh. Only
+                # ever pushed later, another process may still be queued behind it
+                state['booking_waiting_until'] = max(state.get('booking_waiting_until', 0), now + wait + MAX_SLEEP)
+            f.seek(0)
+            f.truncate()
+            f.write(json.dumps(state))
+            return wait
+
+    def acquire(self, priority: str = BACKGROUND) -> float:
+        """Block until a request of this priority may go out; returns the time spent waiting."""
+        if priority not in PRIORITIES:
+            raise ValueError(f"Unknown priority: {priority}")
+        if self.rate <= 0:
+            return 0.0
+        start = self._clock()
+        while True:
+            wait = self._try(priority)
+            if not wait:
+                break
+            self._sleep(min(wait, MAX_SLEEP))
+        waited = self._clock() - start
+        metrics.observe('club_request_queue_seconds', waited, priority=priority)
+        return waited
+
+
+_limiter = None
+
+
+def limiter() -> RateLimiter:
+    """The process-wide limiter, configured from the environment."""
+    global _limiter
+    if _limiter is None:
+        _limiter = RateLimiter()
+    return _limiter
@@ -0,0 +1,331 @@
+"""
+Offline stand-in for tcsp.clubautomation.com, serving the exchanges
+client.http_log() recorded in ./log back to a requests.Session.
+
+    recording = Recording.from_storage(open_storage('./log'))
+    adapter = ReplayAdapter(recording, scenarios=[OpensAt(time.time() + 5), FullAfter(3)])
+    with replaying(adapter):
+        planner.main(send_email=False)
+
+Pages (the class map, event info, sign in) are replayed from the recording,
+matched on method and URL and cycled through when there are several. Dates
+in replayed pages are moved forward by whole weeks so the recorded classes
+fall in the planner's booking window again.
+
+Registration is scripted instead, because its answer depends on what was
+registered before. By default every registration succeeds; scenarios change
+that:
+
+    OpensAt(t)        registration is closed until t
+    FullAfter(n)      the class is full after n registrations
+    NeedsCart()       fast register asks for payment, so the cart checkout runs
+
+Responses take as long as they took when recorded, times latency_scale.
+"""
+import http.client
+import json
+import itertools
+import re
+import statistics
+import sys
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Iterable, List, Tuple, Union
+from urllib.parse import parse_qs, parse_qsl, urlencode, urlsplit
+
+import requests
+from requests.adapters import BaseAdapter
+from requests.structures import CaseInsensitiveDict
+
+CLUB = 'https://tcsp.clubautomation.com'
+WEEK = timedelta(days=7)
+# scripted responses have nothing recorded to take their latency from
+SCRIPTED_LATENCY = 0.25
+
+FAST_REGISTER = '/calendar/fast-register-event'
+CART_ADD = '/calendar/register-event'
+CART = '/member/cart'
+CHECKOUT = re.compile(r'^/member/cart/step/1/cart_items/([\d,]+)/')
+
+# the body was recorded decoded, these no longer describe it
+_DROPPED_HEADERS = ('content-encoding', 'content-length', 'transfer-encoding')
+_DATE = re.compile(r'\b(\d{2}/\d{2}/\d{4})\b')
+
+# (status, body, content type)
+Reply = Tuple[int, str, str]
+
+
+class ReplayMiss(requests.exceptions.ConnectionError):
+    """Nothing was recorded for a request; raised like the network failing."""
+
+
+class Exchange(object):
+    __slots__ = ('time', 'duration', 'status', 'headers', '_body', '_token', '_store')
+
+    def __init__(self, record: dict, token: str = None, store=None):
+        response = record.get('response') or {}
+        self.time = record.get('time') or 0.0
+        self.duration = record.get('duration') or 0.0
+        self.status = response.get('status') or 200
+        self.headers = {k: v for k, v in (response.get('headers') or {}).items()
+                        if k.lower() not in _DROPPED_HEADERS}
+        # from a store, the body is read back when replayed instead of held
+        self._token, self._store = token, store
+        self._body = None if store is not None else response.get('body') or ''
+
+    @property
+    def body(self) -> str:
+        if self._store is None:
+            return self._body
+        record = self._store.get(self._token) or {}
+        return (record.get('response') or {}).get('body') or ''
+
+
+def request_key(method: str, url: str) -> Tuple[str, str, str]:
+    parts = urlsplit(url)
+    return method.upper(), parts.path or '/', urlencode(sorted(parse_qsl(parts.query)))
+
+
+class Recording(object):
+    """
+    Recorded exchanges indexed by request. Records are read one at a time;
+    given the `store` they came from, only their metadata is kept and bodies
+    are read back from it when replayed, so a long log fits in memory.
+    """
+
+    def __init__(self, records: Iterable[Tuple[str, dict]], store=None):
+        self._exact: Dict[tuple, List[Exchange]] = defaultdict(list)
+        self._by_path: Dict[tuple, List[Exchange]] = defaultdict(list)
+        for token, record in records:
+            request = record.get('request') or {}
+            if not request.get('url') or not record.get('response'):
+                continue
+            key = request_key(request.get('method') or 'GET', request['url'])
+            exchange = Exchange(record, token, store)
+            self._exact[key].append(exchange)
+            self._by_path[key[:2]].append(exchange)
+        for exchanges in itertools.chain(self._exact.values(), self._by_path.values()):
+            exchanges.sort(key=lambda e: e.time)
+
+    @classmethod
+    def from_storage(cls, s, since: float = None) -> 'Recording':
+        query = {'$timestamp': {'$gte': since}} if since is not None else None
+        return cls(s.list('http', query), store=s)
+
+    def __len__(self) -> int:
+        return sum(len(v) for v in self._exact.values())
+
+    def lookup(self, key: Tuple[str, str, str]) -> List[Exchange]:
+        """Exchanges recorded for a request, or for its path with other query strings."""
+        return self._exact.get(key) or self._by_path.get(key[:2]) or []
+
+    def duration(self, method: str, path: str) -> float:
+        durations = [e.duration for e in self._by_path.get((method, path), [])]
+        return statistics.median(durations) if durations else SCRIPTED_LATENCY
+
+
+def _form(request: requests.PreparedRequest) -> Dict[str, str]:
+    body = request.body or ''
+    if isinstance(body, bytes):
+        body = body.decode('utf-8', 'replace')
+    return {k: v[-1] for k, v in parse_qs(body).items()}
+
+
+def _json(obj: dict) -> Reply:
+    return 200, json.dumps(obj), 'application/json'
+
+
+def _shift_dates(body: str, weeks: int) -> str:
+    def shift(match):
+        try:
+            date = datetime.strptime(match.group(1), '%m/%d/%Y')
+        except ValueError:
+            return match.group(1)
+        return (date + weeks * WEEK).strftime('%m/%d/%Y')
+    return _DATE.sub(shift, body)
+
+
+class OpensAt(object):
+    """Registration for `schedule_ids` (default: every class) is closed until `opens_at`."""
+
+    def __init__(self, opens_at: float, schedule_ids: Iterable[str] = None):
+        self.opens_at = opens_at
+        self.schedule_ids = None if schedule_ids is None else set(schedule_ids)
+
+    def handle(self, adapter: 'ReplayAdapter', path: str, request) -> Union[Reply, None]:
+        if path not in (FAST_REGISTER, CART_ADD) or adapter.clock() >= self.opens_at:
+            return None
+        if self.schedule_ids is not None and _form(request).get('scheduleId') not in self.schedule_ids:
+            return None
+        return _json({'status': -1, 'message': 'Registration for this class is not open yet.'})
+
+
+class FullAfter(object):
+    """A class is full once `registrations` registrations went through."""
+
+    def __init__(self, registrations: int, schedule_ids: Iterable[str] = None):
+        self.registrations = registrations
+        self.schedule_ids = None if schedule_ids is None else set(schedule_ids)
+
+    def handle(self, adapter: 'ReplayAdapter', path: str, request) -> Union[Reply, None]:
+        if path not in (FAST_REGISTER, CART_ADD):
+            return None
+        schedule_id = _form(request).get('scheduleId')
+        if self.schedule_ids is not None and schedule_id not in self.schedule_ids:
+            return None
+        if adapter.registered(schedule_id) < self.registrations:
+            return None
+        return _json({'status': -1, 'message': 'This class has reached the maximum number of participants.'})
+
+
+class NeedsCart(object):
+    """
+    Classes that can't be registered for without payment, like LB03. There is
+    one cart, shared by every session.
+    """
+
+    def __init__(self, schedule_ids: Iterable[str] = None):
+        self.schedule_ids = None if schedule_ids is None else set(schedule_ids)
+        self._lock = threading.Lock()
+        self._carts: Dict[str, str] = {}
+        self._cart_items = itertools.count(800000)
+
+    def handle(self, adapter: 'ReplayAdapter', path: str, request) -> Union[Reply, None]:
+        if path == FAST_REGISTER:
+            if self.schedule_ids is not None and _form(request).get('scheduleId') not in self.schedule_ids:
+                return None
+            return _json({'status': -1, 'message': 'This event can not be registered without payment.'})
+
+        if path == CART_ADD:
+            schedule_id = _form(request).get('scheduleId')
+            with self._lock:
+                self._carts[str(next(self._cart_items))] = schedule_id
+            return _json({'status': 1, 'message': 'The event has been added to your cart.'})
+
+        if path == CART and request.method == 'GET':
+            with self._lock:
+                items = ','.join(self._carts)
+            return 200, (
+                f'<form action="/member/cart/step/1/cart_items/{items}/?ajax=1" method="post">'
+                '<input type="hidden" name="active_gateway" value="CashFlow">'
+                '<input type="hidden" name="continue" value="1">'
+                '</form>'
+            ), 'text/html; charset=UTF-8'
+
+        match = CHECKOUT.match(path)
+        if match and request.method == 'POST':
+            with self._lock:
+                checked_out = [self._carts.pop(item) for item in match.group(1).split(',') if item in self._carts]
+            for schedule_id in checked_out:
+                adapter.register(schedule_id)
+            return 200, '<h2>Thank you for your purchase!</h2>', 'text/html; charset=UTF-8'
+        return None
+
+
+class ReplayAdapter(BaseAdapter):
+    def __init__(self, recording: Recording, scenarios: List[object] = (), latency_scale: float = 1.0,
+                 shift_dates: bool = True, clock: Callable[[], float] = time.time,
+                 sleep: Callable[[float], None] = time.sleep):
+        super().__init__()
+        self.recording = recording
+        self.scenarios = list(scenarios)
+        self.latency_scale = latency_scale
+        self.shift_dates = shift_dates
+        self.clock = clock
+        self._sleep = sleep
+        self._lock = threading.Lock()
+        self._calls: Dict[tuple, int] = defaultdict(int)
+        self._registrations: Dict[str, int] = defaultdict(int)
+        self.requests = 0
+
+    def registered(self, schedule_id: str) -> int:
+        with self._lock:
+            return self._registrations[schedule_id]
+
+    def register(self, schedule_id: str) -> None:
+        with self._lock:
+            self._registrations[schedule_id] += 1
+
+    def _scripted(self, path: str, request) -> Union[Reply, None]:
+        for scenario in self.scenarios:
+            reply = scenario.handle(self, path, request)
+            if reply is not None:
+                return reply
+        if path == FAST_REGISTER:
+            self.register(_form(request).get('scheduleId'))
+            return _json({'status': 1, 'message': 'Registered', 'countRegistered': 1})
+        return None
+
+    def _replayed(self, key: tuple) -> Exchange:
+        exchanges = self.recording.lookup(key)
+        if not exchanges:
+            raise ReplayMiss(f"Nothing recorded for {key[0]} {key[1]}")
+        with self._lock:
+            n = self._calls[key]
+            self._calls[key] += 1
+        return exchanges[n % len(exchanges)]
+
+    def send(self, request: requests.PreparedRequest, stream=False, timeout=None, verify=True, cert=None,
+             proxies=None) -> requests.Response:
+        key = request_key(request.method, request.url)
+        with self._lock:
+            self.requests += 1
+
+        reply = self._scripted(key[1], request)
+        if reply is not None:
+            status, body, content_type = reply
+            headers = {'Content-Type': content_type}
+            latency = self.recording.duration(key[0], key[1])
+        else:
+            exchange = self._replayed(key)
+            status, body, headers, latency = exchange.status, exchange.body, exchange.headers, exchange.duration
+            if self.shift_dates and exchange.time:
+                body = _shift_dates(body, round((self.clock() - exchange.time) / WEEK.total_seconds()))
+
+        if self.latency_scale and latency:
+            self._sleep(latency * self.latency_scale)
+        return _response(request, status, body, headers)
+
+    def close(self):
+        pass
+
+
+def _response(request: requests.PreparedRequest, status: int, body: str, headers: dict) -> requests.Response:
+    response = requests.Response()
+    response.status_code = status
+    response.reason = http.client.responses.get(status, '')
+    response.headers = CaseInsensitiveDict(headers)
+    response._content = body.encode('utf-8')
+    response.encoding = 'utf-8'
+    response.url = request.url
+    response.request = request
+    return response
+
+
+def replay_session(adapter: ReplayAdapter) -> requests.Session:
+    """A session talking to the adapter instead of the club, recording nothing."""
+    session = requests.Session()
+    session.mount(CLUB, adapter)
+    return session
+
+
+@contextmanager
+def replaying(adapter: ReplayAdapter, modules: Iterable[str] = ('planner',)):
+    """
+    Make client.make_session() return replay sessions, along with the copies
+    already imported into `modules`, so planner.main() and Client run unchanged.
+    """
+    import client
+
+    targets = [client] + [sys.modules[name] for name in modules if name in sys.modules]
+    originals = [(module, module.make_session) for module in targets]
+    for module in targets:
+        module.make_session = lambda: replay_session(adapter)
+    try:
+        yield adapter
+    finally:
+        for module, original in originals:
+            module.make_session = original
@@ -0,0 +1,129 @@
+"""
+On-disk encodings for Storage objects.
+
+Storage writes with one codec but reads any of them, detected from the first
+byte of each file, so a store can switch codecs without migrating what is
+already there. The fast codecs are optional dependencies:
+
+    json     stdlib, what every existing file uses
+    orjson   the same JSON, encoded and decoded much faster (pip install orjson)
+    msgpack  binary, smaller and fast to decode (pip install msgpack)
+
+Asking for one that isn't installed falls back to json. Reading a msgpack
+file without msgpack installed is an error, not a fallback.
+"""
+import abc
+import json
+import logging
+
+# every stored object is a dict, which as JSON starts with '{'
+_JSON_START = b'{[ \t\r\n'
+
+
+class Codec(abc.ABC):
+    name = None
+
+    @abc.abstractmethod
+    def encode(self, obj) -> bytes:
+        pass
+
+    @abc.abstractmethod
+    def decode(self, data: bytes):
+        pass
+
+
+class JsonCodec(Codec):
+    name = 'json'
+
+    def encode(self, obj) -> bytes:
+        return json.dumps(obj).encode('utf-8')
+
+    def decode(self, data: bytes):
+        return json.loads(data)
+
+
+class OrjsonCodec(Codec):
+    name = 'orjson'
+
+    def __init__(self):
+        import orjson
+        self._orjson = orjson
+
+    def encode(self, obj) -> bytes:
+        # json.dumps turns int keys into strings, so must this
+        return self._orjson.dumps(obj, option=self._orjson.OPT_NON_STR_KEYS)
+
+    def decode(self, data: bytes):
+        return self._orjson.loads(data)
+
+
+class MsgpackCodec(Codec):
+    name = 'msgpack'
+
+    def __init__(self):
+        import msgpack
+        self._msgpack = msgpack
+
+    def encode(self, obj) -> bytes:
+        # keys as json.dumps writes them, so every codec reads back the same object
+        return self._msgpack.packb(_str_keys(obj), use_bin_type=True)
+
+    def decode(self, data: bytes):
+        return self._msgpack.unpackb(data, raw=False, strict_map_key=False)
+
+
+def _str_keys(obj):
+    if isinstance(obj, dict):
+        return {k if isinstance(k, str) else json.dumps(k): _str_keys(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [_str_keys(v) for v in obj]
+    return obj
+
+
+CODECS = {c.name: c for c in (JsonCodec, OrjsonCodec, MsgpackCodec)}
+_instances = {}
+
+
+def get_codec(name: str = 'json') -> Codec:
+    """The named codec, or json if its library isn't installed."""
+    if name not in CODECS:
+        raise ValueError(f"Unknown codec: {name}")
+    if name not in _instances:
+        try:
+            _instances[name] = CODECS[name]()
+        except ImportError:
+            logging.warning(f"{name} is not installed, using json")
+            _instances[name] = get_codec('json')
+    return _instances[name]
+
+
+def available_codecs() -> list:
+    return [name for name in CODECS if get_codec(name).name == name]
+
+
+_json_reader = None
+_msgpack_reader = None
+
+
+def decode(data: bytes):
+    """Decode a file written by any codec."""
+    global _json_reader, _msgpack_reader
+    if data[:1] in _JSON_START:
+        if _json_reader is None:
+            # orjson reads what the stdlib wrote too, just faster
+            try:
+                _json_reader = OrjsonCodec()
+            except ImportError:
+                _json_reader = JsonCodec()
+        try:
+            return _json_reader.decode(data)
+        except ValueError:
+            # NaN and the like, which only the stdlib accepts
+            return json.loads(data)
+    if _msgpack_reader is None:
+        try:
+            _msgpack_reader = MsgpackCodec()
+        except ImportError:
+            raise RuntimeError("msgpack codec required: this file was written with msgpack, "
+                               "pip install msgpack to read it") from None
+    return _msgpack_reader.decode(data)
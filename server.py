@@ -0,0 +1,159 @@
+"""
+Production WSGI server adapters for web.py.
+
+bottle's default `wsgiref` server handles one request at a time, so a slow
+request (e.g. a plan save waiting on Google Calendar) blocks every other
+visitor. These adapters plug into `bottle.run(server=...)`:
+
+    waitress  - one process, a pool of request threads (default)
+    gunicorn  - pre-forked worker processes, each with a pool of threads
+    wsgiref   - bottle's single-threaded development server
+
+Both production servers keep connections alive between requests and drain
+in-flight requests on SIGTERM before exiting.
+
+Under gunicorn each worker process has its own web._plan_lock, so concurrent
+plan writes from different workers are kept consistent only by Storage's
+compare-and-swap puts (expected_version plus merge).
+"""
+import argparse
+import logging
+import os
+import signal
+import sys
+import time
+
+from bottle import ServerAdapter
+
+SERVERS = ('waitress', 'gunicorn', 'wsgiref')
+
+DEFAULT_SERVER = 'waitress'
+DEFAULT_THREADS = 4
+DEFAULT_WORKERS = 2
+DEFAULT_KEEPALIVE = 5  # seconds an idle keep-alive connection is held open
+DEFAULT_GRACEFUL_TIMEOUT = 30  # seconds to let in-flight requests finish
+
+
+def _raise_exit(signum, frame):
+    raise SystemExit(0)
+
+
+def _busy(server) -> bool:
+    """Whether any connection has a request running or a response left to send."""
+    return any(channel.requests or channel.total_outbufs_len for channel in list(server.active_channels.values()))
+
+
+def _drain(server, timeout: float) -> None:
+    """
+    Stop accepting, then keep waitress's loop running until in-flight
+    responses are written out. Responses are sent from that loop, not from
+    the request threads, so the loop can't stop before they are.
+    """
+    from waitress import wasyncore
+
+    wasyncore.dispatcher.close(server)  # the listening socket only
+    deadline = time.monotonic() + timeout
+    while _busy(server) and time.monotonic() < deadline:
+        server.asyncore.loop(timeout=server.adj.asyncore_loop_timeout, map=server._map,
+                             use_poll=server.adj.asyncore_use_poll, count=1)
+    server.task_dispatcher.shutdown(cancel_pending=True, timeout=max(0.0, deadline - time.monotonic()))
+    server.close()
+    wasyncore.close_all(server._map)
+
+
+class ThreadedWaitressServer(ServerAdapter):
+    """
+    bottle's built-in waitress adapter drops all options, this one passes
+    through the thread count and keep-alive timeout.
+    """
+    def run(self, handler):
+        from waitress import create_server
+
+        graceful_timeout = self.options.get('graceful_timeout', DEFAULT_GRACEFUL_TIMEOUT)
+        server = create_server(
+            handler,
+            host=self.host,
+            port=self.port,
+            threads=self.options.get('threads', DEFAULT_THREADS),
+            channel_timeout=self.options.get('keepalive', DEFAULT_KEEPALIVE),
+        )
+        signal.signal(signal.SIGTERM, _raise_exit)
+        logging.info(f"Serving on http://{self.host}:{self.port} with {server.adj.threads} threads")
+        # server.run() would shut the task threads down itself on SystemExit,
+        # cancelling queued requests, so run its loop here instead
+        try:
+            server.asyncore.loop(timeout=server.adj.asyncore_loop_timeout, map=server._map,
+                                 use_poll=server.adj.asyncore_use_poll)
+        except (KeyboardInterrupt, SystemExit):
+            pass
+        finally:
+            _drain(server, graceful_timeout)
+
+
+class ThreadedGunicornServer(ServerAdapter):
+    def run(self, handler):
+        from gunicorn.app.base import BaseApplication
+
+        config = {
+            'bind': f"{self.host}:{self.port}",
+            'workers': self.options.get('workers', DEFAULT_WORKERS),
+            'threads': self.options.get('threads', DEFAULT_THREADS),
+            'worker_class': 'gthread',
+            'keepalive': self.options.get('keepalive', DEFAULT_KEEPALIVE),
+            # gunicorn drains workers on SIGTERM for up to graceful_timeout
+            'graceful_timeout': self.options.get('graceful_timeout', DEFAULT_GRACEFUL_TIMEOUT),
+        }
+
+        class Application(BaseApplication):
+            def load_config(self):
+                for k, v in config.items():
+                    self.cfg.set(k, v)
+
+            def load(self):
+                return handler
+
+        Application().run()
+
+
+ADAPTERS = {
+    'waitress': ThreadedWaitressServer,
+    'gunicorn': ThreadedGunicornServer,
+    'wsgiref': 'wsgiref',
+}
+
+
+def parse_args(args=sys.argv):
+    """
+    Parse `web.py PORT [options]`. Every option can also be set from the
+    environment (handy in a Procfile), command line flags take precedence.
+    """
+    parser = argparse.ArgumentParser(description='Tennis planner web server')
+    parser.add_argument('port', type=int)
+    parser.add_argument('--host', default=os.environ.get('WEB_HOST', '0.0.0.0'))
+    parser.add_argument('--server', choices=SERVERS,
+                        default=os.environ.get('WEB_SERVER', DEFAULT_SERVER))
+    parser.add_argument('--threads', type=int,
+                        default=int(os.environ.get('WEB_THREADS', DEFAULT_THREADS)))
+    parser.add_argument('--workers', type=int,
+                        default=int(os.environ.get('WEB_WORKERS', DEFAULT_WORKERS)),
+                        help='worker processes, gunicorn only')
+    parser.add_argument('--keepalive', type=int,
+                        default=int(os.environ.get('WEB_KEEPALIVE', DEFAULT_KEEPALIVE)))
+    parser.add_argument('--graceful-timeout', type=int,
+                        default=int(os.environ.get('WEB_GRACEFUL_TIMEOUT', DEFAULT_GRACEFUL_TIMEOUT)))
+    return parser.parse_args(args[1:])
+
+
+def run_options(opts) -> dict:
+    """Keyword arguments for bottle.run() for the parsed options."""
+    kwargs = {'host': opts.host, 'port': opts.port, 'server': ADAPTERS[opts.server]}
+    if opts.server == 'wsgiref':
+        return kwargs
+    kwargs.update({
+        'threads': opts.threads,
+        'keepalive': opts.keepalive,
+        'graceful_timeout': opts.graceful_timeout,
+    })
+    if opts.server == 'gunicorn':
+        kwargs['workers'] = opts.workers
+    return kwargs
@@ -6,7 +6,7 @@ from rich.console import Console
 from rich.table import Table
 from rich.panel import Panel
 from rich.text import Text
-from storage import Storage
+from storage import open_storage
 
 def format_time(timestamp, from_tz='UTC', to_tz='US/Pacific'):
     """Convert and format time between timezones."""
@@ -16,7 +16,7 @@ def format_time(timestamp, from_tz='UTC', to_tz='US/Pacific'):
 
 def main():
     console = Console()
-    storage = Storage('storage')
+    storage = open_storage('storage')
 
     # Get latest schedule and plan
     schedule_id, schedule = storage.latest("sched")
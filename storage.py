@@ -1,97 +1,665 @@
 import datetime
-import glob
+import fcntl
 import logging
+from collections import OrderedDict
+from contextlib import contextmanager
 from datetime import timedelta
-from typing import List, Generator, Union, Tuple
+from typing import Callable, List, Generator, Union, Tuple
 import os.path
-import json
+import shutil
+import threading
+import time
 
+import serializers
 import tokens
+# matches_query used to live here
+from query import Query, matches_query
 
 
-def matches_query(obj: dict, query: dict) -> bool:
-    result = True
+def token_order(token: str) -> Tuple[float, str]:
+    # objects are assumed to use token from tokens lib,
+    # be ordinal by timestamp.
+    return tokens.parse(token)['timestamp'], token
 
-    for k, v in query.items():
-        cur = obj.get(k)
-        if isinstance(cur, dict):
-            result = result and matches_query(cur, v)
-        else:
-            result = result and cur == v
-        if not result:
-            break
 
-    return result
+class ConflictError(Exception):
+    """A compare-and-swap put() found the object changed since it was read."""
+
+
+# expected_version for put() when the object must not exist yet
+ABSENT = ''
+MAX_MERGE_ATTEMPTS = 5
+CLEANUP_BATCH_SIZE = 100
+CACHE_MAX_BYTES = 8 * 1024 * 1024
+
+
+def _version(st: os.stat_result) -> str:
+    # every put() renames a fresh file into place, so the inode changes with
+    # each write even when mtime granularity is coarse
+    return f"{st.st_ino:x}-{st.st_mtime_ns:x}-{st.st_size:x}"
+
+
+def _write_atomic(filename: str, data: bytes) -> os.stat_result:
+    """
+    Write to a temp file next to the target and rename it into place, so
+    readers see either the old or the new content, never a partial file.
+    """
+    directory, basename = os.path.split(filename)
+    tmp = os.path.join(directory, f".{basename}.{os.getpid()}.{threading.get_ident()}.tmp")
+    try:
+        with open(tmp, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+            st = os.fstat(f.fileno())
+        os.replace(tmp, filename)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+        raise
+    return st
+
+
+class CleanupReport(object):
+    """What a Storage.cleanup() run deleted, or would have with dry_run."""
+    def __init__(self, obj_type: str, dry_run: bool):
+        self.obj_type = obj_type
+        self.dry_run = dry_run
+        self.deleted: List[str] = []
+        self.bytes_reclaimed = 0
+        # False when the run stopped at its deadline with work left
+        self.complete = True
+
+    def __len__(self):
+        return len(self.deleted)
+
+
+def _expired(ids, retention_count: int = None, retention_window: timedelta = None) -> List[str]:
+    """The ids outside a retention policy, oldest first."""
+    cutoff = None
+    if retention_window:
+        cutoff = datetime.datetime.now().timestamp() - retention_window.total_seconds()
+
+    candidates = []
+    for token in ids:
+        try:
+            candidates.append((tokens.parse(token)['timestamp'], token))
+        except (TypeError, IndexError, ValueError):
+            continue
+    candidates.sort(reverse=True)
+
+    expired = []
+    for rank, (timestamp, token) in enumerate(candidates):
+        if (retention_count is not None and rank >= retention_count) \
+                or (cutoff is not None and timestamp < cutoff):
+            expired.append(token)
+    expired.reverse()
+    return expired
+
+
+def _copy(obj):
+    # decoded objects are only dicts, lists and scalars, much cheaper than deepcopy
+    if isinstance(obj, dict):
+        return {k: _copy(v) for k, v in obj.items()}
+    if isinstance(obj, list):
+        return [_copy(v) for v in obj]
+    return obj
+
+
+class ObjectCache(object):
+    """
+    Decoded objects by id, each valid for as long as its file keeps the same
+    version, so writes from other processes are never missed. Bounded by the
+    on-disk size of what it holds, least recently used first out. Callers
+    get their own copy, mutating it can't corrupt the cache.
+    """
+    def __init__(self, max_bytes: int = CACHE_MAX_BYTES):
+        self._max_bytes = max_bytes
+        self._bytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, _id: str, version: str):
+        with self._lock:
+            entry = self._entries.get(_id)
+            if entry is None or entry[0] != version:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(_id)
+            self.hits += 1
+            obj = entry[1]
+        return _copy(obj)
+
+    def put(self, _id: str, version: str, obj, size: int) -> None:
+        if size > self._max_bytes // 4:
+            # one http log shouldn't flush everything else
+            self.discard(_id)
+            return
+        obj = _copy(obj)
+        with self._lock:
+            self._discard(_id)
+            self._entries[_id] = (version, obj, size)
+            self._bytes += size
+            while self._bytes > self._max_bytes:
+                _, (_, _, evicted) = self._entries.popitem(last=False)
+                self._bytes -= evicted
+
+    def discard(self, _id: str) -> None:
+        with self._lock:
+            self._discard(_id)
+
+    def _discard(self, _id: str) -> None:
+        entry = self._entries.pop(_id, None)
+        if entry is not None:
+            self._bytes -= entry[2]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses,
+                    'entries': len(self._entries), 'bytes': self._bytes}
+
+
+def _bucket(timestamp: float) -> str:
+    return datetime.datetime.fromtimestamp(timestamp, datetime.timezone.utc).strftime('%Y-%m')
+
+
+def _shard(_id: str) -> Tuple[str, str]:
+    """The (type, month bucket) an object id belongs to."""
+    try:
+        parsed = tokens.parse(_id)
+        bucket = _bucket(parsed['timestamp'])
+    except (TypeError, IndexError, OverflowError, OSError, ValueError):
+        raise ValueError(f"Invalid _id: {_id}")
+    if '_' not in _id or not parsed['prefix']:
+        raise ValueError(f"Invalid _id: {_id}")
+    return parsed['prefix'], bucket
+
+
+def _bucket_end(bucket: str) -> float:
+    """First instant after a month bucket, as a timestamp; inf for directories we didn't make."""
+    try:
+        year, month = (int(p) for p in bucket.split('-'))
+    except ValueError:
+        return float('inf')
+    year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+    return datetime.datetime(year, month, 1, tzinfo=datetime.timezone.utc).timestamp()
+
+
+def _bucket_overlaps(bucket: str, since: float = None, until: float = None) -> bool:
+    """Whether a month bucket can hold timestamps in [since, until]."""
+    try:
+        year, month = (int(p) for p in bucket.split('-'))
+        start = datetime.datetime(year, month, 1, tzinfo=datetime.timezone.utc)
+    except ValueError:
+        # not a bucket we made, don't prune it
+        return True
+    year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+    end = datetime.datetime(year, month, 1, tzinfo=datetime.timezone.utc)
+    return (since is None or since < end.timestamp()) and (until is None or until >= start.timestamp())
 
 
 class Storage(object):
-    def __init__(self, root_directory: str):
+    """
+    Objects keyed by token, sharded on disk by type and month:
+
+        <root>/<type>/<yyyy-mm>/<token>.json
+
+    so listing a type never touches another type's files and cleanup() leaves
+    whole months behind to remove.
+
+    Objects are written with `codec` (see serializers.py, defaults to the
+    STORAGE_CODEC environment variable, then json) and read back whatever
+    codec wrote them. Files keep the .json name either way.
+
+    Reads go through an ObjectCache of up to `cache_bytes` (defaults to the
+    STORAGE_CACHE_BYTES environment variable, 0 turns it off).
+    """
+    def __init__(self, root_directory: str, codec: str = None, cache_bytes: int = None):
         self._root = root_directory
+        self._codec = serializers.get_codec(codec or os.environ.get('STORAGE_CODEC', 'json'))
+        if cache_bytes is None:
+            cache_bytes = int(os.environ.get('STORAGE_CACHE_BYTES', CACHE_MAX_BYTES))
+        self._cache = ObjectCache(cache_bytes) if cache_bytes > 0 else None
+        self._lock = threading.RLock()
         os.makedirs(self._root, exist_ok=True)
+        self._migrate_flat_layout()
+
+    def _migrate_flat_layout(self):
+        # objects used to live directly in the root directory
+        for entry in os.scandir(self._root):
+            if not entry.is_file() or not entry.name.endswith('.json'):
+                continue
+            _id = entry.name[:-5]
+            try:
+                target = self._filename_for_id(_id)
+            except ValueError:
+                continue
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            try:
+                if os.path.exists(target) and os.path.getmtime(target) >= entry.stat().st_mtime:
+                    # already rewritten in the new layout
+                    os.unlink(entry.path)
+                else:
+                    os.replace(entry.path, target)
+            except FileNotFoundError:
+                # another process migrated it first
+                pass
+
+    def put(self, _id: str, obj: dict, expected_version: str = None,
+            merge: Callable[[dict, dict], dict] = None) -> str:
+        """
+        Write an object, atomically.
 
-    def put(self, _id: str, obj: dict) -> None:
+        With expected_version (from get_versioned(), or ABSENT for a new
+        object) this is a compare-and-swap: if the stored object changed in
+        the meantime, merge(ours, theirs) is asked to reconcile the two and the
+        write is retried against the newer version. Without a merge hook, or
+        when it keeps losing the race, ConflictError is raised.
+
+        :return: the version of the object as written
+        """
         if not tokens.is_valid_token(_id):
             raise ValueError(f"Invalid _id: {_id}")
 
         filename = self._filename_for_id(_id)
-        with open(filename, 'w') as f:
-            json.dump(obj, f)
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        if expected_version is None:
+            st = _write_atomic(filename, self._codec.encode(obj))
+            self._uncache(_id)
+            self._advance_ref(_id)
+            return _version(st)
+
+        for _ in range(MAX_MERGE_ATTEMPTS):
+            with self._locked(os.path.join(self._root, '.lock')):
+                current = self.version(_id) or ABSENT
+                if current == expected_version:
+                    st = _write_atomic(filename, self._codec.encode(obj))
+                    break
+                if merge is None:
+                    raise ConflictError(f"{_id} changed: expected version {expected_version}, found {current}")
+                theirs, expected_version = self.get_versioned(_id)
+                expected_version = expected_version or ABSENT
+            obj = merge(obj, theirs)
+        else:
+            raise ConflictError(f"{_id} kept changing, gave up after {MAX_MERGE_ATTEMPTS} merges")
+
+        self._uncache(_id)
+        self._advance_ref(_id)
+        return _version(st)
+
+    def _uncache(self, _id: str) -> None:
+        # not re-cached from obj, it may not decode back equal (int keys, tuples)
+        if self._cache is not None:
+            self._cache.discard(_id)
 
     def get(self, _id) -> Union[dict, None]:
+        return self.get_versioned(_id)[0]
+
+    def get_versioned(self, _id) -> Union[Tuple[dict, str], Tuple[None, None]]:
+        """The object and its version, for a later compare-and-swap put()."""
         if not tokens.is_valid_token(_id):
             raise ValueError(f"Invalid _id: {_id}")
 
-        filename = self._filename_for_id(_id)
-        if not os.path.isfile(filename):
+        filename = self._stored_filename(_id)
+        if filename is None:
+            return None, None
+        try:
+            if self._cache is not None:
+                version = _version(os.stat(filename))
+                obj = self._cache.get(_id, version)
+                if obj is not None:
+                    return obj, version
+
+            with open(filename, 'rb') as f:
+                # stat the open file, so the version matches what was read
+                st = os.fstat(f.fileno())
+                obj = serializers.decode(f.read())
+        except FileNotFoundError:
+            self._uncache(_id)
+            return None, None
+        if self._cache is not None:
+            self._cache.put(_id, _version(st), obj, st.st_size)
+        return obj, _version(st)
+
+    def cache_stats(self) -> dict:
+        """Hit and miss counts of the read cache, all zero when it is off."""
+        if self._cache is None:
+            return {'hits': 0, 'misses': 0, 'entries': 0, 'bytes': 0}
+        return self._cache.stats()
+
+    def version(self, _id) -> Union[str, None]:
+        if not tokens.is_valid_token(_id):
+            raise ValueError(f"Invalid _id: {_id}")
+
+        filename = self._stored_filename(_id)
+        if filename is None:
+            return None
+        try:
+            return _version(os.stat(filename))
+        except FileNotFoundError:
             return None
 
-        with open(filename, 'r') as f:
-            return json.load(f)
+    @contextmanager
+    def _locked(self, lock_filename: str):
+        # writers are in other processes (cron, planner), not just other threads
+        os.makedirs(os.path.dirname(lock_filename), exist_ok=True)
+        with self._lock, open(lock_filename, 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            yield
+
+    def last_modified(self, _id: str) -> Union[float, None]:
+        """mtime of an object, None if missing."""
+        if not tokens.is_valid_token(_id):
+            raise ValueError(f"Invalid _id: {_id}")
+
+        filename = self._stored_filename(_id)
+        if filename is None:
+            return None
+        try:
+            return os.stat(filename).st_mtime
+        except FileNotFoundError:
+            return None
 
     def _filename_for_id(self, _id):
-        filename = os.path.join(self._root, f"{_id}.json")
-        return filename
+        obj_type, bucket = _shard(_id)
+        return os.path.join(self._root, obj_type, bucket, f"{_id}.json")
+
+    def _stored_filename(self, _id: str) -> Union[str, None]:
+        """Where an object would be, None for ids put() can't have written (e.g. 'foo', 'job_')."""
+        try:
+            return self._filename_for_id(_id)
+        except ValueError:
+            return None
+
+    def _type_directory(self, obj_type: str) -> str:
+        return os.path.join(self._root, obj_type)
+
+    def types(self) -> List[str]:
+        """Every object type with anything stored."""
+        return sorted(e.name for e in os.scandir(self._root) if e.is_dir() and not e.name.startswith('.'))
+
+    def _buckets(self, obj_type: str) -> List[str]:
+        try:
+            return sorted(e.name for e in os.scandir(self._type_directory(obj_type)) if e.is_dir())
+        except FileNotFoundError:
+            return []
+
+    def _entries(self, obj_type: str, buckets: List[str] = None) -> Generator[Tuple[str, os.DirEntry], None, None]:
+        # filenames only, nothing is decoded
+        for bucket in self._buckets(obj_type) if buckets is None else buckets:
+            try:
+                entries = os.scandir(os.path.join(self._type_directory(obj_type), bucket))
+            except FileNotFoundError:
+                continue
+            with entries:
+                for entry in entries:
+                    if entry.name.endswith('.json') and not entry.name.startswith('.'):
+                        yield entry.name[:-5], entry
+
+    def _tokens(self, obj_type: str, buckets: List[str] = None) -> Generator[str, None, None]:
+        for token, _ in self._entries(obj_type, buckets):
+            yield token
+
+    def _index_filename(self, name: str) -> str:
+        return os.path.join(self._root, '.index', f"{name}.json")
+
+    def get_index(self, name: str) -> Union[dict, None]:
+        """
+        Read a derived index maintained alongside the objects, e.g. a lookup
+        table that saves callers from scanning a whole type. Indexes live in a
+        hidden directory so they never show up in list().
+        """
+        filename = self._index_filename(name)
+        if not os.path.isfile(filename):
+            return None
+        with open(filename, 'rb') as f:
+            return serializers.decode(f.read())
+
+    def put_index(self, name: str, index: dict) -> None:
+        filename = self._index_filename(name)
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        _write_atomic(filename, self._codec.encode(index))
+
+    def update_index(self, name: str, update: Callable[[Union[dict, None]], dict]) -> dict:
+        """Read-modify-write an index, safe against writers in other processes."""
+        with self._locked(os.path.join(self._root, '.lock')):
+            index = update(self.get_index(name))
+            self.put_index(name, index)
+        return index
+
+    def index_names(self) -> List[str]:
+        try:
+            return sorted(f[:-5] for f in os.listdir(os.path.join(self._root, '.index')) if f.endswith('.json'))
+        except FileNotFoundError:
+            return []
+
+    def _ref_filename(self, obj_type: str) -> str:
+        return os.path.join(self._root, '.refs', obj_type)
 
-    def list(self, obj_type: str, query: dict = None) -> Generator[Tuple[str, dict], None, None]:
-        for filename in glob.glob(f"{self._root}/{obj_type}_*.json"):
-            _id = os.path.basename(filename)[:-5]
+    def _refs_locked(self):
+        return self._locked(self._ref_filename('.lock'))
+
+    def _read_ref(self, obj_type: str) -> Union[str, None]:
+        try:
+            with open(self._ref_filename(obj_type), 'r') as f:
+                token = f.read().strip()
+        except FileNotFoundError:
+            return None
+        filename = self._stored_filename(token) if token and tokens.is_valid_token(token) else None
+        if filename is None or not os.path.isfile(filename):
+            # dangling, e.g. the head was removed by cleanup()
+            return None
+        return token
+
+    def _write_ref(self, obj_type: str, token: str) -> None:
+        filename = self._ref_filename(obj_type)
+        with open(f"{filename}.tmp", 'w') as f:
+            f.write(token)
+        os.replace(f"{filename}.tmp", filename)
+
+    def _advance_ref(self, _id: str) -> None:
+        obj_type = tokens.parse(_id)['prefix']
+        # refs only exist for types someone asked for the head of, so
+        # write-heavy types like http logs don't pay for them. A ref file is
+        # created before head() scans for it (see _rebuild_ref), so a put that
+        # sees no ref here was on disk in time for that scan.
+        if not os.path.isfile(self._ref_filename(obj_type)):
+            return
+        with self._refs_locked():
+            head = self._read_ref(obj_type)
+            if head is None:
+                self._rebuild_ref(obj_type)
+            elif token_order(_id) > token_order(head):
+                self._write_ref(obj_type, _id)
+
+    def _rebuild_ref(self, obj_type: str) -> Union[str, None]:
+        # called with the refs lock held; from here on put() advances the ref
+        # itself, under that lock, so nothing written after the scan is missed
+        if not os.path.isfile(self._ref_filename(obj_type)):
+            self._write_ref(obj_type, '')
+        candidates = list(self._tokens(obj_type))
+        if not candidates:
+            return None
+        head = max(candidates, key=token_order)
+        self._write_ref(obj_type, head)
+        return head
+
+    def head(self, obj_type: str) -> Union[str, None]:
+        """
+        Id of the newest object of a type, like a git ref: one small file read
+        and a stat of the object it names. Maintained by put() and rebuilt
+        from the filenames if missing or dangling; see repair_refs() for refs
+        left behind by writers that didn't advance them.
+        """
+        head = self._read_ref(obj_type)
+        if head is not None:
+            return head
+        with self._refs_locked():
+            return self._rebuild_ref(obj_type)
+
+    def repair_refs(self) -> List[str]:
+        """
+        Rebuild every ref from the filenames, for objects written without
+        advancing it (copied in, or by older code). Run at startup, it scans
+        each type that has a ref.
+        :return: the types whose head changed
+        """
+        try:
+            names = [n for n in os.listdir(os.path.join(self._root, '.refs'))
+                     if not n.startswith('.') and not n.endswith('.tmp')]
+        except FileNotFoundError:
+            return []
+        repaired = []
+        with self._refs_locked():
+            for obj_type in sorted(names):
+                before = self._read_ref(obj_type)
+                if self._rebuild_ref(obj_type) != before:
+                    repaired.append(obj_type)
+        return repaired
+
+    def count(self, obj_type: str) -> int:
+        return sum(1 for _ in self._tokens(obj_type))
+
+    def list(self, obj_type: str, query: Union[dict, Query] = None) -> Generator[Tuple[str, dict], None, None]:
+        """
+        Objects of a type matching a query, see query.py. Conditions on
+        $timestamp are checked against the filenames, files outside the range
+        are never opened.
+        """
+        if query is not None and not isinstance(query, Query):
+            query = Query(query)
+
+        buckets = self._buckets(obj_type)
+        if query is not None:
+            buckets = [b for b in buckets if _bucket_overlaps(b, query.since, query.until)]
+
+        for _id in self._tokens(obj_type, buckets):
+            if query is not None and not query.matches_token(_id):
+                continue
             value = self.get(_id)
-            if query is None or matches_query(value, query):
+            if value is None:
+                # deleted since the directory was read
+                continue
+            if query is None or query.matches(value):
                 yield _id, value
 
-    def latest(self, obj_type: str, query: dict = None) -> Union[tuple[str, dict], tuple[None, None]]:
-        # objects are assumed to use token from tokens lib,
-        # be ordinal by timestamp.
+    def latest(self, obj_type: str, query: Union[dict, Query] = None) -> Union[tuple[str, dict], tuple[None, None]]:
+        if query is None:
+            head = self.head(obj_type)
+            if head is None:
+                return None, None
+            return head, self.get(head)
 
-        objs = sorted([(tokens.parse(t)['timestamp'], t, o) for t, o in list(self.list(obj_type, query=query))])
+        objs = sorted([(*token_order(t), o) for t, o in list(self.list(obj_type, query=query))])
         if objs:
             return objs[-1][1:]
         return None, None
 
-    def cleanup(self, obj_type: str, retention_count: int = None, retention_window: timedelta = None, dry_run=True) -> List[Tuple[str, dict]]:
-        to_delete = []
-        now = datetime.datetime.now()
-        remaining_count = retention_count or 1
-        for token, obj in sorted(self.list(obj_type)):
-            if retention_count:
-                remaining_count -= 1
-            if remaining_count < 0:
-                to_delete.append((token, obj))
-                continue
-            parsed = tokens.parse(token)
-            delta = now - datetime.datetime.fromtimestamp(parsed['timestamp'])
-            if retention_window and delta > retention_window:
-                to_delete.append((token, obj))
+    def cleanup(self, obj_type: str, retention_count: int = None, retention_window: timedelta = None,
+                dry_run=True, deadline: float = None, batch_size: int = CLEANUP_BATCH_SIZE,
+                pause: float = 0) -> CleanupReport:
+        """
+        Delete objects outside the retention policy: all but the newest
+        retention_count, and anything older than retention_window. Decided
+        from the timestamps in the tokens alone, no object is read.
+
+        Deletes go oldest first, batch_size files at a time with `pause`
+        seconds in between. Past the deadline (a time.time() value) it stops
+        at the next batch and reports complete=False, running it again picks
+        up where it left off.
+        """
+        report = CleanupReport(obj_type, dry_run)
+        entries = dict(self._entries(obj_type))
+        expired = [(token, entries[token]) for token in _expired(entries, retention_count, retention_window)]
+
+        # months entirely past the retention window go as whole directories
+        whole = set()
+        if retention_window:
+            cutoff = time.time() - retention_window.total_seconds()
+            whole = {b for b in self._buckets(obj_type) if _bucket_end(b) <= cutoff}
+        by_bucket = {}
+        for token, entry in expired:
+            by_bucket.setdefault(os.path.basename(os.path.dirname(entry.path)), []).append((token, entry))
+        units = [(bucket, by_bucket[bucket]) for bucket in sorted(by_bucket) if bucket in whole]
+        rest = [(token, entry) for token, entry in expired
+                if os.path.basename(os.path.dirname(entry.path)) not in whole]
+        units += [(None, rest[start:start + batch_size]) for start in range(0, len(rest), batch_size)]
+
+        for n, (bucket, batch) in enumerate(units):
+            if deadline is not None and time.time() >= deadline:
+                report.complete = False
+                break
+            if n and pause:
+                time.sleep(pause)
+            if bucket is not None:
+                self._delete_bucket(obj_type, bucket, batch, report)
                 continue
+            for token, entry in batch:
+                try:
+                    size = entry.stat().st_size
+                    if not dry_run:
+                        os.unlink(entry.path)
+                except FileNotFoundError:
+                    # removed by someone else meanwhile
+                    continue
+                except OSError:
+                    logging.exception(f"Failed to delete {token}")
+                    continue
+                report.deleted.append(token)
+                report.bytes_reclaimed += size
 
         if not dry_run:
-            for _id, _ in to_delete:
-                filename = self._filename_for_id(_id)
-                try:
-                    os.unlink(filename)
-                except Exception:
-                    logging.exception(f"Failed to delete {_id}")
+            self._remove_empty_buckets(obj_type)
+        return report
+
+    def _delete_bucket(self, obj_type: str, bucket: str, batch: list, report: CleanupReport) -> None:
+        sizes = []
+        for token, entry in batch:
+            try:
+                sizes.append((token, entry.stat().st_size))
+            except FileNotFoundError:
+                continue
+        if not report.dry_run:
+            try:
+                shutil.rmtree(os.path.join(self._type_directory(obj_type), bucket))
+            except FileNotFoundError:
+                pass
+            except OSError:
+                logging.exception(f"Failed to delete {obj_type}/{bucket}")
+                return
+        for token, size in sizes:
+            report.deleted.append(token)
+            report.bytes_reclaimed += size
+
+    def _remove_empty_buckets(self, obj_type: str) -> None:
+        for bucket in self._buckets(obj_type):
+            try:
+                os.rmdir(os.path.join(self._type_directory(obj_type), bucket))
+            except OSError:
+                # not empty
+                pass
+
 
-        return to_delete
+_memory_stores = {}
+_memory_stores_lock = threading.Lock()
 
 
+def open_storage(root_directory: str, backend: str = None, **kwargs):
+    """
+    The store for a directory, on disk unless STORAGE_BACKEND (or `backend`)
+    says 'memory', e.g. for ephemeral runs that mustn't touch real data.
+    """
+    backend = backend or os.environ.get('STORAGE_BACKEND', 'file')
+    if backend == 'file':
+        return Storage(root_directory, **kwargs)
+    if backend == 'memory':
+        from memory_storage import MemoryStorage
+        # modules open the same directory separately, they must see one store
+        key = os.path.abspath(root_directory)
+        with _memory_stores_lock:
+            if key not in _memory_stores:
+                _memory_stores[key] = MemoryStorage(**kwargs)
+            return _memory_stores[key]
+    raise ValueError(f"Unknown storage backend: {backend}")
@@ -48,7 +48,7 @@ def main():
     console = Console()
     
     # Initialize the storage
-    db = storage.Storage('./storage')
+    db = storage.open_storage('./storage')
     
     # Get the latest plan
     _, plan = db.latest('plan')
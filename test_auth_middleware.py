@@ -8,7 +8,11 @@ import base64
 import time
 import unittest
 from unittest.mock import patch, Mock
+from wsgiref.util import setup_testing_defaults
+
+from bottle import Bottle
 from auth_middleware import (
+    BasicAuthPlugin,
     get_auth_credentials,
     parse_basic_auth,
     require_basic_auth,
@@ -244,6 +248,73 @@ class TestAuthDecorator(unittest.TestCase):
         mock_verify.assert_called_once_with('valid-token', 'test-secret')
 
 
+class TestAuthPlugin(unittest.TestCase):
+
+    def setUp(self):
+        with patch.dict(os.environ, {'AUTH_COOKIE_SECRET': 'test-secret'}):
+            self.plugin = BasicAuthPlugin(public_prefixes=('/static/',))
+            self.app = Bottle()
+            self.app.install(self.plugin)
+
+        @self.app.get('/protected')
+        def protected():
+            return "success"
+
+        @self.app.get('/health', skip=['basic_auth'])
+        def health():
+            return "ok"
+
+        @self.app.get('/static/app.js')
+        def static():
+            return "js"
+
+    def call(self, path, headers=None):
+        environ = {}
+        setup_testing_defaults(environ)
+        environ['PATH_INFO'] = path
+        environ.update(headers or {})
+        status = []
+        body = b''.join(self.app(environ, lambda s, h, e=None: status.append((s, h))))
+        return status[0][0], dict(status[0][1]), body.decode('utf-8')
+
+    def test_basic_auth_sets_session_cookie(self):
+        """Test that valid Basic auth logs in and sets a cookie."""
+        credentials = base64.b64encode(b'user:pass').decode('ascii')
+        status, headers, body = self.call('/protected', {'HTTP_AUTHORIZATION': f'Basic {credentials}'})
+        self.assertTrue(status.startswith('200'))
+        self.assertIn('auth_session=', headers['Set-Cookie'])
+
+    def test_session_cookie_verified_once(self):
+        """Test that a verified session is cached for repeat requests."""
+        token = create_auth_token('user', 'test-secret')
+        with patch.object(self.plugin, '_mac', wraps=self.plugin._mac) as mac:
+            for _ in range(3):
+                status, _, _ = self.call('/protected', {'HTTP_COOKIE': f'auth_session={token}'})
+                self.assertTrue(status.startswith('200'))
+            self.assertEqual(mac.copy.call_count, 1)
+
+    def test_secret_read_once(self):
+        """Test that the secret isn't looked up per request."""
+        token = create_auth_token('user', 'test-secret')
+        with patch('auth_middleware.get_cookie_secret') as mock_get_secret:
+            self.call('/protected', {'HTTP_COOKIE': f'auth_session={token}'})
+            mock_get_secret.assert_not_called()
+
+    def test_rejects_token_signed_with_other_secret(self):
+        """Test that a cookie signed with another secret is refused."""
+        token = create_auth_token('user', 'other-secret')
+        status, _, _ = self.call('/protected', {'HTTP_COOKIE': f'auth_session={token}'})
+        self.assertTrue(status.startswith('401'))
+
+    def test_skipped_and_public_routes_bypass_auth(self):
+        """Test that skip=['basic_auth'] and public prefixes need no credentials."""
+        status, _, body = self.call('/health')
+        self.assertTrue(status.startswith('200'))
+        self.assertEqual(body, 'ok')
+        status, _, body = self.call('/static/app.js')
+        self.assertTrue(status.startswith('200'))
+
+
 class TestLogout(unittest.TestCase):
     
     @patch('auth_middleware.response')
@@ -1,9 +1,12 @@
 import shutil
 import copy
 import tempfile
+import threading
 from unittest import TestCase
 
 import tokens
+from bookings import booking_index, record_booking
+from plans import merge_onto, merge_plans
 from web import mark_bookings
 
 from storage import Storage
@@ -77,3 +80,70 @@ class TestPlans(TestCase):
         self.storage.put(plan_id, plan)
         from_storage = self.storage.get(plan_id)
         self.assertTrue(from_storage['LB03']['scheduled'])
+
+    def test_mark_booking_recorded_after_index_built(self):
+        plan = copy.deepcopy(TEST_PLAN)
+        mark_bookings(plan, self.storage)
+        self.assertNotIn('scheduled', plan['LB03'])
+
+        record_booking(self.storage, tokens.generate_token('book'), TEST_BOOKING)
+        mark_bookings(plan, self.storage)
+        self.assertTrue(plan['LB03']['scheduled'])
+
+    def test_concurrent_bookings_all_indexed(self):
+        # as if from cron's member threads and the watcher, each with its own store
+        def book(n):
+            record_booking(Storage(self.storage_directory), tokens.generate_token('book'),
+                           {'scheduled_id': str(1400000 + n)})
+        threads = [threading.Thread(target=book, args=(n,)) for n in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        index = self.storage.get_index('book_by_schedule')
+        self.assertEqual(index['count'], 8)
+        self.assertEqual(len(index['by_schedule']), 8)
+
+    def test_booking_index_rebuilt_when_stale(self):
+        self.assertEqual({}, booking_index(self.storage))
+        # written without going through record_booking
+        self.storage.put(tokens.generate_token('book'), TEST_BOOKING)
+        self.assertIn(TEST_BOOKING['scheduled_id'], booking_index(self.storage))
+
+    def test_merge_keeps_bookings_and_plan_edits(self):
+        base = copy.deepcopy(TEST_PLAN)
+        # the web app drops LB16 and adds nothing, cron books LB03 meanwhile
+        web = copy.deepcopy(TEST_PLAN)
+        del web['LB16']
+        cron = copy.deepcopy(TEST_PLAN)
+        cron['LB03']['scheduled'] = True
+
+        merged = merge_plans(base, web, cron)
+        self.assertEqual(set(merged), {'LB03', 'LB06', 'LB19'})
+        self.assertTrue(merged['LB03']['scheduled'])
+        self.assertEqual(merged, merge_plans(base, cron, web))
+
+    def test_merge_keeps_class_booked_while_removed(self):
+        base = copy.deepcopy(TEST_PLAN)
+        web = copy.deepcopy(TEST_PLAN)
+        del web['LB03']
+        cron = copy.deepcopy(TEST_PLAN)
+        cron['LB03']['scheduled'] = True
+        self.assertIn('LB03', merge_plans(base, web, cron))
+
+    def test_concurrent_plan_writes_are_merged(self):
+        plan_id = tokens.generate_token('plan')
+        self.storage.put(plan_id, TEST_PLAN)
+        cron_plan, version = self.storage.get_versioned(plan_id)
+
+        web_plan = copy.deepcopy(TEST_PLAN)
+        del web_plan['LB19']
+        self.storage.put(plan_id, web_plan)
+
+        base = copy.deepcopy(cron_plan)
+        cron_plan['LB16']['scheduled'] = True
+        self.storage.put(plan_id, cron_plan, expected_version=version, merge=merge_onto(base))
+
+        stored = self.storage.get(plan_id)
+        self.assertNotIn('LB19', stored)
+        self.assertTrue(stored['LB16']['scheduled'])
@@ -0,0 +1,166 @@
+"""
+Unit tests for the JSON plan API in web.py
+"""
+import base64
+import io
+import json
+import shutil
+import tempfile
+import unittest
+from unittest.mock import patch
+from wsgiref.util import setup_testing_defaults
+
+import bottle
+
+import events
+import jobs
+import tokens
+import web
+from members import Member, add_member
+from storage import Storage
+
+SCHEDULE = [
+    {
+        "event_id": "850377",
+        "slug": "LB03",
+        "description": "LB03 | Live Ball 3.5-4.0 Drop-in | Monday 7:30pm-8:45pm on 04/22/2024",
+        "schedule": "Monday 7:30pm-8:45pm",
+        "schedule_id": "1408968",
+        "timestamp": 1713839400
+    },
+    {
+        "event_id": "850362",
+        "slug": "LB06",
+        "description": "LB06 | Live Ball 4.0+ Drop-in | Tuesday 6:15pm-7:30pm on 04/23/2024",
+        "schedule": "Tuesday 6:15pm-7:30pm",
+        "schedule_id": "1408991",
+        "timestamp": 1713921300
+    }
+]
+
+
+def call(method, path, body=None):
+    environ = {}
+    setup_testing_defaults(environ)
+    data = json.dumps(body).encode('utf-8') if body is not None else b''
+    path, _, query = path.partition('?')
+    environ.update({
+        'REQUEST_METHOD': method,
+        'PATH_INFO': path,
+        'QUERY_STRING': query,
+        'CONTENT_TYPE': 'application/json',
+        'CONTENT_LENGTH': str(len(data)),
+        'wsgi.input': io.BytesIO(data),
+        'HTTP_AUTHORIZATION': 'Basic ' + base64.b64encode(b'user:pass').decode('ascii'),
+    })
+    status = []
+    result = b''.join(bottle.default_app()(environ, lambda s, h, e=None: status.append(s)))
+    return int(status[0].split()[0]), result
+
+
+class TestPlanApi(unittest.TestCase):
+
+    def setUp(self):
+        self.storage_directory = tempfile.mkdtemp()
+        self.storage = Storage(self.storage_directory)
+        self.schedule_id = tokens.generate_token('sched')
+        self.storage.put(self.schedule_id, SCHEDULE)
+        self.plan_id = tokens.swap_prefix(self.schedule_id, 'plan')
+        self.storage.put(self.plan_id, {'LB06': SCHEDULE[1]})
+        patcher = patch.object(web, 'storage', self.storage)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        jobs.wait_for_idle(timeout=5)
+        shutil.rmtree(self.storage_directory)
+
+    def test_metrics(self):
+        """Test that /metrics serves Prometheus text"""
+        status, body = call('GET', '/metrics')
+        self.assertEqual(status, 200)
+        self.assertIn(b'# TYPE booking_phase_seconds histogram', body)
+        self.assertIn(b'storage_cache_misses_total', body)
+
+    def test_get_plan(self):
+        """Test that the plan is served as JSON"""
+        status, body = call('GET', f'/api/plan/{self.schedule_id}')
+        self.assertEqual(status, 200)
+        self.assertEqual(list(json.loads(body)['classes']), ['LB06'])
+
+    def test_get_schedule_marks_planned_classes(self):
+        """Test that schedule classes carry their plan state"""
+        status, body = call('GET', f'/api/schedule/{self.schedule_id}')
+        self.assertEqual(status, 200)
+        checked = {c['slug']: c['checked'] for c in json.loads(body)['classes']}
+        self.assertEqual(checked, {'LB03': '', 'LB06': 'checked'})
+
+    def test_patch_adds_single_class(self):
+        """Test that checking a class adds only that entry"""
+        status, body = call('PATCH', f'/api/plan/{self.schedule_id}/LB03', {'checked': True})
+        self.assertEqual(status, 200)
+        result = json.loads(body)
+        self.assertEqual(result['num_selected'], 2)
+        self.assertIsNotNone(result['job_id'])
+        self.assertEqual(set(self.storage.get(self.plan_id)), {'LB03', 'LB06'})
+
+    def test_patch_removes_single_class(self):
+        """Test that unchecking a class removes it"""
+        status, _ = call('PATCH', f'/api/plan/{self.schedule_id}/LB06', {'checked': False})
+        self.assertEqual(status, 200)
+        self.assertEqual(self.storage.get(self.plan_id), {})
+
+    def test_patch_without_change_skips_calendar(self):
+        """Test that a no-op toggle doesn't queue a calendar update"""
+        status, body = call('PATCH', f'/api/plan/{self.schedule_id}/LB06', {'checked': True})
+        self.assertEqual(status, 200)
+        self.assertIsNone(json.loads(body)['job_id'])
+
+    def test_patch_rejects_bad_requests(self):
+        """Test that unknown classes and malformed bodies are refused"""
+        status, _ = call('PATCH', f'/api/plan/{self.schedule_id}/LB99', {'checked': True})
+        self.assertEqual(status, 404)
+        status, _ = call('PATCH', f'/api/plan/{self.schedule_id}/LB03', {'checked': 'yes'})
+        self.assertEqual(status, 400)
+
+    def test_member_plans(self):
+        """Test that ?member= reads and edits that member's plan, leaving the default member's alone"""
+        add_member(self.storage, Member('ana', 'Ana', 'ana@example.com', password_env='ANA_PASSWORD'))
+        status, body = call('GET', f'/api/plan/{self.schedule_id}?member=ana')
+        self.assertEqual(status, 404)
+
+        status, _ = call('PATCH', f'/api/plan/{self.schedule_id}/LB03?member=ana', {'checked': True})
+        self.assertEqual(status, 200)
+        ana_plan_id = tokens.swap_prefix(self.schedule_id, 'plan_ana')
+        self.assertEqual(list(self.storage.get(ana_plan_id)), ['LB03'])
+        self.assertEqual(list(self.storage.get(self.plan_id)), ['LB06'])
+
+        status, body = call('GET', f'/api/schedule/{self.schedule_id}?member=ana')
+        checked = {c['slug']: c['checked'] for c in json.loads(body)['classes']}
+        self.assertEqual(checked, {'LB03': 'checked', 'LB06': ''})
+        status, body = call('GET', f'/schedule/{self.schedule_id}?member=ana')
+        self.assertEqual(status, 200)
+        self.assertIn(b'action="/plan/' + self.schedule_id.encode() + b'?member=ana"', body)
+        status, _ = call('GET', f'/api/plan/{self.schedule_id}?member=bo')
+        self.assertEqual(status, 404)
+
+    def test_unparseable_ids_are_not_found(self):
+        """Test that ids storage couldn't have written are a 404, not a 500"""
+        for path in ('/schedule/foo', '/api/schedule/foo', '/api/plan/foo', '/jobs/job_'):
+            status, _ = call('GET', path)
+            self.assertEqual(status, 404, path)
+        status, _ = call('PATCH', '/api/plan/foo/LB03', {'checked': True})
+        self.assertEqual(status, 404)
+
+    def test_event_streams_are_capped(self):
+        """Test that streams past the cap are turned away instead of taking a server thread"""
+        # as if every allowed stream were already open
+        with patch.object(events, 'MAX_STREAMS', 0):
+            status, _ = call('GET', '/events')
+        self.assertEqual(status, 503)
+        status, _ = call('GET', '/events?member=bo')
+        self.assertEqual(status, 404)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,45 @@
+"""
+Unit tests for the booking window check in cronv2.py
+"""
+import subprocess
+import sys
+import unittest
+from datetime import datetime, timedelta
+
+from cronv2 import due_classes
+
+
+class TestDueClasses(unittest.TestCase):
+
+    def setUp(self):
+        self.now = datetime(2025, 10, 27, 12, 0)
+
+    def _class(self, slug, delta, **extra):
+        return {'slug': slug, 'timestamp': (self.now + delta).timestamp(), **extra}
+
+    def test_only_classes_inside_window_are_due(self):
+        """Test that classes within 2 days and 2 minutes are due"""
+        plan = {
+            'LB01': self._class('LB01', timedelta(days=2, minutes=1)),
+            'LB02': self._class('LB02', timedelta(days=2, minutes=3)),
+            'LB03': self._class('LB03', timedelta(hours=-1)),
+        }
+        self.assertEqual([c['slug'] for c in due_classes(plan, self.now)], ['LB01'])
+
+    def test_booked_and_failed_classes_are_skipped(self):
+        """Test that classes already booked or given up on are not retried"""
+        plan = {
+            'LB01': self._class('LB01', timedelta(days=1), scheduled=True),
+            'LB02': self._class('LB02', timedelta(days=1), failed=True),
+        }
+        self.assertEqual(list(due_classes(plan, self.now)), [])
+
+    def test_window_check_imports_no_booking_dependencies(self):
+        """Test that importing cronv2 doesn't pull in the network/calendar stack"""
+        code = "import sys, cronv2; print(sorted({'cal', 'client', 'requests', 'mail_client'} & set(sys.modules)))"
+        out = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True).stdout
+        self.assertEqual(out.strip(), '[]')
+
+
+if __name__ == '__main__':
+    unittest.main()
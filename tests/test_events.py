@@ -0,0 +1,86 @@
+"""
+Unit tests for live plan status in events.py
+"""
+import os
+import shutil
+import tempfile
+import unittest
+
+import tokens
+from events import PlanStatusFeed, PlanStatusFeeds, diff_status
+from memory_storage import MemoryStorage
+from storage import Storage
+
+
+class TestPlanStatusFeed(unittest.TestCase):
+
+    def setUp(self):
+        self.storage_directory = tempfile.mkdtemp()
+        self.storage = Storage(self.storage_directory)
+        self.plan_id = tokens.generate_token('plan')
+        self.storage.put(self.plan_id, {'LB03': {'slug': 'LB03'}, 'LB06': {'slug': 'LB06'}})
+        self.feed = PlanStatusFeed(self.storage)
+
+    def tearDown(self):
+        shutil.rmtree(self.storage_directory)
+
+    def _rewrite_plan(self, plan):
+        self.storage.put(self.plan_id, plan)
+        # make sure the change is visible even on coarse mtime filesystems
+        stat = os.stat(self.storage._filename_for_id(self.plan_id))
+        os.utime(self.storage._filename_for_id(self.plan_id), (stat.st_atime, stat.st_mtime + 1))
+
+    def test_first_poll_reports_every_class(self):
+        """Test that the initial poll reports the whole plan"""
+        changes = self.feed.poll()
+        self.assertEqual([c['slug'] for c in changes], ['LB03', 'LB06'])
+        self.assertEqual(self.feed.poll(), [])
+
+    def test_booking_is_broadcast(self):
+        """Test that a booking written by another process reaches subscribers"""
+        self.feed.poll()
+        q = self.feed.subscribe()
+        self.addCleanup(self.feed.unsubscribe, q)
+        self._rewrite_plan({'LB03': {'slug': 'LB03', 'scheduled': True}, 'LB06': {'slug': 'LB06'}})
+        # the feed's own watcher thread may get there first, either way it's queued once
+        self.feed.poll()
+        self.assertEqual(q.get(timeout=5), {
+            'plan_id': self.plan_id, 'slug': 'LB03', 'checked': True, 'scheduled': True, 'failed': False
+        })
+        self.assertTrue(q.empty())
+
+    def test_subscribers_are_limited(self):
+        """Test that a full feed refuses new subscribers until one leaves"""
+        # over memory storage, so the feed's watcher thread can outlive the test
+        feed = PlanStatusFeed(MemoryStorage())
+        first = feed.subscribe(limit=1)
+        self.assertIsNone(feed.subscribe(limit=1))
+        feed.unsubscribe(first)
+        second = feed.subscribe(limit=1)
+        self.assertIsNotNone(second)
+        feed.unsubscribe(second)
+
+    def test_feeds_per_member(self):
+        """Test that each plan type has its own feed, and the stream limit counts them all"""
+        storage = MemoryStorage()
+        ana_plan_id = tokens.generate_token('plan_ana')
+        storage.put(ana_plan_id, {'LB01': {'slug': 'LB01', 'scheduled': True}})
+        feeds = PlanStatusFeeds(storage)
+        self.assertEqual([c['plan_id'] for c in feeds.feed('plan_ana').poll()], [ana_plan_id])
+        self.assertEqual(feeds.feed('plan').poll(), [])
+
+        feed, first = feeds.subscribe('plan', limit=1)
+        self.assertIsNone(feeds.subscribe('plan_ana', limit=1)[1])
+        feed.unsubscribe(first)
+
+    def test_removed_class_is_unchecked(self):
+        """Test that dropping a class reports it as unchecked"""
+        old = {'LB03': {'checked': True, 'scheduled': False, 'failed': False}}
+        changes = diff_status('plan_x', old, {})
+        self.assertEqual(changes, [{
+            'plan_id': 'plan_x', 'slug': 'LB03', 'checked': False, 'scheduled': False, 'failed': False
+        }])
+
+
+if __name__ == '__main__':
+    unittest.main()
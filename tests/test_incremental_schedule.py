@@ -0,0 +1,115 @@
+"""
+Unit tests for building next week's schedule from last week's in build_next_week_schedule
+"""
+import datetime
+import unittest
+from unittest.mock import Mock
+
+import pytz
+
+import metrics
+from client import WEEK, build_next_week_schedule
+
+DAY = 24 * 60 * 60
+PACIFIC = pytz.timezone('America/Los_Angeles')
+
+
+def _title(slug, ts):
+    t = datetime.datetime.fromtimestamp(ts, PACIFIC)
+    return f"{slug} | {t.strftime('%A %I:%M%p').lower().capitalize()} on {t:%m/%d/%Y}"
+
+
+def _page(slug, event_id, first, weeks, skip=()):
+    buttons = ''.join(
+        f'<button class="register-button-closed" data-title="{_title(slug, first + w * WEEK)}" '
+        f'data-event-id="{event_id}" data-schedule-id="{event_id}-{w}">Not yet open</button>'
+        for w in range(weeks) if w not in skip)
+    return f'<html>{buttons}</html>'
+
+
+class TestIncrementalSchedule(unittest.TestCase):
+
+    def setUp(self):
+        # Fridays, when the planner runs, on the hour so classes land on whole minutes
+        self.now = float(int(datetime.datetime(2025, 10, 17, 12, tzinfo=datetime.timezone.utc).timestamp()))
+        self.pages = {
+            '900001': _page('LB01', '900001', self.now + 3 * DAY, 6),
+            '900002': _page('LB02', '900002', self.now + 5 * DAY, 6, skip=(2,)),
+        }
+        self.class_map = {
+            'LB01': [{'event_id': '900001', 'slug': 'LB01', 'description': 'Live Ball', 'schedule': 'Mon 9am'}],
+            'LB02': [{'event_id': '900002', 'slug': 'LB02', 'description': 'Live Ball', 'schedule': 'Wed 6pm'}],
+        }
+        self.session = Mock()
+        self.session.get.side_effect = lambda url: Mock(content=self.pages[url.split('=')[-1]].encode())
+        metrics.registry.drain()
+        self.addCleanup(metrics.registry.drain)
+
+    def _build(self, week, previous=None, pages=None):
+        self.session.get.reset_mock()
+        schedule = build_next_week_schedule(self.session, self.class_map, ['LB01', 'LB02'], previous=previous,
+                                            pages=pages, now=self.now + week * WEEK)
+        return schedule, self.session.get.call_count
+
+    def test_full_rescan_without_previous_schedule(self):
+        """Test that every page is fetched, and remembered, when there is no schedule to go on"""
+        pages = {}
+        schedule, fetched = self._build(0, pages=pages)
+        self.assertEqual(fetched, 2)
+        self.assertEqual([c['schedule_id'] for c in schedule], ['900001-0', '900002-0'])
+        self.assertEqual(sorted(pages), ['LB01', 'LB02'])
+
+        _, fetched = self._build(1, previous=None, pages=pages)
+        self.assertEqual(fetched, 2)
+
+    def test_predicts_from_last_weeks_schedule(self):
+        """Test that classes shifting by a week aren't fetched, and match what a full rescan finds"""
+        pages = {}
+        schedule, _ = self._build(0, pages=pages)
+        next_schedule, fetched = self._build(1, previous=schedule, pages=pages)
+        self.assertEqual(fetched, 0)
+        self.assertEqual(next_schedule, self._build(1)[0])
+        self.assertEqual(metrics.registry.drain()['counters']['schedule_instances_total'],
+                         {'source="fetched"': 4, 'source="predicted"': 2})
+
+    def test_stale_state_is_not_trusted(self):
+        """Test that a class last week's page showed Full is still predicted, booking finds out if it still is"""
+        pages = {}
+        schedule, _ = self._build(0, pages=pages)
+        for instance in pages['LB01']['instances']:
+            instance[4] = 'Full'
+        next_schedule, fetched = self._build(1, previous=schedule, pages=pages)
+        self.assertEqual(fetched, 0)
+        self.assertEqual([c['schedule_id'] for c in next_schedule], ['900001-1', '900002-1'])
+
+    def test_fetches_what_cannot_be_confirmed(self):
+        """Test that a skipped week or a changed class map entry sends the builder back to the page"""
+        pages = {}
+        schedule, _ = self._build(0, pages=pages)
+        schedule, fetched = self._build(1, previous=schedule, pages=pages)
+        self.assertEqual(fetched, 0)
+
+        # no LB02 in week 2: nothing a week on from last week's, so its page is checked
+        schedule, fetched = self._build(2, previous=schedule, pages=pages)
+        self.assertEqual(fetched, 1)
+        self.assertEqual([c['slug'] for c in schedule], ['LB01'])
+        # LB02 wasn't in last week's schedule, LB01 changed in the class map
+        self.class_map['LB01'][0]['schedule'] = 'Tue 9am'
+        schedule, fetched = self._build(3, previous=schedule, pages=pages)
+        self.assertEqual(fetched, 2)
+        self.assertEqual([c['schedule_id'] for c in schedule], ['900001-3', '900002-3'])
+
+    def test_old_pages_are_fetched_again(self):
+        """Test that a page isn't trusted for predictions forever"""
+        self.pages['900002'] = _page('LB02', '900002', self.now + 5 * DAY, 6)
+        pages, fetched = {}, []
+        schedule, _ = self._build(0, pages=pages)
+        for week in range(1, 6):
+            schedule, n = self._build(week, previous=schedule, pages=pages)
+            fetched.append(n)
+        self.assertEqual(fetched, [0, 0, 0, 0, 2])
+        self.assertEqual(len(schedule), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+"""
+Unit tests for background jobs in jobs.py
+"""
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+import jobs
+import tokens
+from storage import Storage
+
+
+class TestJobs(unittest.TestCase):
+
+    def setUp(self):
+        self.storage_directory = tempfile.mkdtemp()
+        self.storage = Storage(self.storage_directory)
+
+    def tearDown(self):
+        shutil.rmtree(self.storage_directory)
+
+    def test_job_runs_in_background(self):
+        """Test that a submitted job runs and is marked done"""
+        calls = []
+        job_id = jobs.submit(self.storage, 'test', calls.append, 'ran')
+        jobs.wait_for_idle(timeout=5)
+        self.assertEqual(calls, ['ran'])
+        job = jobs.status(self.storage, job_id)
+        self.assertEqual(job['status'], jobs.DONE)
+        self.assertEqual(job['name'], 'test')
+        self.assertIn('finished', job)
+
+    def test_failed_job_records_error(self):
+        """Test that an exception marks the job failed instead of escaping"""
+        def boom():
+            raise RuntimeError('calendar unavailable')
+        job_id = jobs.submit(self.storage, 'test', boom)
+        jobs.wait_for_idle(timeout=5)
+        job = jobs.status(self.storage, job_id)
+        self.assertEqual(job['status'], jobs.FAILED)
+        self.assertEqual(job['error'], 'calendar unavailable')
+
+    def test_status_rejects_other_objects(self):
+        """Test that the status lookup only serves job objects"""
+        self.assertIsNone(jobs.status(self.storage, 'plan_0abc'))
+        self.assertIsNone(jobs.status(self.storage, '../../etc/passwd'))
+
+    def test_orphaned_jobs_fail(self):
+        """Test that unfinished jobs of an earlier or dead process are marked failed"""
+        dead = subprocess.run([sys.executable, '-c', 'import os; print(os.getpid())'],
+                              capture_output=True, text=True).stdout.strip()
+        earlier, elsewhere, current = (tokens.generate_token('job') for _ in range(3))
+        self.storage.put(earlier, {'status': jobs.PENDING, 'created': 100.0, 'pid': os.getpid()})
+        self.storage.put(elsewhere, {'status': jobs.RUNNING, 'created': 100.0, 'pid': int(dead)})
+        self.storage.put(current, {'status': jobs.PENDING, 'created': 300.0, 'pid': os.getpid()})
+
+        self.assertEqual(jobs.status(self.storage, elsewhere)['status'], jobs.FAILED)
+        self.assertEqual(jobs.status(self.storage, earlier)['status'], jobs.PENDING)
+        self.assertEqual(jobs.fail_orphaned(self.storage, started=200.0), 1)
+        self.assertEqual(jobs.status(self.storage, earlier)['status'], jobs.FAILED)
+        self.assertEqual(jobs.status(self.storage, current)['status'], jobs.PENDING)
+
+
+if __name__ == '__main__':
+    unittest.main()
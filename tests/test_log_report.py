@@ -0,0 +1,90 @@
+"""
+Unit tests for log_report.py
+"""
+import io
+import shutil
+import tempfile
+import time
+import unittest
+import unittest.mock
+
+import tokens
+from log_report import analyze, main, normalize_endpoint, percentile, print_report, read_records
+from memory_storage import MemoryStorage
+
+BASE = 'https://tcsp.clubautomation.com'
+DAY = 24 * 60 * 60
+
+
+def _record(when, url, duration, status=200):
+    return {
+        'time': when,
+        'duration': duration,
+        'request': {'method': 'GET', 'url': url, 'headers': {}, 'body': 'None'},
+        'response': {'status': status, 'headers': {}, 'body': '<html>' * 100},
+    }
+
+
+class TestEndpoints(unittest.TestCase):
+
+    def test_normalize_endpoint(self):
+        """Test that URLs are grouped by endpoint, ids stripped"""
+        self.assertEqual(normalize_endpoint(f'{BASE}/calendar/fast-register-event'), 'fast-register-event')
+        self.assertEqual(normalize_endpoint(f'{BASE}/calendar/event-info?id=850377'), 'event-info')
+        self.assertEqual(normalize_endpoint(f'{BASE}/login/login'), 'login')
+        self.assertEqual(normalize_endpoint(f'{BASE}/member/cart'), 'cart')
+        self.assertEqual(normalize_endpoint(f'{BASE}/member/cart/step/1/cart_items/12,13/?ajax=1'), 'cart-checkout')
+        self.assertEqual(normalize_endpoint(f'{BASE}/'), 'home')
+        self.assertEqual(normalize_endpoint(None), 'home')
+
+    def test_percentile(self):
+        """Test nearest-rank percentiles"""
+        values = [float(v) for v in range(1, 101)]
+        self.assertEqual(percentile(values, 50), 50)
+        self.assertEqual(percentile(values, 99), 99)
+        self.assertEqual(percentile([3.0], 95), 3.0)
+        self.assertIsNone(percentile([], 50))
+
+
+class TestAnalyze(unittest.TestCase):
+
+    def setUp(self):
+        self.now = time.time()
+        self.storage = MemoryStorage()
+
+    def _log(self, when, url, duration, status=200):
+        self.storage.put(tokens.generate_token('http', timestamp=when), _record(when, url, duration, status))
+
+    def test_flags_regressions_against_previous_window(self):
+        """Test that a slower, failing endpoint is flagged and a steady one isn't"""
+        for i in range(20):
+            self._log(self.now - 10 * DAY + i * 60, f'{BASE}/calendar/event-info?id=1', 0.2)
+            self._log(self.now - 10 * DAY + i * 60, f'{BASE}/login/login', 0.5)
+            self._log(self.now - 2 * DAY + i * 60, f'{BASE}/calendar/event-info?id=1', 0.9, 500 if i < 4 else 200)
+            self._log(self.now - 2 * DAY + i * 60, f'{BASE}/login/login', 0.5)
+        # outside both windows, never counted
+        self._log(self.now - 30 * DAY, f'{BASE}/login/login', 99)
+
+        rows = read_records(self.storage.list('http'))
+        report = analyze(rows, self.now, 7 * DAY)
+        self.assertEqual(report['login']['regressions'], [])
+        self.assertEqual(report['login']['window']['requests'], 20)
+        self.assertEqual(report['login']['previous_window']['p99'], 0.5)
+
+        event_info = report['event-info']
+        self.assertEqual(len(event_info['regressions']), 2)
+        self.assertEqual(event_info['window']['error_rate'], 0.2)
+        self.assertEqual(event_info['window']['p50'], 0.9)
+        self.assertEqual(sum(b['requests'] for b in event_info['buckets'].values()), 20)
+
+        out = io.StringIO()
+        print_report(report, out)
+        self.assertIn('event-info  REGRESSED: p95 0.20s -> 0.90s; errors 0% -> 20%', out.getvalue())
+
+    def test_main_reads_log_dir(self):
+        """Test the CLI end to end, with nothing logged"""
+        log_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, log_dir)
+        with unittest.mock.patch('sys.stdout', new_callable=io.StringIO) as out:
+            main(['--log-dir', log_dir, '--json'])
+        self.assertEqual(out.getvalue().strip(), '{}')
@@ -0,0 +1,125 @@
+"""
+Unit tests for members.py and booking several members from one cron run
+"""
+import os
+import threading
+import time
+import unittest
+from datetime import datetime, timedelta
+from unittest.mock import patch
+
+import cronv2
+import tokens
+from bookings import booking_index, record_booking
+from members import DEFAULT, Member, add_member, load_members, remove_member
+from memory_storage import MemoryStorage
+
+
+class TestMembers(unittest.TestCase):
+
+    def setUp(self):
+        self.storage = MemoryStorage()
+
+    def test_default_member_keeps_the_original_types(self):
+        """Test that the default member's objects are plan, book and cal_event as before"""
+        self.assertEqual((DEFAULT.plan_type, DEFAULT.book_type, DEFAULT.cal_event_type),
+                         ('plan', 'book', 'cal_event'))
+        ana = Member('ana', 'Ana', 'ana@example.com')
+        self.assertEqual((ana.plan_type, ana.book_type, ana.cal_event_type),
+                         ('plan_ana', 'book_ana', 'cal_event_ana'))
+        self.assertEqual(ana.typed('sched'), 'sched')
+        self.assertEqual(tokens.parse(tokens.generate_token(ana.plan_type))['prefix'], 'plan_ana')
+
+    def test_slugs_are_alphanumeric(self):
+        """Test that slugs which would break token prefixes are rejected"""
+        with self.assertRaises(ValueError):
+            Member('ana-b', 'Ana')
+
+    def test_add_load_remove(self):
+        """Test that members round-trip through the members index, default first"""
+        add_member(self.storage, Member('bo', 'Bo', 'bo@example.com', password_env='BO_PASSWORD'))
+        add_member(self.storage, Member('ana', 'Ana', 'ana@example.com', password_env='ANA_PASSWORD'))
+        self.assertEqual([m.slug for m in load_members(self.storage)], ['', 'ana', 'bo'])
+
+        with patch.dict(os.environ, {'BO_PASSWORD': 'from-env'}):
+            bo = load_members(self.storage)[2]
+            self.assertEqual(bo.credentials(), ('bo@example.com', 'from-env'))
+        self.assertIsNone(DEFAULT.credentials())
+
+        self.assertTrue(remove_member(self.storage, 'bo'))
+        self.assertFalse(remove_member(self.storage, 'bo'))
+        self.assertEqual([m.slug for m in load_members(self.storage)], ['', 'ana'])
+
+    def test_passwords_come_from_the_environment(self):
+        """Test that a missing password variable is named, and stored passwords are ignored"""
+        with patch.dict(os.environ, clear=True):
+            with self.assertRaisesRegex(ValueError, 'ANA_PASSWORD'):
+                Member('ana', 'Ana', 'ana@example.com', password_env='ANA_PASSWORD').credentials()
+
+        self.storage.update_index('members', lambda index: {'bo': {'name': 'Bo', 'email': 'bo@example.com',
+                                                                   'password': 'plaintext'}})
+        bo = load_members(self.storage)[1]
+        self.assertNotIn('password', bo.to_dict())
+        with self.assertRaisesRegex(ValueError, 'password_env'):
+            bo.credentials()
+
+    def test_bookings_are_indexed_per_member(self):
+        """Test that one member's booking doesn't mark the class booked for another"""
+        ana = Member('ana', 'Ana', 'ana@example.com')
+        record_booking(self.storage, tokens.generate_token(ana.book_type), {'scheduled_id': '1400001'})
+        self.assertIn('1400001', booking_index(self.storage, ana.book_type))
+        self.assertEqual(booking_index(self.storage), {})
+
+
+class FakeClient(object):
+    adapters = []
+    threads = set()
+
+    def __init__(self, settings=None, member=DEFAULT, adapter=None, priority=None):
+        self.member = member
+        FakeClient.adapters.append(adapter)
+
+    def register_for_instance(self, clazz):
+        # long enough for the members' bookings to overlap
+        time.sleep(0.05)
+        FakeClient.threads.add(threading.current_thread().name)
+        return {'status': 1, 'message': f"Registered {self.member.slug}"}
+
+
+class TestBookingMembers(unittest.TestCase):
+
+    def setUp(self):
+        self.storage = MemoryStorage()
+        self.now = datetime.now()
+        for member in (Member('ana', 'Ana', 'ana@example.com'), Member('bo', 'Bo', 'bo@example.com')):
+            add_member(self.storage, member)
+        due_at = (self.now + timedelta(days=1)).timestamp()
+        later = (self.now + timedelta(days=5)).timestamp()
+        for plan_type, when in (('plan', later), ('plan_ana', due_at), ('plan_bo', due_at)):
+            self.storage.put(tokens.generate_token(plan_type), {
+                'LB01': {'slug': 'LB01', 'schedule_id': '1400001', 'event_id': '900001', 'timestamp': when},
+            })
+
+    def test_find_due_reads_each_members_plan(self):
+        """Test that only members with classes in the booking window are due"""
+        due = cronv2.find_due(self.storage, self.now)
+        self.assertEqual([d.member.slug for d in due], ['ana', 'bo'])
+
+    def test_book_members_concurrently_over_one_pool(self):
+        """Test that due members are booked in parallel, sharing an adapter, and their plans updated"""
+        FakeClient.adapters, FakeClient.threads = [], set()
+        with patch('client.Client', FakeClient), patch('cal.create_event_for_class') as create_event:
+            cronv2.book_members(self.storage, cronv2.find_due(self.storage, self.now))
+
+        self.assertEqual(len(FakeClient.threads), 2)
+        self.assertIs(FakeClient.adapters[0], FakeClient.adapters[1])
+        self.assertEqual(sorted(call.args[3].slug for call in create_event.call_args_list), ['ana', 'bo'])
+        for plan_type in ('plan_ana', 'plan_bo'):
+            _, plan = self.storage.latest(plan_type)
+            self.assertTrue(plan['LB01']['scheduled'])
+        _, plan = self.storage.latest('plan')
+        self.assertNotIn('scheduled', plan['LB01'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,129 @@
+"""
+Unit tests for memory_storage.py, run against the file store too so the two
+can't drift apart.
+"""
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from datetime import timedelta
+from unittest.mock import patch
+
+import tokens
+from memory_storage import MemoryStorage
+from storage import ABSENT, ConflictError, Storage, open_storage
+
+
+class StorageContract(object):
+    """Behaviour both backends share; subclasses provide self.storage."""
+
+    def _put(self, prefix, age, obj=None):
+        token = tokens.generate_token(prefix, timestamp=time.time() - age)
+        self.storage.put(token, obj if obj is not None else {'age': age})
+        return token
+
+    def test_roundtrip_normalizes_like_json(self):
+        """Test that stored objects come back as the codec would return them"""
+        token = self._put('plan', 0, {1: ('a', 'b')})
+        self.assertEqual(self.storage.get(token), {'1': ['a', 'b']})
+        self.assertEqual(self.storage.get(tokens.generate_token('plan')), None)
+        with self.assertRaises(ValueError):
+            self.storage.get('not a token')
+
+    def test_returned_objects_are_copies(self):
+        """Test that mutating a returned object doesn't change the store"""
+        token = self._put('plan', 0, {'LB01': {'slug': 'LB01'}})
+        self.storage.get(token)['LB01']['checked'] = True
+        self.assertEqual(self.storage.get(token), {'LB01': {'slug': 'LB01'}})
+
+    def test_head_latest_and_queries(self):
+        """Test that heads, latest() and queries follow token order"""
+        older = self._put('book', 300, {'scheduled_id': '1'})
+        newer = self._put('book', 100, {'scheduled_id': '1'})
+        self._put('book', 200, {'scheduled_id': '2'})
+        self._put('book_extra', 0)
+        self.assertEqual(self.storage.head('book'), newer)
+        self.assertEqual(self.storage.count('book'), 3)
+        self.assertEqual(self.storage.latest('book', {'scheduled_id': '1'})[0], newer)
+        since = time.time() - 250
+        self.assertEqual(sorted(t for t, _ in self.storage.list('book', {'$timestamp': {'$lt': since}})), [older])
+
+    def test_compare_and_swap(self):
+        """Test that stale puts conflict or merge"""
+        token = tokens.generate_token('plan')
+        version = self.storage.put(token, {'a': 1}, expected_version=ABSENT)
+        self.assertEqual(self.storage.get_versioned(token), ({'a': 1}, version))
+        self.storage.put(token, {'a': 2})
+        with self.assertRaises(ConflictError):
+            self.storage.put(token, {'a': 3}, expected_version=version)
+        self.storage.put(token, {'b': 3}, expected_version=version, merge=lambda ours, theirs: {**theirs, **ours})
+        self.assertEqual(self.storage.get(token), {'a': 2, 'b': 3})
+
+    def test_cleanup(self):
+        """Test that retention keeps the newest and reports what went"""
+        ids = [self._put('http', (10 - i) * 86400) for i in range(10)]
+        report = self.storage.cleanup('http', retention_window=timedelta(days=5, hours=12))
+        self.assertEqual(report.deleted, ids[:5])
+        self.assertEqual(self.storage.count('http'), 10)
+        report = self.storage.cleanup('http', retention_count=2, dry_run=False)
+        self.assertEqual(report.deleted, ids[:8])
+        self.assertGreater(report.bytes_reclaimed, 0)
+        self.assertEqual(self.storage.head('http'), ids[-1])
+        self.assertEqual(self.storage.count('http'), 2)
+
+    def test_indexes(self):
+        """Test that indexes are stored apart from objects"""
+        self.storage.put_index('book_by_schedule', {'count': 0, 'by_schedule': {}})
+        self.assertEqual(self.storage.get_index('book_by_schedule'), {'count': 0, 'by_schedule': {}})
+        self.assertEqual(self.storage.get_index('missing'), None)
+        self.assertEqual(self.storage.index_names(), ['book_by_schedule'])
+        self.assertEqual(self.storage.types(), [])
+
+
+class TestFileStorageContract(StorageContract, unittest.TestCase):
+
+    def setUp(self):
+        self.storage_directory = tempfile.mkdtemp()
+        self.storage = Storage(self.storage_directory)
+
+    def tearDown(self):
+        shutil.rmtree(self.storage_directory)
+
+
+class TestMemoryStorage(StorageContract, unittest.TestCase):
+
+    def setUp(self):
+        self.storage = MemoryStorage()
+
+    def test_snapshot_and_restore(self):
+        """Test that a snapshot opens as a file store and restores back"""
+        plan = self._put('plan', 0, {'LB01': {'slug': 'LB01'}})
+        books = [self._put('book', age) for age in (200, 100)]
+        self.storage.put_index('book_by_schedule', {'count': 2})
+
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.storage.snapshot(directory)
+        on_disk = Storage(directory)
+        self.assertEqual(on_disk.latest('plan'), (plan, {'LB01': {'slug': 'LB01'}}))
+        self.assertEqual(on_disk.head('book'), books[-1])
+        self.assertEqual(on_disk.get_index('book_by_schedule'), {'count': 2})
+
+        restored = MemoryStorage()
+        restored.put(tokens.generate_token('junk'), {})
+        restored.restore(directory)
+        self.assertEqual(restored.types(), ['book', 'plan'])
+        self.assertEqual(sorted(restored.list('book')), sorted(self.storage.list('book')))
+        self.assertEqual(restored.get_index('book_by_schedule'), {'count': 2})
+
+    def test_selected_by_config(self):
+        """Test that STORAGE_BACKEND=memory gives one shared in-memory store per directory"""
+        directory = os.path.join(tempfile.gettempdir(), 'never-created-by-memory-storage')
+        with patch.dict(os.environ, {'STORAGE_BACKEND': 'memory'}):
+            s = open_storage(directory)
+            self.assertIsInstance(s, MemoryStorage)
+            self.assertIs(open_storage(directory), s)
+        self.assertFalse(os.path.exists(directory))
+        with self.assertRaises(ValueError):
+            open_storage(directory, backend='sqlite')
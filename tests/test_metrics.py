@@ -0,0 +1,84 @@
+"""
+Unit tests for metrics.py and the booking instrumentation in cronv2.py
+"""
+import time
+import unittest
+from unittest.mock import MagicMock, patch
+
+import cronv2
+import metrics
+from memory_storage import MemoryStorage
+
+
+class TestMetrics(unittest.TestCase):
+
+    def setUp(self):
+        self.storage = MemoryStorage()
+        metrics.registry.drain()
+        self.addCleanup(metrics.registry.drain)
+
+    def test_flushes_accumulate_across_runs(self):
+        """Test that each run's metrics add to the persisted totals"""
+        for _ in range(2):
+            metrics.inc('booking_outcomes_total', outcome='booked')
+            metrics.observe('booking_phase_seconds', 0.3, phase='sign_in')
+            metrics.flush(self.storage)
+        totals = self.storage.get_index(metrics.INDEX_NAME)
+        self.assertEqual(totals['counters']['booking_outcomes_total'], {'outcome="booked"': 2})
+        hist = totals['histograms']['booking_phase_seconds']['phase="sign_in"']
+        self.assertEqual(hist['count'], 2)
+        self.assertAlmostEqual(hist['sum'], 0.6)
+        # cumulative buckets: nothing at or under 0.25, both at 0.5 and up
+        self.assertEqual(hist['buckets'][:4], [0, 0, 0, 2])
+
+    def test_span_times_failures_too(self):
+        """Test that a span records even when the phase raises"""
+        with self.assertRaises(RuntimeError):
+            with metrics.span('cart_checkout'):
+                raise RuntimeError()
+        self.assertIn('phase="cart_checkout"', metrics.registry.drain()['histograms']['booking_phase_seconds'])
+
+    def test_render_prometheus_text(self):
+        """Test the exposition format of counters and histograms"""
+        metrics.inc('booking_attempts_total', endpoint='fast_register')
+        metrics.observe('booking_window_delay_seconds', 42)
+        text = metrics.render(metrics.flush(self.storage), [('storage_cache_hits_total', 'Hits.', 3)])
+        self.assertIn('# TYPE booking_attempts_total counter\n', text)
+        self.assertIn('booking_attempts_total{endpoint="fast_register"} 1\n', text)
+        self.assertIn('booking_window_delay_seconds_bucket{le="30"} 0\n', text)
+        self.assertIn('booking_window_delay_seconds_bucket{le="60"} 1\n', text)
+        self.assertIn('booking_window_delay_seconds_bucket{le="+Inf"} 1\n', text)
+        self.assertIn('booking_window_delay_seconds_sum 42\n', text)
+        self.assertIn('storage_cache_hits_total 3\n', text)
+
+
+class TestBookingInstrumentation(unittest.TestCase):
+
+    def setUp(self):
+        self.storage = MemoryStorage()
+        metrics.registry.drain()
+        self.addCleanup(metrics.registry.drain)
+        self.clazz = {'slug': 'LB01', 'timestamp': time.time() + 2 * 86400 - 90}
+
+    def _book(self, result):
+        client = MagicMock()
+        client.register_for_instance.return_value = result
+        with patch('cal.create_event_for_class'), patch.object(cronv2, 'send_failure_email'):
+            cronv2.book_class(self.storage, client, self.clazz)
+        return metrics.registry.drain()
+
+    def test_booked(self):
+        """Test that a booking counts its outcome, phases and window delay"""
+        delta = self._book({'status': 1, 'message': 'ok'})
+        self.assertEqual(delta['counters']['booking_outcomes_total'], {'outcome="booked"': 1})
+        self.assertEqual(set(delta['histograms']['booking_phase_seconds']),
+                         {'phase="register"', 'phase="calendar_write"'})
+        delay = delta['histograms']['booking_window_delay_seconds']['']
+        self.assertAlmostEqual(delay['sum'], 90, delta=5)
+
+    def test_gave_up(self):
+        """Test that a booking the club refuses counts as failed"""
+        delta = self._book({'status': -1, 'message': 'the maximum number of registrations'})
+        self.assertEqual(delta['counters']['booking_outcomes_total'], {'outcome="failed"': 1})
+        self.assertTrue(self.clazz['failed'])
+        self.assertEqual(self.clazz['failure'], 'full')
@@ -0,0 +1,96 @@
+"""
+Unit tests for profiling.py
+"""
+import os
+import pstats
+import shutil
+import tempfile
+import unittest
+from types import SimpleNamespace
+
+import bottle
+
+import profiling
+import web  # registers the routes
+from memory_storage import MemoryStorage
+
+
+@profiling.timed()
+def fetch():
+    return sum(range(1000))
+
+
+class TestProfiling(unittest.TestCase):
+
+    def setUp(self):
+        self.storage = MemoryStorage()
+        self.addCleanup(profiling.set_mode, None)
+
+    def _run(self):
+        with profiling.profiled('planner', self.storage):
+            with profiling.span('build'):
+                fetch()
+                fetch()
+            fetch()
+
+    def test_off_by_default(self):
+        """Test that nothing is recorded without PROFILE"""
+        self._run()
+        self.assertEqual(self.storage.count('prof'), 0)
+
+    def test_spans(self):
+        """Test that span mode stores nested phase timings"""
+        profiling.set_mode('spans')
+        self._run()
+        (_, profile), = self.storage.list('prof')
+        self.assertEqual(profile['mode'], 'spans')
+        self.assertEqual(sorted({sp['path'] for sp in profile['spans']}),
+                         ['planner', 'planner;build', 'planner;build;fetch', 'planner;fetch'])
+        self.assertNotIn('pstats', profile)
+        folded = profiling.folded(profile)
+        self.assertEqual([line.split()[0] for line in folded.splitlines()],
+                         ['planner', 'planner;build', 'planner;build;fetch', 'planner;fetch'])
+
+    def test_nested_runs_are_spans(self):
+        """Test that a profiled run inside another becomes a span of it"""
+        profiling.set_mode('spans')
+        with profiling.profiled('cron', self.storage):
+            with profiling.profiled('planner', self.storage):
+                pass
+        (_, profile), = self.storage.list('prof')
+        self.assertEqual([sp['path'] for sp in profile['spans']], ['cron;planner', 'cron'])
+
+    def test_cprofile_exports_pstats(self):
+        """Test that a cProfile run exports a file pstats can read"""
+        profiling.set_mode('cprofile')
+        self._run()
+        (_, profile), = self.storage.list('prof')
+        self.assertTrue(any('fetch' in f['function'] for f in profile['top']))
+
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'planner.pstats')
+        profiling.export(profile, path)
+        stats = pstats.Stats(path)
+        self.assertTrue(any(func == 'fetch' for _, _, func in stats.stats))
+
+    def test_plugin(self):
+        """Test that the bottle plugin only wraps handlers when profiling is on"""
+        def handler():
+            return 'ok'
+        route = SimpleNamespace(method='GET', rule='/schedule')
+        plugin = profiling.ProfilingPlugin(lambda: self.storage)
+        self.assertIs(plugin.apply(handler, route), handler)
+
+        profiling.set_mode('cprofile')
+        self.assertEqual(plugin.apply(handler, route)(), 'ok')
+        (_, profile), = self.storage.list('prof')
+        self.assertEqual(profile['name'], 'GET /schedule')
+        # requests are timed, never run under cProfile
+        self.assertEqual(profile['mode'], 'spans')
+        self.assertNotIn('pstats', profile)
+
+    def test_streaming_and_polling_routes_are_skipped(self):
+        """Test that /events and /jobs polls don't store profiles"""
+        skipped = {r.rule for r in bottle.default_app().routes if 'profiling' in r.skiplist}
+        self.assertTrue({'/events', '/jobs/<job_id>'} <= skipped)
@@ -0,0 +1,93 @@
+"""
+Unit tests for query.py
+"""
+import shutil
+import tempfile
+import time
+import unittest
+from unittest.mock import patch
+
+import tokens
+from query import Query, matches_query
+from storage import Storage
+
+BOOKING = {
+    'status': 1,
+    'scheduled_id': '1400001',
+    'response': {'status': 200, 'headers': {'Content-Type': 'text/html'}},
+    'duration': 2.5,
+}
+
+
+class TestQuery(unittest.TestCase):
+
+    def test_equality_and_nested_queries(self):
+        """Test that plain equality and nested dicts behave as before"""
+        self.assertTrue(matches_query(BOOKING, {'scheduled_id': '1400001'}))
+        self.assertFalse(matches_query(BOOKING, {'scheduled_id': '1400002'}))
+        self.assertTrue(matches_query(BOOKING, {'response': {'status': 200}}))
+        self.assertFalse(matches_query(BOOKING, {'status': {'code': 1}}))
+        self.assertTrue(matches_query(BOOKING, {'missing': None}))
+
+    def test_dotted_paths(self):
+        """Test that dotted paths reach into nested objects"""
+        self.assertTrue(matches_query(BOOKING, {'response.headers.Content-Type': 'text/html'}))
+        self.assertFalse(matches_query(BOOKING, {'response.status.code': 200}))
+
+    def test_operators(self):
+        """Test $in, the comparisons and $exists"""
+        self.assertTrue(matches_query(BOOKING, {'status': {'$in': [1, 2]}}))
+        self.assertFalse(matches_query(BOOKING, {'status': {'$in': [2, 3]}}))
+        self.assertTrue(matches_query(BOOKING, {'duration': {'$gt': 2, '$lte': 2.5}}))
+        self.assertFalse(matches_query(BOOKING, {'duration': {'$lt': 2}}))
+        self.assertFalse(matches_query(BOOKING, {'scheduled_id': {'$gt': 5}}))
+        self.assertFalse(matches_query(BOOKING, {'missing': {'$gte': 0}}))
+        self.assertTrue(matches_query(BOOKING, {'response.status': {'$exists': True}}))
+        self.assertTrue(matches_query(BOOKING, {'failed': {'$exists': False}}))
+        with self.assertRaises(ValueError):
+            Query({'status': {'$regex': '1'}})
+
+    def test_token_timestamp(self):
+        """Test that $timestamp conditions are checked on the token alone"""
+        q = Query({'$timestamp': {'$gte': 1000, '$lt': 2000}})
+        self.assertEqual((q.since, q.until), (1000, 2000))
+        self.assertTrue(q.matches_token(tokens.generate_token('book', timestamp=1500)))
+        self.assertFalse(q.matches_token(tokens.generate_token('book', timestamp=2000)))
+        self.assertTrue(q.matches({}))
+
+
+class TestStorageQueries(unittest.TestCase):
+
+    def setUp(self):
+        self.storage_directory = tempfile.mkdtemp()
+        self.storage = Storage(self.storage_directory)
+        now = time.time()
+        # one booking a week for a year, oldest first
+        self.tokens = []
+        for week in range(52, 0, -1):
+            token = tokens.generate_token('book', timestamp=now - week * 7 * 86400)
+            self.storage.put(token, {'week': week, 'scheduled_id': str(week % 4)})
+            self.tokens.append(token)
+        self.now = now
+
+    def tearDown(self):
+        shutil.rmtree(self.storage_directory)
+
+    def test_timestamp_filters_prune_files(self):
+        """Test that files outside a $timestamp range are never opened"""
+        since = self.now - 4 * 7 * 86400 - 60
+        with patch.object(self.storage, 'get', wraps=self.storage.get) as get:
+            found = sorted(self.storage.list('book', {'$timestamp': {'$gt': since}}))
+            self.assertEqual(get.call_count, 4)
+        self.assertEqual([t for t, _ in found], self.tokens[-4:])
+
+    def test_combined_filters(self):
+        """Test that token and content conditions combine"""
+        since = self.now - 20 * 7 * 86400 - 60
+        token, booking = self.storage.latest('book', {
+            '$timestamp': {'$gte': since},
+            'scheduled_id': {'$in': ['2']},
+            'week': {'$gt': 5},
+        })
+        self.assertEqual(booking['week'], 6)
+        self.assertEqual(token, self.tokens[-6])
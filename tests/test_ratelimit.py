@@ -0,0 +1,138 @@
+"""
+Unit tests for ratelimit.py and its use by client.make_session
+"""
+import os
+import shutil
+import tempfile
+import unittest
+from unittest.mock import patch
+
+import requests
+
+import client
+import metrics
+import ratelimit
+from memory_storage import MemoryStorage
+from ratelimit import BACKGROUND, BOOKING, RateLimiter, priority_for
+
+BASE = 'https://tcsp.clubautomation.com'
+
+
+class Clock(object):
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class TestRateLimiter(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+        self.path = os.path.join(self.dir, '.ratelimit')
+        self.clock = Clock()
+        metrics.registry.drain()
+        self.addCleanup(metrics.registry.drain)
+
+    def _limiter(self, rate=1.0, burst=4):
+        # a limiter per "process", sharing only the file
+        return RateLimiter(self.path, rate=rate, burst=burst, clock=self.clock, sleep=self.clock.sleep)
+
+    def test_burst_then_rate(self):
+        """Test that a burst goes straight out, then requests are spaced at the rate"""
+        limiter = self._limiter()
+        self.assertEqual([limiter.acquire(BOOKING) for _ in range(4)], [0, 0, 0, 0])
+        self.assertAlmostEqual(limiter.acquire(BOOKING), 1.0)
+        self.assertAlmostEqual(limiter.acquire(BOOKING), 1.0)
+
+    def test_state_is_shared(self):
+        """Test that limiters over the same file draw from one bucket"""
+        first, second = self._limiter(), self._limiter()
+        for _ in range(2):
+            first.acquire(BOOKING)
+            second.acquire(BOOKING)
+        self.assertAlmostEqual(second.acquire(BOOKING), 1.0)
+
+    def test_background_leaves_a_reserve_for_booking(self):
+        """Test that background requests stop at the reserve that booking can still use"""
+        limiter = self._limiter()
+        self.assertEqual([limiter.acquire(BACKGROUND) for _ in range(2)], [0, 0])
+        self.assertEqual([limiter.acquire(BOOKING) for _ in range(2)], [0, 0])
+        self.assertAlmostEqual(limiter.acquire(BACKGROUND), 3.0)
+
+    def test_queued_booking_holds_off_background(self):
+        """Test that background waits while a booking request is queued"""
+        limiter = self._limiter()
+        for _ in range(4):
+            limiter.acquire(BOOKING)
+        self.assertGreater(limiter._try(BOOKING), 0)
+        self.assertEqual(limiter._try(BACKGROUND), ratelimit.MAX_SLEEP)
+        self.clock.now += 1
+        self.assertEqual(limiter._try(BOOKING), 0)
+        self.clock.now += 10
+        self.assertEqual(limiter._try(BACKGROUND), 0)
+
+    def test_booking_elsewhere_keeps_background_held(self):
+        """Test that one process getting a booking token doesn't release another's hold on background"""
+        first, second = self._limiter(), self._limiter()
+        for _ in range(4):
+            first.acquire(BOOKING)
+        self.assertGreater(first._try(BOOKING), 0)
+        self.clock.now += 1
+        self.assertEqual(second._try(BOOKING), 0)
+        self.assertEqual(second._try(BACKGROUND), ratelimit.MAX_SLEEP)
+
+    def test_queue_delay_metric(self):
+        """Test that waiting is observed per priority"""
+        limiter = self._limiter(burst=1)
+        limiter.acquire(BOOKING)
+        limiter.acquire(BOOKING)
+        hist = metrics.registry.drain()['histograms']['club_request_queue_seconds']['priority="booking"']
+        self.assertEqual(hist['count'], 2)
+        self.assertAlmostEqual(hist['sum'], 1.0)
+
+    def test_disabled_and_unknown_priority(self):
+        """Test that a zero rate never waits, and priorities are checked"""
+        limiter = self._limiter(rate=0)
+        self.assertEqual([limiter.acquire(BACKGROUND) for _ in range(20)], [0.0] * 20)
+        with self.assertRaises(ValueError):
+            limiter.acquire('urgent')
+
+
+class StubAdapter(requests.adapters.BaseAdapter):
+    def send(self, request, **kwargs):
+        response = requests.Response()
+        response.status_code, response._content, response.request, response.url = 200, b'{}', request, request.url
+        return response
+
+    def close(self):
+        pass
+
+
+class TestSessions(unittest.TestCase):
+
+    def test_priority_for(self):
+        """Test that registration and cart requests are always booking priority"""
+        self.assertEqual(priority_for(f'{BASE}/calendar/fast-register-event'), BOOKING)
+        self.assertEqual(priority_for(f'{BASE}/member/cart/step/1/cart_items/12/?ajax=1'), BOOKING)
+        self.assertEqual(priority_for(f'{BASE}/calendar/event-info?id=1'), BACKGROUND)
+        self.assertEqual(priority_for(f'{BASE}/calendar/event-info?id=1', BOOKING), BOOKING)
+
+    def test_make_session_waits_its_turn(self):
+        """Test that every request from a client session goes through the limiter"""
+        priorities = []
+        with patch.object(ratelimit, 'limiter') as limiter, patch.object(client, 'log_storage', MemoryStorage()):
+            limiter.return_value.acquire.side_effect = priorities.append
+            session = client.make_session(StubAdapter())
+            session.get(f'{BASE}/calendar/event-info?id=1')
+            session.post(f'{BASE}/calendar/fast-register-event', data={})
+        self.assertEqual(priorities, [BACKGROUND, BOOKING])
+
+
+if __name__ == '__main__':
+    unittest.main()
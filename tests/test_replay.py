@@ -0,0 +1,137 @@
+"""
+Unit tests for replay.py
+"""
+import time
+import unittest
+
+import client
+import tokens
+from memory_storage import MemoryStorage
+from replay import (FullAfter, NeedsCart, OpensAt, Recording, ReplayAdapter, ReplayMiss, replay_session,
+                    replaying)
+
+BASE = 'https://tcsp.clubautomation.com'
+WEEK = 7 * 24 * 60 * 60
+
+
+def _record(when, method, url, body, status=200, duration=0.5):
+    return {
+        'time': when,
+        'duration': duration,
+        'request': {'method': method, 'url': url, 'headers': {}, 'body': 'None'},
+        'response': {'status': status, 'headers': {'Content-Type': 'text/html', 'Content-Encoding': 'gzip'},
+                     'body': body},
+    }
+
+
+def _recording(*records) -> Recording:
+    s = MemoryStorage()
+    for record in records:
+        s.put(tokens.generate_token('http', timestamp=record['time']), record)
+    return Recording.from_storage(s)
+
+
+class TestReplay(unittest.TestCase):
+
+    def setUp(self):
+        self.now = time.time()
+        self.recording = _recording(
+            _record(self.now, 'GET', f'{BASE}/calendar/event-info?id=1', 'first'),
+            _record(self.now + 1, 'GET', f'{BASE}/calendar/event-info?id=1', 'second'),
+            _record(self.now, 'GET', f'{BASE}/calendar/event-info?id=2', 'other', status=500),
+        )
+
+    def test_replays_recorded_responses_in_order(self):
+        """Test that repeated requests cycle through what was recorded for them"""
+        session = replay_session(ReplayAdapter(self.recording, latency_scale=0))
+        bodies = [session.get(f'{BASE}/calendar/event-info?id=1').text for _ in range(3)]
+        self.assertEqual(bodies, ['first', 'second', 'first'])
+        response = session.get(f'{BASE}/calendar/event-info?id=2')
+        self.assertEqual(response.status_code, 500)
+        self.assertNotIn('Content-Encoding', response.headers)
+
+    def test_bodies_are_read_on_demand(self):
+        """Test that a recording from storage holds no bodies until they're replayed"""
+        s = MemoryStorage()
+        token = tokens.generate_token('http', timestamp=self.now)
+        s.put(token, _record(self.now, 'GET', f'{BASE}/calendar/event-info?id=1', 'first'))
+        recording = Recording.from_storage(s)
+        exchange, = recording.lookup(('GET', '/calendar/event-info', 'id=1'))
+        self.assertIsNone(exchange._body)
+        self.assertEqual(exchange.body, 'first')
+
+    def test_falls_back_to_path_then_misses(self):
+        """Test that unrecorded query strings get the path's responses, unknown paths raise"""
+        session = replay_session(ReplayAdapter(self.recording, latency_scale=0))
+        self.assertEqual(session.get(f'{BASE}/calendar/event-info?id=3').text, 'first')
+        with self.assertRaises(ReplayMiss):
+            session.get(f'{BASE}/user/get-member-info')
+
+    def test_injects_recorded_latency(self):
+        """Test that responses take their recorded duration times latency_scale"""
+        slept = []
+        session = replay_session(ReplayAdapter(self.recording, latency_scale=2, sleep=slept.append))
+        session.get(f'{BASE}/calendar/event-info?id=1')
+        self.assertEqual(slept, [1.0])
+
+    def test_shifts_dates_by_whole_weeks(self):
+        """Test that dates in replayed pages move forward to the week being replayed"""
+        recorded = self.now - 3 * WEEK
+        recording = _recording(_record(recorded, 'GET', f'{BASE}/calendar/event-info?id=1',
+                                       'LB01 | Live Ball | Monday 7:30pm-8:45pm on 04/22/2024'))
+        session = replay_session(ReplayAdapter(recording, latency_scale=0, clock=lambda: self.now))
+        self.assertEqual(session.get(f'{BASE}/calendar/event-info?id=1').text,
+                         'LB01 | Live Ball | Monday 7:30pm-8:45pm on 05/13/2024')
+
+
+class TestScenarios(unittest.TestCase):
+
+    def _register(self, adapter, schedule_id='1400001'):
+        return client.register_for_instance(replay_session(adapter), '900001', schedule_id, '42')
+
+    def test_registration_succeeds_by_default(self):
+        """Test that registration without scenarios succeeds and is counted"""
+        adapter = ReplayAdapter(Recording([]), latency_scale=0)
+        self.assertEqual(self._register(adapter)['status'], 1)
+        self.assertEqual(adapter.registered('1400001'), 1)
+
+    def test_opens_at(self):
+        """Test that registration is closed until the scripted time"""
+        now = [1000.0]
+        adapter = ReplayAdapter(Recording([]), [OpensAt(2000.0)], latency_scale=0, clock=lambda: now[0])
+        self.assertEqual(self._register(adapter)['status'], -1)
+        now[0] = 2000.0
+        self.assertEqual(self._register(adapter)['status'], 1)
+
+    def test_full_after(self):
+        """Test that a class fills up after N registrations, with the message the client stops on"""
+        adapter = ReplayAdapter(Recording([]), [FullAfter(2, schedule_ids=['1400001'])], latency_scale=0)
+        self.assertEqual(self._register(adapter)['status'], 1)
+        self.assertEqual(self._register(adapter)['status'], 1)
+        full = self._register(adapter)
+        self.assertEqual(full['status'], -1)
+        self.assertIn('maximum number', full['message'])
+        self.assertEqual(self._register(adapter, schedule_id='1400002')['status'], 1)
+
+    def test_needs_cart(self):
+        """Test that the client falls back to cart checkout and the checkout registers"""
+        adapter = ReplayAdapter(Recording([]), [FullAfter(1), NeedsCart()], latency_scale=0)
+        result = self._register(adapter)
+        self.assertEqual(result['status'], 1)
+        self.assertIn('cart checkout', result['message'])
+        self.assertEqual(adapter.registered('1400001'), 1)
+        self.assertIn('maximum number', self._register(adapter)['message'])
+
+    def test_replaying_patches_make_session(self):
+        """Test that client.make_session returns replay sessions only inside replaying()"""
+        original = client.make_session
+        adapter = ReplayAdapter(Recording([]), latency_scale=0)
+        with replaying(adapter):
+            session = client.make_session()
+            self.assertIs(session.get_adapter(f'{BASE}/'), adapter)
+            self.assertEqual(session.hooks['response'], [])
+        self.assertIs(client.make_session, original)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,418 @@
+"""
+Unit tests for storage.py
+"""
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from datetime import datetime, timedelta
+from unittest.mock import patch
+
+import serializers
+import tokens
+from storage import ABSENT, ConflictError, Storage
+
+
+class TestHeadRefs(unittest.TestCase):
+
+    def setUp(self):
+        self.storage_directory = tempfile.mkdtemp()
+        self.storage = Storage(self.storage_directory)
+        self.now = time.time()
+
+    def tearDown(self):
+        shutil.rmtree(self.storage_directory)
+
+    def _put(self, prefix, age, obj=None):
+        token = tokens.generate_token(prefix, timestamp=self.now - age)
+        self.storage.put(token, obj or {'age': age})
+        return token
+
+    def test_latest_without_query_reads_one_object(self):
+        """Test that latest() resolves the head without decoding the whole type"""
+        for age in (300, 200, 100):
+            newest = self._put('plan', age)
+        self.assertEqual(self.storage.latest('plan')[0], newest)
+        with patch.object(self.storage, 'get', wraps=self.storage.get) as get:
+            token, plan = self.storage.latest('plan')
+            self.assertEqual(token, newest)
+            self.assertEqual(plan, {'age': 100})
+            self.assertEqual(get.call_count, 1)
+
+    def test_put_advances_head_only_for_newer_tokens(self):
+        """Test that the head follows newer puts and ignores older ones"""
+        self._put('plan', 100)
+        self.storage.latest('plan')
+        newer = self._put('plan', 10)
+        self.assertEqual(self.storage.head('plan'), newer)
+        self._put('plan', 500)
+        self.assertEqual(self.storage.head('plan'), newer)
+
+    def test_head_rebuilt_when_missing_or_dangling(self):
+        """Test that a lost ref or a deleted head object is recovered from disk"""
+        older = self._put('sched', 100)
+        newer = self._put('sched', 10)
+        self.assertEqual(self.storage.head('sched'), newer)
+
+        os.unlink(os.path.join(self.storage_directory, '.refs', 'sched'))
+        self.assertEqual(self.storage.head('sched'), newer)
+
+        os.unlink(self.storage._filename_for_id(newer))
+        self.assertEqual(self.storage.head('sched'), older)
+        self.assertEqual(self.storage.latest('sched'), (older, {'age': 100}))
+
+    def test_stale_ref_is_caught_up(self):
+        """Test that a valid ref behind the newest object on disk is caught up by repair_refs() or a put"""
+        older = self._put('plan', 300)
+        self.assertEqual(self.storage.head('plan'), older)
+        newer = tokens.generate_token('plan', timestamp=self.now - 200)
+        # written without advancing the ref, as by older code
+        with patch.object(self.storage, '_advance_ref'):
+            self.storage.put(newer, {})
+        # head() itself only reads the ref
+        with patch.object(self.storage, '_buckets') as buckets:
+            self.assertEqual(self.storage.head('plan'), older)
+            buckets.assert_not_called()
+        self.assertEqual(self.storage.repair_refs(), ['plan'])
+        self.assertEqual(self.storage.head('plan'), newer)
+        self.assertEqual(self.storage.repair_refs(), [])
+
+        with patch.object(self.storage, '_advance_ref'):
+            self.storage.put(tokens.generate_token('plan', timestamp=self.now - 150), {})
+        newest = self._put('plan', 100)
+        self.assertEqual(self.storage.head('plan'), newest)
+
+    def test_put_during_first_head_is_not_missed(self):
+        """Test that a put racing the first head() rebuild still ends up as the head"""
+        self._put('plan', 200)
+        other = Storage(self.storage_directory)
+        newer = tokens.generate_token('plan', timestamp=self.now - 100)
+        scan = self.storage._tokens
+        writer = []
+
+        def racing_scan(obj_type, buckets=None):
+            found = list(scan(obj_type, buckets))
+            # another process puts right after the scan, before the ref is written
+            writer.append(threading.Thread(target=other.put, args=(newer, {})))
+            writer[0].start()
+            writer[0].join(0.2)
+            return found
+
+        with patch.object(self.storage, '_tokens', side_effect=racing_scan):
+            self.storage.head('plan')
+        writer[0].join(5)
+        self.assertEqual(self.storage.head('plan'), newer)
+        self.assertEqual(open(os.path.join(self.storage_directory, '.refs', 'plan')).read(), newer)
+
+    def test_head_ignores_longer_prefixes(self):
+        """Test that cal_event objects aren't mistaken for cal objects"""
+        self._put('cal_event', 10)
+        self.assertEqual(self.storage.latest('cal'), (None, None))
+
+    def test_latest_with_query_still_filters(self):
+        """Test that queries skip the head and match on content"""
+        wanted = self._put('book', 100, {'scheduled_id': '1'})
+        self._put('book', 10, {'scheduled_id': '2'})
+        self.assertEqual(self.storage.latest('book', {'scheduled_id': '1'})[0], wanted)
+
+
+class TestCompareAndSwap(unittest.TestCase):
+
+    def setUp(self):
+        self.storage_directory = tempfile.mkdtemp()
+        self.storage = Storage(self.storage_directory)
+        self.token = tokens.generate_token('plan')
+
+    def tearDown(self):
+        shutil.rmtree(self.storage_directory)
+
+    def test_put_leaves_no_temp_files(self):
+        """Test that atomic writes clean up after themselves"""
+        self.storage.put(self.token, {'a': 1})
+        self.storage.put(self.token, {'a': 2})
+        leftovers = [f for _, _, files in os.walk(self.storage_directory) for f in files if f.endswith('.tmp')]
+        self.assertEqual(leftovers, [])
+        self.assertEqual(self.storage.get(self.token), {'a': 2})
+
+    def test_put_with_matching_version(self):
+        """Test that a put based on the current version succeeds"""
+        version = self.storage.put(self.token, {'a': 1}, expected_version=ABSENT)
+        obj, read_version = self.storage.get_versioned(self.token)
+        self.assertEqual(read_version, version)
+        new_version = self.storage.put(self.token, {'a': 2}, expected_version=version)
+        self.assertNotEqual(new_version, version)
+        self.assertEqual(self.storage.version(self.token), new_version)
+
+    def test_stale_put_conflicts(self):
+        """Test that a put based on an old version is refused without a merge hook"""
+        version = self.storage.put(self.token, {'a': 1})
+        self.storage.put(self.token, {'a': 2})
+        with self.assertRaises(ConflictError):
+            self.storage.put(self.token, {'a': 3}, expected_version=version)
+        with self.assertRaises(ConflictError):
+            self.storage.put(self.token, {'a': 3}, expected_version=ABSENT)
+        self.assertEqual(self.storage.get(self.token), {'a': 2})
+
+    def test_stale_put_merges(self):
+        """Test that a merge hook reconciles a lost race instead of overwriting"""
+        version = self.storage.put(self.token, {'a': 1})
+        self.storage.put(self.token, {'a': 1, 'b': 2})
+        self.storage.put(self.token, {'a': 1, 'c': 3}, expected_version=version,
+                         merge=lambda ours, theirs: {**theirs, **ours})
+        self.assertEqual(self.storage.get(self.token), {'a': 1, 'b': 2, 'c': 3})
+
+
+if __name__ == '__main__':
+    unittest.main()
+
+
+class TestShardedLayout(unittest.TestCase):
+
+    def setUp(self):
+        self.storage_directory = tempfile.mkdtemp()
+        self.storage = Storage(self.storage_directory)
+
+    def tearDown(self):
+        shutil.rmtree(self.storage_directory)
+
+    def _token(self, prefix, when):
+        return tokens.generate_token(prefix, timestamp=when.timestamp())
+
+    def test_objects_are_sharded_by_type_and_month(self):
+        """Test that objects land in <type>/<yyyy-mm>/ directories"""
+        token = self._token('plan', datetime(2024, 3, 15))
+        self.storage.put(token, {'a': 1})
+        self.assertTrue(os.path.isfile(os.path.join(self.storage_directory, 'plan', '2024-03', f'{token}.json')))
+        self.assertEqual(self.storage.get(token), {'a': 1})
+        self.assertEqual(self.storage.count('plan'), 1)
+        self.assertEqual(self.storage.count('cal'), 0)
+
+    def test_flat_layout_is_migrated(self):
+        """Test that objects from the old flat layout are moved into their shards"""
+        flat = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, flat)
+        token = self._token('sched', datetime(2024, 1, 10))
+        with open(os.path.join(flat, f'{token}.json'), 'w') as f:
+            json.dump({'b': 2}, f)
+        with open(os.path.join(flat, 'notes.json'), 'w') as f:
+            f.write('not an object')
+
+        storage = Storage(flat)
+        self.assertEqual(storage.get(token), {'b': 2})
+        self.assertEqual(storage.head('sched'), token)
+        self.assertFalse(os.path.exists(os.path.join(flat, f'{token}.json')))
+        self.assertTrue(os.path.exists(os.path.join(flat, 'notes.json')))
+
+    def test_cleanup_removes_expired_months(self):
+        """Test that months emptied by cleanup are removed too"""
+        now = datetime.now()
+        old = [self._token('log', now - timedelta(days=120 + i)) for i in range(3)]
+        recent = self._token('log', now - timedelta(hours=1))
+        for token in old + [recent]:
+            self.storage.put(token, {})
+
+        report = self.storage.cleanup('log', retention_window=timedelta(days=60), dry_run=False)
+        self.assertEqual(sorted(report.deleted), sorted(old))
+        self.assertEqual([t for t, _ in self.storage.list('log')], [recent])
+        self.assertEqual(os.listdir(os.path.join(self.storage_directory, 'log')),
+                         [datetime.utcfromtimestamp(tokens.parse(recent)['timestamp']).strftime('%Y-%m')])
+
+    def test_cleanup_drops_expired_months_whole(self):
+        """Test that a month past the retention window goes in one piece, strays and all"""
+        old = self._token('log', datetime.now() - timedelta(days=120))
+        self.storage.put(old, {})
+        bucket = os.path.dirname(self.storage._filename_for_id(old))
+        with open(os.path.join(bucket, '.tmp-left-behind'), 'w') as f:
+            f.write('partial write')
+
+        report = self.storage.cleanup('log', retention_window=timedelta(days=60), dry_run=False)
+        self.assertEqual(report.deleted, [old])
+        self.assertFalse(os.path.exists(bucket))
+
+    def test_cleanup_by_count_unlinks(self):
+        """Test that objects expired by count alone are deleted from disk"""
+        now = datetime.now()
+        old = [self._token('log', now - timedelta(days=120 + i)) for i in range(3)]
+        for token in old:
+            self.storage.put(token, {})
+
+        report = self.storage.cleanup('log', retention_count=1, dry_run=False)
+        self.assertEqual(sorted(report.deleted), sorted(old[1:]))
+        for token in old[1:]:
+            self.assertFalse(os.path.exists(self.storage._filename_for_id(token)))
+        self.assertTrue(os.path.exists(self.storage._filename_for_id(old[0])))
+
+    def test_unparseable_ids_are_missing(self):
+        """Test that ids put() couldn't have written read as missing"""
+        for _id in ('foo', 'job_'):
+            self.assertIsNone(self.storage.get(_id))
+            self.assertEqual(self.storage.get_versioned(_id), (None, None))
+
+
+class TestCleanup(unittest.TestCase):
+
+    def setUp(self):
+        self.storage_directory = tempfile.mkdtemp()
+        self.storage = Storage(self.storage_directory)
+        now = time.time()
+        # oldest first, a day apart
+        self.tokens = [tokens.generate_token('http', timestamp=now - (10 - i) * 86400) for i in range(10)]
+        for token in self.tokens:
+            self.storage.put(token, {'body': 'x' * 100})
+
+    def tearDown(self):
+        shutil.rmtree(self.storage_directory)
+
+    def test_cleanup_never_reads_objects(self):
+        """Test that retention is decided from token metadata alone"""
+        with patch('serializers.decode') as load:
+            report = self.storage.cleanup('http', retention_window=timedelta(days=5, hours=12), dry_run=False)
+            load.assert_not_called()
+        self.assertEqual(report.deleted, self.tokens[:5])
+        self.assertEqual(report.bytes_reclaimed, 5 * len('{"body": "' + 'x' * 100 + '"}'))
+        self.assertEqual(self.storage.count('http'), 5)
+
+    def test_dry_run_deletes_nothing(self):
+        """Test that a dry run reports without deleting"""
+        report = self.storage.cleanup('http', retention_window=timedelta(days=5, hours=12))
+        self.assertEqual(len(report), 5)
+        self.assertEqual(self.storage.count('http'), 10)
+
+    def test_retention_count_keeps_newest(self):
+        """Test that retention_count keeps the newest objects"""
+        report = self.storage.cleanup('http', retention_count=3, dry_run=False)
+        self.assertEqual(report.deleted, self.tokens[:7])
+        self.assertEqual(sorted(t for t, _ in self.storage.list('http')), sorted(self.tokens[7:]))
+
+    def test_deadline_stops_between_batches_and_resumes(self):
+        """Test that a time-bounded run stops early and a later run finishes"""
+        with patch('storage.time.time', side_effect=[0, 10]):
+            report = self.storage.cleanup('http', retention_count=2, dry_run=False,
+                                          deadline=5, batch_size=3)
+        self.assertFalse(report.complete)
+        self.assertEqual(report.deleted, self.tokens[:3])
+
+        report = self.storage.cleanup('http', retention_count=2, dry_run=False, batch_size=3)
+        self.assertTrue(report.complete)
+        self.assertEqual(report.deleted, self.tokens[3:8])
+
+
+class TestCodecs(unittest.TestCase):
+
+    def setUp(self):
+        self.storage_directory = tempfile.mkdtemp()
+        self.obj = {'slug': 'LB01', 'timestamp': 1700000000.5, 'scheduled': True, 'tags': ['a', None]}
+
+    def tearDown(self):
+        shutil.rmtree(self.storage_directory)
+
+    def _roundtrip(self, codec):
+        storage = Storage(self.storage_directory, codec=codec)
+        token = tokens.generate_token('plan')
+        storage.put(token, self.obj)
+        self.assertEqual(storage.get(token), self.obj)
+        return token
+
+    def test_json_roundtrip(self):
+        """Test that the default codec still writes plain JSON"""
+        token = self._roundtrip('json')
+        with open(Storage(self.storage_directory)._filename_for_id(token)) as f:
+            self.assertEqual(json.load(f), self.obj)
+
+    @unittest.skipUnless('orjson' in serializers.available_codecs(), 'orjson not installed')
+    def test_orjson_roundtrip(self):
+        """Test that orjson objects roundtrip, int keys included"""
+        self._roundtrip('orjson')
+        storage = Storage(self.storage_directory, codec='orjson')
+        token = tokens.generate_token('plan')
+        storage.put(token, {1: 'a'})
+        self.assertEqual(storage.get(token), {'1': 'a'})
+
+    @unittest.skipUnless('msgpack' in serializers.available_codecs(), 'msgpack not installed')
+    def test_files_from_any_codec_are_readable(self):
+        """Test that a store reads files written by every other codec"""
+        written = {codec: self._roundtrip(codec) for codec in serializers.available_codecs()}
+        storage = Storage(self.storage_directory, codec='json')
+        for codec, token in written.items():
+            self.assertEqual(storage.get(token), self.obj, codec)
+        self.assertEqual(storage.count('plan'), len(written))
+
+    def test_missing_library_falls_back_to_json(self):
+        """Test that an uninstalled codec falls back to json"""
+        with patch.dict(serializers._instances, clear=True), \
+                patch.object(serializers.MsgpackCodec, '__init__', side_effect=ImportError):
+            self.assertEqual(serializers.get_codec('msgpack').name, 'json')
+        with self.assertRaises(ValueError):
+            serializers.get_codec('pickle')
+
+    def test_msgpack_files_need_msgpack(self):
+        """Test that reading a msgpack file without msgpack says so, rather than failing as bad JSON"""
+        with patch.object(serializers, '_msgpack_reader', None), \
+                patch.object(serializers.MsgpackCodec, '__init__', side_effect=ImportError):
+            with self.assertRaisesRegex(RuntimeError, 'msgpack codec required'):
+                serializers.decode(b'\x81\xa1a\x01')
+
+    @unittest.skipUnless('msgpack' in serializers.available_codecs(), 'msgpack not installed')
+    def test_msgpack_keys_match_json(self):
+        """Test that msgpack stores non-string keys the way json does"""
+        obj = {1: {None: 'a', True: [{2.5: 'b'}]}}
+        self.assertEqual(serializers.get_codec('msgpack').decode(serializers.get_codec('msgpack').encode(obj)),
+                         json.loads(json.dumps(obj)))
+
+
+class TestReadCache(unittest.TestCase):
+
+    def setUp(self):
+        self.storage_directory = tempfile.mkdtemp()
+        self.storage = Storage(self.storage_directory, cache_bytes=4096)
+        self.token = tokens.generate_token('plan')
+        self.storage.put(self.token, {'LB01': {'slug': 'LB01'}})
+
+    def tearDown(self):
+        shutil.rmtree(self.storage_directory)
+
+    def test_repeat_reads_hit(self):
+        """Test that an unchanged object is decoded once"""
+        with patch('serializers.decode', wraps=serializers.decode) as decode:
+            for _ in range(3):
+                self.assertEqual(self.storage.get(self.token), {'LB01': {'slug': 'LB01'}})
+            self.assertEqual(decode.call_count, 1)
+        self.assertEqual(self.storage.cache_stats()['hits'], 2)
+        self.assertEqual(self.storage.cache_stats()['misses'], 1)
+
+    def test_writes_from_elsewhere_invalidate(self):
+        """Test that a write by another process is seen on the next read"""
+        self.storage.get(self.token)
+        Storage(self.storage_directory, cache_bytes=0).put(self.token, {'LB02': {}})
+        self.assertEqual(self.storage.get(self.token), {'LB02': {}})
+
+    def test_callers_get_copies(self):
+        """Test that mutating a returned object leaves the cache intact"""
+        self.storage.get(self.token)['LB01']['checked'] = 'checked'
+        self.storage.get(self.token)['LB01']['checked'] = 'checked'
+        self.assertEqual(self.storage.get(self.token), {'LB01': {'slug': 'LB01'}})
+
+    def test_memory_bound_evicts_least_recently_used(self):
+        """Test that the cache stays within its byte budget"""
+        ids = [tokens.generate_token('book') for _ in range(40)]
+        for _id in ids:
+            self.storage.put(_id, {'body': 'x' * 200})
+            self.storage.get(_id)
+        stats = self.storage.cache_stats()
+        self.assertLessEqual(stats['bytes'], 4096)
+        self.assertLess(stats['entries'], 40)
+        misses = stats['misses']
+        self.storage.get(ids[-1])
+        self.assertEqual(self.storage.cache_stats()['misses'], misses)
+        self.storage.get(ids[0])
+        self.assertEqual(self.storage.cache_stats()['misses'], misses + 1)
+
+    def test_disabled(self):
+        """Test that cache_bytes=0 reads from disk every time"""
+        storage = Storage(self.storage_directory, cache_bytes=0)
+        storage.get(self.token)
+        storage.get(self.token)
+        self.assertEqual(storage.cache_stats(), {'hits': 0, 'misses': 0, 'entries': 0, 'bytes': 0})
@@ -3,8 +3,48 @@ Unit tests for timestamp parsing in client.py
 """
 import unittest
 import datetime
+import random
+import re
 import pytz
-from client import _extract_timestamp_from_title
+from client import _extract_timestamp_from_title, _extract_timestamps_from_titles
+
+
+def _reference_timestamp(title):
+    """The parser before it was precompiled and memoized, to check the fast one against."""
+    pacific = pytz.timezone('America/Los_Angeles')
+    tstr = title.split("|")[-1]
+    tstr = re.compile("-[0-9]+:[0-9]{2}[ap]m").sub('', tstr).strip()
+    tstr = re.compile(r'([0-9]{1,2}:[0-9]{2}[ap]m)\s+.*?\s+on').sub(r'\1 on', tstr)
+    naive_dt = datetime.datetime.strptime(tstr, '%A %I:%M%p on %m/%d/%Y')
+    return int(pacific.localize(naive_dt).timestamp())
+
+
+def _random_title(rng):
+    def pick(valid, invalid):
+        # mostly well-formed, so both parsed and refused titles are well covered
+        return rng.choice(valid) if rng.random() < 0.9 else rng.choice(invalid)
+
+    hour = rng.randint(1, 12)
+    day = pick(['Monday', 'Thursday', 'sunday', 'SATURDAY', 'Thu'], ['Funday', 'Mon day'])
+    hour = pick([str(hour), f"{hour:02d}"], ['0', '13', '012'])
+    minute = pick(['00', '45', '59', f"{rng.randint(0, 59):02d}"], ['60', '5'])
+    ampm = pick(['am', 'pm', 'AM', 'Pm'], ['xm', ''])
+    time_range = rng.choice(['', '', f"-{rng.randint(1, 12)}:15pm", '-11:45AM'])
+    extra = rng.choice(['', '', ' 90 MINUTE EDITION!', ' SPECIAL CLASS', ' on'])
+    on = pick([' on ', '  on ', ' ON '], [' at ', 'on '])
+    # March and November cover the daylight saving switches
+    month = pick([str(rng.randint(1, 12)), f"{rng.randint(1, 12):02d}", '3', '11'], ['0', '13'])
+    dom = pick([str(rng.randint(1, 28)), f"{rng.randint(1, 9):02d}", '29', '30', '31'], ['32', '00'])
+    year = pick(['2024', '2025', '2026'], ['25'])
+    prefix = rng.choice(['', 'LB01 | ', 'LB01 | Live Ball | '])
+    return f"{prefix}{day} {hour}:{minute}{ampm}{time_range}{extra}{on}{month}/{dom}/{year}"
+
+
+def _outcome(parse, title):
+    try:
+        return parse(title)
+    except ValueError:
+        return ValueError
 
 
 class TestTimestampParsing(unittest.TestCase):
@@ -75,6 +115,28 @@ class TestTimestampParsing(unittest.TestCase):
         # All timestamps should be equal
         self.assertEqual(len(set(timestamps)), 1)
 
+    def test_matches_reference_parser(self):
+        """Test that random titles, valid or not, parse (or fail) exactly as the original parser did"""
+        rng = random.Random(49)
+        titles = [_random_title(rng) for _ in range(5000)]
+        titles += [f"Sunday {h}:{m:02d}{p} on {mo}/{d}/2025" for h in range(1, 13) for m in (0, 30)
+                   for p in ('am', 'pm') for mo, d in ((3, 9), (11, 2))]
+        parsed = 0
+        for title in titles:
+            expected = _outcome(_reference_timestamp, title)
+            self.assertEqual(_outcome(_extract_timestamp_from_title, title), expected, title)
+            parsed += expected is not ValueError
+        # the generator makes enough titles of each kind to be a real check
+        self.assertGreater(parsed, 500)
+        self.assertGreater(len(titles) - parsed, 500)
+
+    def test_batch(self):
+        """Test that a page's titles are converted in order, repeats included"""
+        titles = ['Thursday 10:45am on 10/30/2025', 'Monday 9:00am SPECIAL CLASS on 11/03/2025',
+                  'LB01 | Thursday 10:45am on 10/30/2025']
+        self.assertEqual(_extract_timestamps_from_titles(titles), [_reference_timestamp(t) for t in titles])
+        self.assertEqual(_extract_timestamps_from_titles([]), [])
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,179 @@
+"""
+Unit tests for watcher.py
+"""
+import os
+import unittest
+from unittest.mock import Mock, patch
+
+import client
+import metrics
+import tokens
+from members import Member
+from memory_storage import MemoryStorage
+from plans import merge_plans
+from watcher import REFRESH_INTERVAL, RequestBudget, Watcher, button_state, is_open, poll_interval
+
+HOUR = 60 * 60
+
+
+def _page(schedule_id, kind, text):
+    return f'<html><button class="btn {kind}" data-schedule-id="{schedule_id}">{text}</button></html>'
+
+
+FULL = _page('1400001', 'register-button-closed', 'Full')
+OPEN = _page('1400001', 'register-button-now', 'Register')
+
+
+class Clock(object):
+    def __init__(self, now=1_000_000.0):
+        self.now = now
+        self.slept = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+
+class FakeClient(object):
+    def __init__(self, clock, pages, result=None):
+        self.clock = clock
+        self.pages = list(pages)
+        self.result = result or {'status': 1, 'message': 'Registered'}
+        self.polled_at = []
+        self.registered = []
+
+    @property
+    def polls(self):
+        return len(self.polled_at)
+
+    def event_info(self, event_id):
+        self.polled_at.append(self.clock())
+        return self.pages.pop(0) if len(self.pages) > 1 else self.pages[0]
+
+    def register_for_instance(self, clazz, attempts=90):
+        self.registered.append(clazz['schedule_id'])
+        return self.result
+
+
+class TestPolling(unittest.TestCase):
+
+    def test_poll_interval(self):
+        """Test that classes are polled faster as they near and slower while nothing changes"""
+        self.assertLess(poll_interval(2 * HOUR, 0), poll_interval(20 * HOUR, 0))
+        self.assertLess(poll_interval(10 * HOUR, 0), poll_interval(10 * HOUR, 2))
+        self.assertEqual(poll_interval(10 * HOUR, 50), poll_interval(10 * HOUR, 10))
+        self.assertEqual(poll_interval(60, 0), 60)
+        self.assertEqual(poll_interval(30 * 24 * HOUR, 0), 30 * 60)
+
+    def test_button_state(self):
+        """Test that the planned instance's button is found and an open one recognised"""
+        self.assertEqual(button_state(FULL, '1400001'), 'register-button-closed:Full')
+        self.assertFalse(is_open(button_state(FULL, '1400001')))
+        self.assertTrue(is_open(button_state(OPEN, '1400001')))
+        self.assertIsNone(button_state(OPEN, '1400002'))
+
+    def test_request_budget(self):
+        """Test that the budget allows a burst, then refills at its hourly rate"""
+        clock = Clock()
+        budget = RequestBudget(24, clock=clock)
+        self.assertEqual([budget.take() for _ in range(3)], [True, True, False])
+        self.assertAlmostEqual(budget.wait_time(), 150)
+        clock.now += 150
+        self.assertTrue(budget.take())
+
+
+class TestWatcher(unittest.TestCase):
+
+    def setUp(self):
+        self.storage = MemoryStorage()
+        self.clock = Clock()
+        metrics.registry.drain()
+        self.addCleanup(metrics.registry.drain)
+        self.plan_id = tokens.generate_token('plan')
+        self.storage.put(self.plan_id, {
+            'LB01': {'slug': 'LB01', 'schedule_id': '1400001', 'event_id': '900001',
+                     'timestamp': self.clock.now + 10 * HOUR, 'failed': True, 'failure': 'full'},
+            'LB02': {'slug': 'LB02', 'schedule_id': '1400002', 'event_id': '900002',
+                     'timestamp': self.clock.now + 10 * HOUR, 'scheduled': True},
+            'LB03': {'slug': 'LB03', 'schedule_id': '1400003', 'event_id': '900003',
+                     'timestamp': self.clock.now + 10 * HOUR, 'failed': True, 'failure': 'payment'},
+        })
+
+    def _watcher(self, fake, per_hour=1000):
+        return Watcher(self.storage, RequestBudget(per_hour, clock=self.clock), make_client=lambda member: fake,
+                       clock=self.clock, sleep=self.clock.sleep)
+
+    def test_books_when_a_spot_opens(self):
+        """Test that only classes that were full are watched, backing off until the button opens"""
+        fake = FakeClient(self.clock, [FULL, FULL, FULL, OPEN])
+        watcher = self._watcher(fake)
+        watcher.refresh()
+        self.assertEqual([w.key for w in watcher.watches], [('', '1400001')])
+
+        while watcher.watches:
+            watcher.step()
+        self.assertEqual(fake.polls, 4)
+        self.assertEqual(fake.registered, ['1400001'])
+        booked = self.storage.get(self.plan_id)['LB01']
+        self.assertTrue(booked['scheduled'])
+        self.assertNotIn('failed', booked)
+        self.assertNotIn('failure', booked)
+        # the pause between polls grew while the class stayed full
+        gaps = [b - a for a, b in zip(fake.polled_at, fake.polled_at[1:])]
+        self.assertLess(gaps[0], gaps[1])
+        self.assertLess(gaps[1], gaps[2])
+        polls = metrics.flush(self.storage)['counters']['waitlist_polls_total']
+        self.assertEqual(polls, {'outcome="changed"': 1, 'outcome="unchanged"': 2, 'outcome="open"': 1})
+
+    def test_keeps_watching_after_losing_the_spot(self):
+        """Test that a spot someone else got first doesn't end the watch"""
+        fake = FakeClient(self.clock, [OPEN], result={'status': -1, 'message': 'maximum number of participants'})
+        watcher = self._watcher(fake)
+        watcher.refresh()
+        watcher.poll(watcher.watches[0])
+        self.assertEqual(len(watcher.watches), 1)
+        self.assertNotIn('scheduled', self.storage.get(self.plan_id)['LB01'])
+
+    def test_booking_clears_failure_in_merges(self):
+        """Test that a booking merged with a concurrent edit still wins over the earlier failure"""
+        base = self.storage.get(self.plan_id)
+        ours = {slug: dict(c) for slug, c in base.items()}
+        ours['LB01'].update(scheduled=True)
+        del ours['LB01']['failed'], ours['LB01']['failure']
+        theirs = dict(base, LB04={'slug': 'LB04'})
+        merged = merge_plans(base, ours, theirs)
+        self.assertTrue(merged['LB01']['scheduled'])
+        self.assertNotIn('failed', merged['LB01'])
+        self.assertIn('LB04', merged)
+
+    def test_budget_limits_polls(self):
+        """Test that polls wait for the request budget when it runs out"""
+        fake = FakeClient(self.clock, [FULL])
+        watcher = self._watcher(fake, per_hour=12)
+        start = self.clock.now
+        while self.clock.now < start + REFRESH_INTERVAL * 3:
+            watcher.step()
+        # one burst token, then one per five minutes
+        self.assertLessEqual(fake.polls, 1 + 3 * REFRESH_INTERVAL / 300)
+
+
+class TestSignedOut(unittest.TestCase):
+
+    def test_event_info_signs_in_again(self):
+        """Test that a client the club signed out signs in again and retries"""
+        signed_out = Mock(text='<form><input type="hidden" id="login_token" value="x"></form>')
+        with patch.dict(os.environ, {'ANA_PASSWORD': 'secret'}), \
+                patch.object(client, 'sign_in') as sign_in:
+            watcher_client = client.Client(member=Member('ana', 'Ana', 'ana@example.com', password_env='ANA_PASSWORD'))
+            watcher_client._session = Mock()
+            watcher_client._session.get.side_effect = [Mock(text=FULL), signed_out, Mock(text=OPEN)]
+            self.assertEqual(watcher_client.event_info('900001'), FULL)
+            self.assertEqual(watcher_client.event_info('900001'), OPEN)
+        self.assertEqual(sign_in.call_count, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,252 @@
+"""
+Waitlist watcher: books spots that open up in classes that were full.
+
+cronv2.py gives up on a class the club says is full and marks it `failed`,
+with `failure` 'full'. (A class that needs payment fails too, but waiting
+won't change that, so it isn't watched.) The watcher keeps polling the
+event-info page of every such class, for every member, until the planned
+instance shows a `register-button-now`, then registers right away through
+the fast-register path (or the cart, if the club asks for payment), and
+marks the class booked instead of failed.
+
+A class is polled more often the closer it is, and less often the longer its
+button doesn't change. All polls draw from one hourly request budget, spent on
+whichever class is most overdue, so watching many classes costs no more than
+watching a few.
+
+    python3 watcher.py [--budget 120] [--once]
+"""
+import argparse
+import copy
+import heapq
+import logging
+import time
+from typing import Callable, Dict, List, Tuple, Union
+
+from bs4 import BeautifulSoup
+
+import client
+import metrics
+from members import Member, load_members
+from plans import merge_onto
+from storage import Storage, open_storage
+
+MIN_INTERVAL = 60
+MAX_INTERVAL = 30 * 60
+# a class is polled every 1/PROXIMITY of the time left until it starts
+PROXIMITY = 50
+# each poll that finds nothing new stretches the interval, up to MAX_BACKOFF times
+BACKOFF = 1.5
+MAX_BACKOFF = 4
+REQUESTS_PER_HOUR = 120
+# how often plans are re-read for classes to start or stop watching
+REFRESH_INTERVAL = 10 * 60
+
+
+def poll_interval(seconds_to_class: float, unchanged_polls: int) -> float:
+    base = seconds_to_class / PROXIMITY
+    backoff = min(BACKOFF ** unchanged_polls, MAX_BACKOFF)
+    return min(MAX_INTERVAL, max(MIN_INTERVAL, base * backoff))
+
+
+def button_state(html: str, schedule_id: str) -> Union[str, None]:
+    """The register button of one class instance, e.g. 'register-button-closed:Full'."""
+    soup = BeautifulSoup(html, 'html.parser')
+    button = soup.find(attrs={'data-schedule-id': schedule_id})
+    if button is None:
+        return None
+    kind = next((c for c in button.get('class', []) if c.startswith('register-button')), '')
+    return f"{kind}:{button.get_text(strip=True)}"
+
+
+def is_open(state: Union[str, None]) -> bool:
+    return state is not None and state.startswith('register-button-now:')
+
+
+class RequestBudget(object):
+    """Token bucket: `per_hour` requests an hour, in bursts of up to five minutes' worth."""
+
+    def __init__(self, per_hour: float, clock: Callable[[], float] = time.time):
+        self.rate = per_hour / 3600.0
+        self.capacity = max(1.0, per_hour / 12.0)
+        self._tokens = self.capacity
+        self._clock = clock
+        self._updated = clock()
+
+    def _refill(self) -> None:
+        now = self._clock()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def take(self) -> bool:
+        self._refill()
+        if self._tokens < 1:
+            return False
+        self._tokens -= 1
+        return True
+
+    def wait_time(self) -> float:
+        """Seconds until take() can succeed."""
+        self._refill()
+        return 0.0 if self._tokens >= 1 else (1 - self._tokens) / self.rate
+
+
+class Watch(object):
+    def __init__(self, member: Member, plan_id: str, clazz: dict, next_poll: float):
+        self.member = member
+        self.plan_id = plan_id
+        self.clazz = clazz
+        self.next_poll = next_poll
+        self.unchanged = 0
+        self.state = None
+
+    @property
+    def key(self) -> Tuple[str, str]:
+        return self.member.slug, self.clazz['schedule_id']
+
+
+def find_watches(storage: Storage, now: float) -> List[Tuple[Member, str, dict]]:
+    """(member, plan id, class) of every upcoming class that failed to book because it was full."""
+    found = []
+    for member in load_members(storage):
+        plan_id = storage.head(member.plan_type)
+        plan = storage.get(plan_id) if plan_id else None
+        for clazz in (plan or {}).values():
+            if clazz.get('failure') == client.FULL and not clazz.get('scheduled') and clazz['timestamp'] > now:
+                found.append((member, plan_id, clazz))
+    return found
+
+
+class Watcher(object):
+    def __init__(self, storage: Storage, budget: RequestBudget, make_client: Callable = None,
+                 clock: Callable[[], float] = time.time, sleep: Callable[[float], None] = time.sleep):
+        self._storage = storage
+        self._budget = budget
+        self._clock = clock
+        self._sleep = sleep
+        self._watches: Dict[Tuple[str, str], Watch] = {}
+        self._clients = {}
+        self._adapter = None
+        self._make_client = make_client or self._pooled_client
+        self._refreshed = None
+
+    def _pooled_client(self, member: Member):
+        if self._adapter is None:
+            self._adapter = client.pooled_adapter(4)
+        return client.Client(member=member, adapter=self._adapter)
+
+    def _client(self, member: Member):
+        if member.slug not in self._clients:
+            self._clients[member.slug] = self._make_client(member)
+        return self._clients[member.slug]
+
+    @property
+    def watches(self) -> List[Watch]:
+        return sorted(self._watches.values(), key=lambda w: w.next_poll)
+
+    def refresh(self) -> None:
+        """Start watching newly failed classes, stop watching booked, removed or past ones."""
+        now = self._clock()
+        current = {}
+        for member, plan_id, clazz in find_watches(self._storage, now):
+            watch = self._watches.get((member.slug, clazz['schedule_id']))
+            if watch is None:
+                watch = Watch(member, plan_id, clazz, next_poll=now)
+            watch.plan_id, watch.clazz = plan_id, clazz
+            current[watch.key] = watch
+        self._watches = current
+        self._refreshed = now
+        metrics.flush(self._storage)
+
+    def step(self) -> None:
+        """Poll the most overdue class, or sleep until one is due and the budget allows it."""
+        now = self._clock()
+        if self._refreshed is None or now - self._refreshed >= REFRESH_INTERVAL:
+            self.refresh()
+        next_refresh = self._refreshed + REFRESH_INTERVAL
+        due = heapq.nsmallest(1, self._watches.values(), key=lambda w: w.next_poll)
+        if not due or due[0].next_poll > now:
+            wake = min(due[0].next_poll, next_refresh) if due else next_refresh
+            self._sleep(max(0.0, wake - now))
+            return
+        if not self._budget.take():
+            self._sleep(min(self._budget.wait_time(), max(0.0, next_refresh - now)))
+            return
+        self.poll(due[0])
+
+    def poll(self, watch: Watch) -> None:
+        clazz = watch.clazz
+        try:
+            state = button_state(self._client(watch.member).event_info(clazz['event_id']), clazz['schedule_id'])
+        except Exception:
+            logging.exception(f"Polling {clazz['slug']} for {watch.member.name} failed")
+            metrics.inc('waitlist_polls_total', outcome='error')
+            state = watch.state
+
+        if is_open(state):
+            metrics.inc('waitlist_polls_total', outcome='open')
+            if self.book(watch):
+                return
+            watch.unchanged = 0
+        elif state == watch.state:
+            metrics.inc('waitlist_polls_total', outcome='unchanged')
+            watch.unchanged += 1
+        else:
+            metrics.inc('waitlist_polls_total', outcome='changed')
+            watch.unchanged = 0
+        watch.state = state
+        now = self._clock()
+        watch.next_poll = now + poll_interval(clazz['timestamp'] - now, watch.unchanged)
+
+    def book(self, watch: Watch) -> bool:
+        """Register right away; True if the spot was ours."""
+        clazz = watch.clazz
+        with metrics.span('waitlist_register'):
+            result = self._client(watch.member).register_for_instance(clazz, attempts=1)
+        if not client.successful_registration_response(result):
+            logging.info(f"Missed the open spot in {clazz['slug']} for {watch.member.name}: {result.get('message')}")
+            metrics.inc('booking_outcomes_total', outcome='waitlist_missed')
+            return False
+
+        metrics.inc('booking_outcomes_total', outcome='waitlist_booked')
+        plan, version = self._storage.get_versioned(watch.plan_id)
+        if plan is not None:
+            base = copy.deepcopy(plan)
+            entry = plan.setdefault(clazz['slug'], copy.deepcopy(clazz))
+            entry['scheduled'] = True
+            entry.pop('failed', None)
+            entry.pop('failure', None)
+            self._storage.put(watch.plan_id, plan, expected_version=version, merge=merge_onto(base))
+        del self._watches[watch.key]
+        return True
+
+    def run(self, until: float = None) -> None:
+        while until is None or self._clock() < until:
+            self.step()
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description='Book spots that open up in full classes')
+    parser.add_argument('--budget', type=float, default=REQUESTS_PER_HOUR, help='event info requests per hour')
+    parser.add_argument('--once', action='store_true', help='poll every watched class once and exit')
+    opts = parser.parse_args(args)
+
+    logging.basicConfig(
+        format='[%(asctime)s][%(levelname)-0s] %(message)s',
+        level=logging.INFO,
+        datefmt='%Y-%m-%d %H:%M:%S')
+    storage = open_storage('storage')
+    watcher = Watcher(storage, RequestBudget(opts.budget))
+    try:
+        if opts.once:
+            watcher.refresh()
+            for watch in watcher.watches:
+                watcher.poll(watch)
+        else:
+            watcher.run()
+    finally:
+        metrics.flush(storage)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,18 +1,70 @@
+import os
 import sys
+import threading
 
-from bottle import run, get, post, abort, request, redirect, install
+from bottle import run, get, post, route, abort, request, response, redirect, install
 from pybars import Compiler
 
 import cal
-from storage import Storage
+import events
+import jobs
+import metrics
+import profiling
+from bookings import booking_index
+from members import Member, load_members
+from plans import merge_onto
+from storage import Storage, ABSENT, open_storage
 from tokens import swap_prefix
 from auth_middleware import basic_auth_plugin, logout_route
+from server import parse_args, run_options
 
 # Protect all routes with authentication
 install(basic_auth_plugin)
+# a no-op unless PROFILE is set
+install(profiling.ProfilingPlugin(lambda: storage))
 
 compiler = Compiler()
-storage = Storage('storage')
+storage = open_storage('storage')
+
+# serializes plan read-modify-write cycles between request threads of one
+# process; across gunicorn workers only the CAS puts keep plans consistent
+_plan_lock = threading.Lock()
+_template_lock = threading.Lock()
+_template_cache = {}
+plan_status_feeds = events.PlanStatusFeeds(storage)
+
+
+def load_template(filename='template.html'):
+    """
+    Compile a template once and reuse it until the file changes on disk.
+    Compilation is the expensive part of rendering and isn't safe to run
+    from several request threads at once.
+    """
+    mtime = os.path.getmtime(filename)
+    with _template_lock:
+        cached = _template_cache.get(filename)
+        if cached and cached[0] == mtime:
+            return cached[1]
+        with open(filename, 'r') as f, profiling.span('template_compile'):
+            template = compiler.compile(f.read())
+        _template_cache[filename] = (mtime, template)
+        return template
+
+
+def request_member() -> Member:
+    """
+    The member a page or API call is for, from ?member=<slug>; without it
+    the default member, whose plans are the plain `plan` type.
+    """
+    slug = request.query.get('member', '')
+    member = next((m for m in load_members(storage) if m.slug == slug), None)
+    if member is None:
+        abort(404, f"No member {slug}")
+    return member
+
+
+def _member_query(member: Member) -> str:
+    return f"?member={member.slug}" if member.slug else ''
 
 
 def update_table_contents(schedule):
@@ -22,10 +74,12 @@ def update_table_contents(schedule):
         row['class_date'] = parts[2]
 
 
-def mark_bookings(plan, s: Storage = storage):
+@profiling.timed()
+def mark_bookings(plan, s: Storage = None, book_type: str = 'book'):
+    # looked up per call, so swapping web.storage (as tests do) is honoured
+    booked = booking_index(s or storage, book_type)
     for row in plan.values():
-        _, booking = s.latest('book', {'scheduled_id': row['schedule_id']})
-        if booking:
+        if row['schedule_id'] in booked:
             row['scheduled'] = True
 
 
@@ -45,17 +99,63 @@ def update_schedule_from_plan(schedule, plan):
 @get('/schedule')
 @get('/schedule/<schedule_id>')
 def serve_schedule(schedule_id=None):
-    if not schedule_id:
-        schedule_id, schedule = storage.latest('sched')
-    else:
-        schedule = storage.get(schedule_id)
-    if schedule == None:
+    member = request_member()
+    with profiling.span('storage'):
+        if not schedule_id:
+            schedule_id, schedule = storage.latest('sched')
+        else:
+            schedule = storage.get(schedule_id)
+        if schedule == None:
+            return abort(404)
+
+        plan_id = swap_prefix(schedule_id, member.plan_type)
+        plan = storage.get(plan_id) or {}
+
+    return render_response(plan, schedule, schedule_id, job_id=request.query.get('job'), member=member)
+
+
+@get('/jobs/<job_id>', skip=['profiling'])
+def job_status(job_id):
+    job = jobs.status(storage, job_id)
+    if job is None:
         return abort(404)
+    return job
+
+
+@get('/events', skip=['profiling'])
+def event_stream():
+    """
+    Server-sent events with the booking status of each class in the plan,
+    the ?member=<slug>'s as on the plan routes. Every open stream holds a
+    server thread, so only events.MAX_STREAMS are served at once (see
+    events.py).
+    """
+    feed, q = plan_status_feeds.subscribe(request_member().plan_type, limit=events.MAX_STREAMS)
+    if q is None:
+        response.set_header('Retry-After', '30')
+        return abort(503, 'Too many open event streams, try again later.')
+    response.content_type = 'text/event-stream'
+    response.set_header('Cache-Control', 'no-cache')
+    # tell nginx not to buffer the stream
+    response.set_header('X-Accel-Buffering', 'no')
+    # bottle starts the generator right away, so its finally always unsubscribes
+    return events.stream(feed, q)
+
 
-    plan_id = swap_prefix(schedule_id, "plan")
-    plan = storage.get(plan_id) or {}
+@get('/health', skip=['basic_auth', 'profiling'])
+def health():
+    return "ok"
 
-    return render_response(plan, schedule, schedule_id)
+
+@get('/metrics', skip=['profiling'])
+def serve_metrics():
+    """Booking metrics from every process, in the Prometheus text format."""
+    cache = storage.cache_stats()
+    response.content_type = 'text/plain; version=0.0.4'
+    return metrics.render(metrics.flush(storage), [
+        ('storage_cache_hits_total', 'Reads served from the web process object cache.', cache['hits']),
+        ('storage_cache_misses_total', 'Reads the web process decoded from disk.', cache['misses']),
+    ])
 
 
 @get('/logout')
@@ -66,7 +166,7 @@ def logout():
 
 @post('/plan/<schedule_id>')
 def create_plan(schedule_id):
-
+    member = request_member()
     schedule = storage.get(schedule_id)
     if not schedule:
         return abort(404)
@@ -75,28 +175,107 @@ def create_plan(schedule_id):
     # the prior week's plan. As such, latest plan should always
     # match the latest schedule, and modifications to different plans
     # will not be followed.
-    plan_id = swap_prefix(schedule_id, "plan")
-    latest_plan_id, previous_plan = storage.latest("plan")
-    if latest_plan_id and plan_id != latest_plan_id:
-        return abort(400, "Trying to modify a plan that is not based on the most recent schedule. "
-                          "Start over <a href='/schedule'>here</a>.")
-    plan = {}
+    plan_id = swap_prefix(schedule_id, member.plan_type)
+    with _plan_lock:
+        latest_plan_id = storage.head(member.plan_type)
+        if latest_plan_id and plan_id != latest_plan_id:
+            return abort(400, "Trying to modify a plan that is not based on the most recent schedule. "
+                              f"Start over <a href='/schedule{_member_query(member)}'>here</a>.")
+        previous_plan, version = storage.get_versioned(plan_id)
+        previous_plan = previous_plan or {}
+        plan = {}
 
-    for class_ in schedule:
-        slug = class_['slug']
-        checked = str(request.forms.get(slug, 'off')) == 'on'
-        if checked:
-            plan[slug] = class_
-    mark_bookings(plan)
-    cal.update_calendar_to_new_plan(storage, previous_plan, plan)
-    storage.put(plan_id, plan)
+        for class_ in schedule:
+            slug = class_['slug']
+            checked = str(request.forms.get(slug, 'off')) == 'on'
+            if checked:
+                plan[slug] = class_
+        mark_bookings(plan, storage, member.book_type)
+        # cronv2.py may be marking bookings in this plan right now
+        storage.put(plan_id, plan, expected_version=version or ABSENT, merge=merge_onto(previous_plan))
+        # one Google API round trip per changed class, don't make the user wait on it
+        job_id = jobs.submit(storage, 'update_calendar', cal.update_calendar_to_new_plan,
+                             storage, previous_plan, plan, member.calendar(), member)
+
+    member_param = f"&member={member.slug}" if member.slug else ''
+    return redirect(f"{request.urlparts[0]}://{request.get_header('host')}/schedule?job={job_id}{member_param}")
+
+
+@get('/api/schedule/<schedule_id>')
+def api_schedule(schedule_id):
+    member = request_member()
+    schedule = storage.get(schedule_id)
+    if schedule is None:
+        return abort(404)
+    plan = storage.get(swap_prefix(schedule_id, member.plan_type)) or {}
+    update_schedule_from_plan(schedule, plan)
+    return {'schedule_id': schedule_id, 'classes': schedule}
+
+
+@get('/api/plan/<schedule_id>')
+def api_plan(schedule_id):
+    plan_id = swap_prefix(schedule_id, request_member().plan_type)
+    plan = storage.get(plan_id)
+    if plan is None:
+        return abort(404)
+    return {'plan_id': plan_id, 'classes': plan}
+
+
+@route('/api/plan/<schedule_id>/<slug>', method='PATCH')
+def api_toggle_class(schedule_id, slug):
+    """
+    Add a class to, or drop it from, the plan: {"checked": true|false}.
+    Only that entry is touched, in storage and on the calendar.
+    ?member=<slug> picks whose plan, as on every plan route.
+    """
+    body = request.json
+    if not isinstance(body, dict) or not isinstance(body.get('checked'), bool):
+        return abort(400, 'Expected a JSON body like {"checked": true}.')
+    checked = body['checked']
+    member = request_member()
+
+    schedule = storage.get(schedule_id)
+    if not schedule:
+        return abort(404)
+    class_ = next((c for c in schedule if c['slug'] == slug), None)
+    if class_ is None:
+        return abort(404)
+
+    plan_id = swap_prefix(schedule_id, member.plan_type)
+    job_id = None
+    with _plan_lock:
+        latest_plan_id = storage.head(member.plan_type)
+        if latest_plan_id and plan_id != latest_plan_id:
+            return abort(400, "Trying to modify a plan that is not based on the most recent schedule.")
+        plan, version = storage.get_versioned(plan_id)
+        plan = plan or {}
+        base = dict(plan)
+        previous = plan.get(slug)
+
+        if checked != (previous is not None):
+            if checked:
+                plan[slug] = class_
+                mark_bookings({slug: class_}, storage, member.book_type)
+            else:
+                del plan[slug]
+            storage.put(plan_id, plan, expected_version=version or ABSENT, merge=merge_onto(base))
+            job_id = jobs.submit(storage, 'update_calendar', cal.update_calendar_to_new_plan, storage,
+                                 {slug: previous} if previous else {},
+                                 {slug: class_} if checked else {}, member.calendar(), member)
 
-    return redirect(f"{request.urlparts[0]}://{request.get_header('host')}/schedule")
+    entry = plan.get(slug, {})
+    return {
+        'slug': slug,
+        'checked': checked,
+        'scheduled': entry.get('scheduled', False),
+        'failed': entry.get('failed', False),
+        'num_selected': len(plan),
+        'job_id': job_id
+    }
 
 
-def render_response(plan, schedule, schedule_id):
-    source = open('template.html', 'r').read()
-    template = compiler.compile(source)
+def render_response(plan, schedule, schedule_id, job_id=None, member: Member = None):
+    template = load_template()
     update_schedule_from_plan(schedule, plan)
     update_table_contents(schedule)
     
@@ -105,17 +284,27 @@ def render_response(plan, schedule, schedule_id):
     num_selected = len(plan)
     weekly_total = f"{num_selected * CLASS_COST:.2f}"
     
-    return template({
-        'schedule': schedule,
-        'schedule_id': schedule_id,
-        'weekly_total': weekly_total,
-        'num_selected': num_selected
-    })
+    with profiling.span('render'):
+        return template({
+            'schedule': schedule,
+            'schedule_id': schedule_id,
+            'weekly_total': weekly_total,
+            'num_selected': num_selected,
+            'job_id': job_id or '',
+            'member_query': _member_query(member) if member else '',
+            'plan_id': swap_prefix(schedule_id, member.plan_type if member else 'plan')
+        })
 
 
 def main(args=sys.argv):
-    port = int(args[1])
-    run(host='0.0.0.0', port=port)
+    # nothing runs the jobs an earlier server process left unfinished
+    jobs.fail_orphaned(storage)
+    # head() trusts refs, catch them up with anything written without advancing them
+    storage.repair_refs()
+    opts = parse_args(args)
+    # leave most threads for page loads and saves
+    events.MAX_STREAMS = max(1, opts.threads // 2)
+    run(**run_options(opts))
 
 
 if __name__ == "__main__":